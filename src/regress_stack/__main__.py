@@ -1,21 +1,61 @@
 import argparse
+import dataclasses
+import functools
+import json
 import logging
+import os
 import pathlib
-import subprocess
+import sys
 import typing
 from pprint import pprint
 
-import regress_stack.modules
-from regress_stack.core import utils
-from regress_stack.core.modules import get_execution_order, modules
-from regress_stack.modules import keystone
-from regress_stack.modules import utils as module_utils
+from regress_stack.core import (
+    agent,
+    firewall,
+    report,
+    resources,
+    sizing,
+    tempest,
+    utils,
+)
+from regress_stack.core import bench as core_bench
+
+if typing.TYPE_CHECKING:
+    from regress_stack.core.modules import ModuleComp
+    from regress_stack.core.plan import ExecutionPlan
 
 LOG = logging.getLogger(__name__)
 
+RESOURCES_DIR = utils.REGRESS_STACK_DIR / "resources"
+TEMPEST_WORKSPACE = "mycloud01"
+
+
+def execution_plan(from_saved: bool = False) -> "ExecutionPlan":
+    # The planner, networkx and the modules are only loaded by the
+    # commands needing them, keeping --help and agent clients fast.
+    import regress_stack.modules
+    from regress_stack.core.plan import get_plan
+
+    return get_plan(regress_stack.modules, from_saved=from_saved)
+
 
-def plan(target: typing.Optional[str]):
-    order = get_execution_order(regress_stack.modules, target)
+def sample_resources(
+    execution: "ExecutionPlan",
+    mods: typing.Iterable["ModuleComp"],
+    name: str,
+    interval: float,
+):
+    """Sample the resource usage of the services of mods while in context."""
+    return resources.sampling(
+        (pattern for mod in mods for pattern in execution.metadata[mod.name].services),
+        RESOURCES_DIR,
+        name,
+        interval,
+    )
+
+
+def plan(targets: typing.Sequence[str] = ()):
+    order = execution_plan().order(targets)
     print(
         "Execution Order:",
     )
@@ -23,17 +63,72 @@ def plan(target: typing.Optional[str]):
 
 
 @utils.measure_time
-def setup(target: str):
+def setup(targets: typing.Sequence[str] = (), sample_interval: float = 0):
+    execution = execution_plan()
     try:
-        for mod in get_execution_order(regress_stack.modules, target):
-            if setup := getattr(mod.module, "setup", None):
-                with utils.measure("setup " + mod.name):
-                    setup()
-                    utils.mark_setup(mod.name)
+        order = execution.order(targets)
+        with sample_resources(execution, order, "setup", sample_interval):
+            for mod in order:
+                if "setup" in mod.metadata.hooks:
+                    with utils.measure("setup " + mod.name):
+                        mod.module.setup()
+                        execution.mark_setup(mod.name)
+            with utils.measure("firewall"):
+                firewall.reconcile(
+                    rule
+                    for mod in order
+                    if "nat_rules" in mod.metadata.hooks
+                    for rule in mod.module.nat_rules()
+                )
     except Exception as e:
-        LOG.error("Failed to setup %s: %s", target, e)
+        LOG.error("Failed to setup %s: %s", ", ".join(targets) or "all", e)
         collect_logs()
         raise
+    finally:
+        execution.save()
+
+
+@utils.measure_time
+def reset(targets: typing.Sequence[str] = ()):
+    """Undo the setup of targets and of the modules depending on them.
+
+    Modules depending on others are torn down first.
+    """
+    from regress_stack.core.modules import run_in_dependency_order
+    from regress_stack.core.plan import forget_green_run
+
+    execution = execution_plan(from_saved=True)
+    order = execution.reset_order(targets)
+
+    def teardown(mod):
+        with utils.measure("teardown " + mod.name):
+            mod.module.teardown()
+        execution.clear_setup(mod.name)
+
+    try:
+        with utils.measure("teardown"):
+            run_in_dependency_order(
+                execution.graph,
+                [mod for mod in order if "teardown" in mod.metadata.hooks],
+                teardown,
+                reverse=True,
+            )
+        with utils.measure("firewall"):
+            firewall.remove(
+                rule
+                for mod in order
+                if "nat_rules" in mod.metadata.hooks
+                for rule in mod.module.nat_rules()
+            )
+        for mod in order:
+            execution.clear_setup(mod.name)
+        forget_green_run(mod.name for mod in order)
+        if order:
+            # Resources tempest.conf refers to, like images and flavors, may
+            # be gone while the catalog stays the same
+            tempest.clear_fingerprint(pathlib.Path(TEMPEST_WORKSPACE))
+    finally:
+        execution.save()
 
 
 def _output_log_file(path: pathlib.Path):
@@ -43,11 +138,12 @@ def _output_log_file(path: pathlib.Path):
 
 
 def collect_logs():
-    for mod in get_execution_order(regress_stack.modules, None):
-        logs = getattr(mod.module, "LOGS", None)
+    execution = execution_plan(from_saved=True)
+    for mod in execution.order():
+        logs = execution.metadata[mod.name].logs
         if not logs:
             continue
-        with utils.banner(f"Collecting logs for {mod.module.__name__}"):
+        with utils.banner(f"Collecting logs for {mod.name}"):
             for log in logs:
                 log_path = pathlib.Path(log)
                 if not log_path.exists():
@@ -62,54 +158,131 @@ def collect_logs():
     utils.print_ascii_banner("Collected journal logs")
 
 
+def _run_tempest(
+    tests: typing.List[str],
+    list_name: str,
+    collector: report.ResultCollector,
+    env: typing.Dict[str, str],
+    dir_name: str,
+) -> int:
+    test_list = pathlib.Path(dir_name) / list_name
+    test_list.write_text("".join(test + "\n" for test in tests))
+    return report.run_subunit(
+        "tempest",
+        ["run", "--load-list", list_name, "--serial", "--subunit"],
+        collector,
+        env=env,
+        cwd=dir_name,
+    )
+
+
+def _retry_failed(
+    results: typing.List[report.TestResult],
+    retries: int,
+    attribution: report.Attribution,
+    env: typing.Dict[str, str],
+    dir_name: str,
+) -> typing.List[report.TestResult]:
+    if not retries or not any(result.failed for result in results):
+        return results
+
+    def run(test_id: str) -> typing.List[report.TestResult]:
+        collector = report.ResultCollector(attribution, progress=report.log_progress)
+        _run_tempest([test_id], "retry_tests.txt", collector, env, dir_name)
+        return collector.results
+
+    with utils.banner("Retrying failed tests"):
+        return report.retry_failed(results, run, retries)
+
+
 @utils.measure_time
-def test():
+def test(
+    full: bool = False,
+    canary: bool = True,
+    sample_interval: float = 0,
+    retries: int = 2,
+):
+    from regress_stack.core.modules import run_in_dependency_order
+    from regress_stack.core.plan import load_green_run, save_green_run
+    from regress_stack.modules import keystone
+    from regress_stack.modules import utils as module_utils
+
     env = keystone.auth_env()
-    dir_name = "mycloud01"
+    dir_name = TEMPEST_WORKSPACE
+    workspace = pathlib.Path(dir_name)
     release = utils.release()
-    utils.run("tempest", ["init", dir_name])
-    utils.run(
-        "discover-tempest-config",
-        [
-            "--create",
-            "--flavor-min-mem",
-            "1024",
-            "--flavor-min-disk",
-            "5",
-            "--image",
-            f"http://cloud-images.ubuntu.com/{release}/current/{release}-server-cloudimg-{utils.machine()}.img",
-        ],
-        env=env,
-        cwd=dir_name,
+    execution = execution_plan(from_saved=True)
+    # Modules set up since the last green run are missing from it, and
+    # their tests selected
+    versions = execution.package_versions(setup_only=True)
+    discover_args = [
+        "--create",
+        "--flavor-min-mem",
+        "1024",
+        "--flavor-min-disk",
+        "5",
+        "--image",
+        f"http://cloud-images.ubuntu.com/{release}/current/{release}-server-cloudimg-{utils.machine()}.img",
+    ]
+    fingerprint = tempest.workspace_fingerprint(
+        keystone.o7k().identity.endpoints(), versions, discover_args
     )
-    tempest_conf = pathlib.Path(dir_name) / "etc" / "tempest.conf"
+    if not tempest.is_initialized(workspace):
+        utils.run("tempest", ["init", dir_name])
+    tempest_conf = workspace / "etc" / "tempest.conf"
+    if tempest.is_current(workspace, fingerprint):
+        LOG.info("Reusing tempest workspace %s", dir_name)
+    else:
+        tempest.clear_fingerprint(workspace)
+        utils.run("discover-tempest-config", discover_args, env=env, cwd=dir_name)
+        tempest.save_fingerprint(workspace, fingerprint)
     module_utils.cfg_set(
         str(tempest_conf),
         ("validation", "image_ssh_user", "ubuntu"),
         ("validation", "image_alt_ssh_user", "ubuntu"),
     )
 
+    selected = None
+    green_run = load_green_run()
+    if not full and green_run is not None:
+        selected = execution.affected_modules(green_run, versions)
+        LOG.info("Modules changed since last green run: %s", sorted(selected))
     test_regexes = []
-    for mod in get_execution_order(regress_stack.modules):
-        if not utils.is_setup_done(mod.name):
+    selected_regexes = []
+    canary_regexes = []
+    configure_mods = []
+    for mod in execution.order():
+        if not execution.is_setup_done(mod.name):
             LOG.info("Skipping %s", mod.name)
             continue
-        if configure := getattr(mod.module, "configure_tempest", None):
-            with utils.measure("configure_tempest " + mod.name):
-                configure(tempest_conf)
-        includes_regexes = getattr(mod.module, "TEST_INCLUDE_REGEXES", [])
-        exclude_regexes = getattr(mod.module, "TEST_EXCLUDE_REGEXES", [])
+        metadata = execution.metadata[mod.name]
+        if "configure_tempest" in metadata.hooks:
+            configure_mods.append(mod)
+        canary_regexes.extend(metadata.test_canary_regexes)
+        includes_regexes = metadata.test_include_regexes
+        exclude_regexes = metadata.test_exclude_regexes
         if not includes_regexes:
             # If no include defined, it would get too much tests
             continue
-        test_regexes.append((includes_regexes, exclude_regexes))
+        test_regexes.append(
+            (mod.name.rsplit(".", 1)[-1], includes_regexes, exclude_regexes)
+        )
+        if selected is None or mod.name in selected:
+            selected_regexes.append(test_regexes[-1])
+
+    def configure_tempest(mod):
+        with utils.measure("configure_tempest " + mod.name):
+            mod.module.configure_tempest(tempest_conf)
+
+    with utils.measure("configure_tempest"):
+        run_in_dependency_order(execution.graph, configure_mods, configure_tempest)
 
     LOG.info("Building test list")
     regress_tests = utils.run(
         "tempest", ["run", "--smoke", "--list"], env=env, cwd=dir_name
     )
 
-    for include_regexes, exclude_regexes in test_regexes:
+    for _, include_regexes, exclude_regexes in selected_regexes:
         args = []
         for regex in include_regexes:
             args.extend(("--regex", regex))
@@ -119,66 +292,283 @@ def test():
             "tempest", ["run", "--list", *args], env=env, cwd=dir_name
         )
 
-    regress_list = pathlib.Path(dir_name) / "regress_tests.txt"
-    regress_list.write_text(regress_tests)
+    tests = list(dict.fromkeys(regress_tests.splitlines()))
+    canary_tests = []
+    if canary:
+        canary_tests = report.select_canary(tests, canary_regexes, report.load_failed())
+    attribution = report.Attribution(test_regexes)
+    collector = report.ResultCollector(attribution, progress=report.log_progress)
+    setup_mods = [mod for mod in execution.order() if execution.is_setup_done(mod.name)]
+    retried: typing.Dict[str, report.TestResult] = {}
+
+    def results() -> typing.List[report.TestResult]:
+        return [retried.get(result.id, result) for result in collector.results]
+
+    def retry():
+        for result in _retry_failed(results(), retries, attribution, env, dir_name):
+            retried[result.id] = result
+
+    problems: typing.List[str] = []
+
+    def run_tempest(run_tests: typing.List[str], list_name: str):
+        start = len(collector.results)
+        returncode = _run_tempest(run_tests, list_name, collector, env, dir_name)
+        for problem in report.run_problems(
+            run_tests, collector.results[start:], returncode
+        ):
+            problems.append(f"{list_name}: {problem}")
 
     try:
-        utils.run(
-            "tempest",
-            ["run", "--load-list", str(regress_list.relative_to(dir_name)), "--serial"],
-            env=env,
-            cwd=dir_name,
-        )
-    except subprocess.CalledProcessError:
-        # silence to fail on the next command
-        pass
-    try:
-        with utils.banner("Fetching failing tests"):
-            utils.run("stestr", ["failing", "--list"], cwd=dir_name)
-    except subprocess.CalledProcessError:
+        with sample_resources(execution, setup_mods, "test", sample_interval):
+            if canary_tests:
+                with utils.banner("Running canary tests"):
+                    run_tempest(canary_tests, "canary_tests.txt")
+                retry()
+            skip = set(canary_tests)
+            remaining = [test for test in tests if test not in skip]
+            if any(result.failed for result in results()):
+                LOG.error("Canary tests failed, skipping the other tests")
+            elif remaining:
+                run_tempest(remaining, "regress_tests.txt")
+                retry()
+    finally:
+        final = results()
+        report.write_json(final, pathlib.Path(dir_name) / "report.json")
+        report.write_junit(final, pathlib.Path(dir_name) / "report.xml")
+        report.save_failed(final)
+        report.log_summary(final)
+    failures = [result.id for result in final if result.failed]
+    if failures or problems:
         collect_logs()
-        raise
+    if failures:
+        raise RuntimeError(f"{len(failures)} tests failed: {failures}")
+    if problems:
+        # Missing results would pass for a green run
+        raise RuntimeError(f"Incomplete test run: {'; '.join(problems)}")
+    save_green_run(versions)
+
+
+def bench(
+    operations: typing.Optional[typing.List[str]],
+    iterations: int,
+    concurrency: int,
+    output: typing.Optional[pathlib.Path],
+):
+    execution = execution_plan(from_saved=True)
+    funcs = {}
+    for mod in execution.order():
+        if not execution.is_setup_done(mod.name):
+            continue
+        short_name = mod.name.rsplit(".", 1)[-1]
+        for operation in execution.metadata[mod.name].bench_operations:
+            name = f"{short_name}.{operation}"
+            if operations and name not in operations and short_name not in operations:
+                continue
+            funcs[name] = getattr(mod.module, "bench_" + operation)
+    if not funcs:
+        raise RuntimeError(f"No benchmark operation matches {operations}!")
+
+    results = core_bench.run(funcs, iterations, concurrency)
+    stats_json = json.dumps([dataclasses.asdict(stats) for stats in results], indent=2)
+    if output:
+        output.write_text(stats_json)
+    else:
+        print(stats_json)
 
 
 def list_modules():
-    _ = get_execution_order(regress_stack.modules)
+    from regress_stack.core.modules import modules
+
+    _ = execution_plan()
     for module in modules():
         print(module)
 
 
-def main():
+def _positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer: {value!r}")
+    return number
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         prog="openstack-deb-tester",
         description="A CLI tool for testing OpenStack Debian packages.",
     )
+    parser.add_argument(
+        "--http-debug",
+        action="store_true",
+        help="Log OpenStack API requests and responses. Also enabled by "
+        "REGRESS_STACK_HTTP_DEBUG=1 (or true, yes).",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between samples of the services CPU, memory and IO "
+        "usage during setup and test, 0 to disable.",
+    )
+    parser.add_argument(
+        "--agent-socket",
+        type=pathlib.Path,
+        default=os.environ.get("REGRESS_STACK_AGENT_SOCKET"),
+        help="Submit the command to the agent listening on this socket.",
+    )
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     def add_common_arguments(subparser):
-        subparser.add_argument("target", nargs="?", help="Target to test (optional).")
+        subparser.add_argument(
+            "targets",
+            nargs="*",
+            help="Target modules, with their dependencies (all by default).",
+        )
 
     parser_plan = subparsers.add_parser("plan", help="Plan the test execution.")
     add_common_arguments(parser_plan)
 
     parser_setup = subparsers.add_parser("setup", help="Execute the tests.")
     add_common_arguments(parser_setup)
+    parser_setup.add_argument(
+        "--profile",
+        choices=sizing.PROFILES,
+        help="Size service workers and pools for smoke tests (minimal), "
+        "test runs (ci) or throughput (perf). Defaults to the profile of the "
+        f"previous setup, or {sizing.DEFAULT_PROFILE}.",
+    )
+    ephemeral = parser_setup.add_mutually_exclusive_group()
+    ephemeral.add_argument(
+        "--ephemeral",
+        action="store_true",
+        default=None,
+        help="Keep the MySQL data and the Ceph OSDs in memory, without "
+        "durability, for throwaway hosts. Refused without enough memory, "
+        "kept by the next setups.",
+    )
+    ephemeral.add_argument(
+        "--no-ephemeral",
+        action="store_false",
+        dest="ephemeral",
+        default=None,
+        help="Turn ephemeral storage off, refused until a reboot unmounted its memory.",
+    )
+
+    parser_test = subparsers.add_parser("test", help="Run the tests.")
+    parser_test.add_argument(
+        "--full",
+        action="store_true",
+        help="Run the tests of all modules, not only of the modules whose "
+        "packages changed since the last successful run.",
+    )
+    parser_test.add_argument(
+        "--no-canary",
+        dest="canary",
+        action="store_false",
+        help="Do not run the canary tests first, stopping when they fail.",
+    )
+    parser_test.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="Rerun each failed test alone, up to this many times, reporting the "
+        "tests passing on retry as flaky (default: %(default)s).",
+    )
+
+    parser_bench = subparsers.add_parser(
+        "bench", help="Measure API throughput and latencies."
+    )
+    parser_bench.add_argument(
+        "operations",
+        nargs="*",
+        help="Operations (e.g. neutron.network_port) or modules to benchmark, "
+        "all by default.",
+    )
+    parser_bench.add_argument(
+        "--iterations",
+        type=_positive_int,
+        default=20,
+        help="Calls of each operation.",
+    )
+    parser_bench.add_argument(
+        "--concurrency", type=_positive_int, default=4, help="Concurrent calls."
+    )
+    parser_bench.add_argument(
+        "--output", type=pathlib.Path, help="Write the JSON report to a file."
+    )
 
-    subparsers.add_parser("test", help="Run the tests.")
+    parser_reset = subparsers.add_parser(
+        "reset",
+        help="Tear down what setup did: resources, databases, users, bridges, "
+        "OSDs and setup markers.",
+    )
+    add_common_arguments(parser_reset)
 
     subparsers.add_parser("list-modules", help="List available modules.")
 
-    args = parser.parse_args()
+    parser_agent = subparsers.add_parser(
+        "agent",
+        help="Run the submitted commands, keeping the plan, the apt cache and "
+        "the OpenStack session loaded between them.",
+    )
+    parser_agent.add_argument(
+        "--socket",
+        type=pathlib.Path,
+        default=agent.SOCKET_PATH,
+        help="Unix socket to listen on.",
+    )
+    return parser
 
-    logging.basicConfig(level=logging.DEBUG)
+
+def run_command(args: argparse.Namespace):
+    if args.http_debug:
+        from regress_stack.modules import keystone
+
+        keystone.set_http_debug(True)
 
     if args.command == "plan":
-        plan(args.target)
+        plan(args.targets)
     elif args.command == "setup":
-        setup(args.target)
+        sizing.set_profile(args.profile)
+        sizing.set_ephemeral(args.ephemeral)
+        setup(args.targets, args.sample_interval)
     elif args.command == "test":
-        test()
+        test(args.full, args.canary, args.sample_interval, args.retries)
+    elif args.command == "bench":
+        bench(args.operations, args.iterations, args.concurrency, args.output)
+    elif args.command == "reset":
+        reset(args.targets)
     elif args.command == "list-modules":
         list_modules()
 
 
+def run_agent_command(parser: argparse.ArgumentParser, argv: typing.List[str]):
+    args = parser.parse_args(argv)
+    if args.command == "agent":
+        raise RuntimeError("Already running in the agent")
+    # Reads cached by the previous command may be stale by now
+    utils.invalidate_cache()
+    # Options of the previous command must not outlive it
+    from regress_stack.modules import keystone
+
+    keystone.set_http_debug(keystone.HTTP_DEBUG_DEFAULT)
+    run_command(args)
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+    if args.command == "agent":
+        agent.serve(functools.partial(run_agent_command, parser), args.socket)
+    elif args.agent_socket:
+        sys.exit(agent.submit(sys.argv[1:], args.agent_socket))
+    else:
+        run_command(args)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,134 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import pathlib
+import socket
+import socketserver
+import sys
+import typing
+
+from regress_stack.core import utils
+
+LOG = logging.getLogger(__name__)
+
+SOCKET_PATH = utils.REGRESS_STACK_DIR / "agent.sock"
+
+Handler = typing.Callable[[typing.List[str]], None]
+
+
+class _Stream(io.TextIOBase):
+    """Text stream sending what is written to the client, as JSON lines."""
+
+    def __init__(self, wfile: typing.BinaryIO, name: str) -> None:
+        super().__init__()
+        self._wfile = wfile
+        self.name = name
+        self.connected = True
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text and self.connected:
+            try:
+                self._wfile.write(json.dumps({self.name: text}).encode() + b"\n")
+                self._wfile.flush()
+            except OSError:
+                # The client went away, let the command complete anyway
+                self.connected = False
+        return len(text)
+
+
+def _exit_code(handler: Handler, argv: typing.List[str]) -> int:
+    try:
+        handler(argv)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except Exception:
+        LOG.exception("Command %r failed", argv)
+        return 1
+    return 0
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "AgentServer"
+
+    def handle(self) -> None:
+        request = json.loads(self.rfile.readline())
+        argv = request["argv"]
+        stdout = _Stream(self.wfile, "stdout")
+        stderr = _Stream(self.wfile, "stderr")
+        log_handler = logging.StreamHandler(stderr)
+        log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root = logging.getLogger()
+        root.addHandler(log_handler)
+        LOG.info("Running %r", argv)
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                code = _exit_code(self.server.handler, argv)
+        finally:
+            root.removeHandler(log_handler)
+        LOG.info("Command %r exited with %d", argv, code)
+        if stdout.connected:
+            self.wfile.write(json.dumps({"exit": code}).encode() + b"\n")
+
+
+class AgentServer(socketserver.UnixStreamServer):
+    """Run the commands submitted on a unix socket, one at a time.
+
+    Commands run in this process, so whatever they cache (plan, apt cache,
+    SDK session...) is kept warm for the next ones.
+    """
+
+    def __init__(self, path: pathlib.Path, handler: Handler) -> None:
+        self.handler = handler
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Left behind by an agent which did not stop cleanly
+        if path.is_socket():
+            path.unlink()
+        super().__init__(str(path), _RequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+
+def serve(handler: Handler, path: pathlib.Path = SOCKET_PATH):
+    with AgentServer(path, handler) as server:
+        LOG.info("Agent listening on %s", path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            LOG.info("Agent stopped")
+
+
+def submit(
+    argv: typing.List[str],
+    path: pathlib.Path = SOCKET_PATH,
+    stdout: typing.TextIO = sys.stdout,
+    stderr: typing.TextIO = sys.stderr,
+) -> int:
+    """Run argv in the agent listening on path, return its exit code.
+
+    The command output is streamed back while it runs.
+    """
+    streams = {"stdout": stdout, "stderr": stderr}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(path))
+        sock.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+        with sock.makefile("r") as lines:
+            for line in lines:
+                message = json.loads(line)
+                if "exit" in message:
+                    return message["exit"]
+                for name, text in message.items():
+                    streams[name].write(text)
+                    streams[name].flush()
+    raise RuntimeError(f"Agent at {path} closed the connection before the end")
@@ -1,15 +1,33 @@
+import pathlib
 import typing
 
-import apt
+if typing.TYPE_CHECKING:
+    import apt
 
-APT_CACHE: type(apt.cache.Cache) = None
+DPKG_STATUS = pathlib.Path("/var/lib/dpkg/status")
 
+APT_CACHE: typing.Optional["apt.cache.Cache"] = None
+# Modification time of the dpkg status when the cache was loaded
+APT_CACHE_MTIME: typing.Optional[float] = None
 
-def get_cache() -> apt.cache.Cache:
-    global APT_CACHE
 
-    if APT_CACHE is None:
+def status_mtime() -> typing.Optional[float]:
+    try:
+        return DPKG_STATUS.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def get_cache() -> "apt.cache.Cache":
+    """Return the apt cache, reloaded when packages were installed since."""
+    global APT_CACHE, APT_CACHE_MTIME
+
+    import apt
+
+    mtime = status_mtime()
+    if APT_CACHE is None or mtime != APT_CACHE_MTIME:
         APT_CACHE = apt.Cache()
+        APT_CACHE_MTIME = mtime
 
     return APT_CACHE
 
@@ -21,3 +39,14 @@ def pkgs_installed(pkgs: typing.List[str]) -> bool:
         return all([apt_cache[pkg].is_installed for pkg in pkgs])
     except KeyError:
         return False
+
+
+def pkg_versions(pkgs: typing.List[str]) -> typing.Dict[str, typing.Optional[str]]:
+    """Return the installed version of pkgs, None when not installed."""
+    apt_cache = get_cache()
+
+    versions = {}
+    for pkg in pkgs:
+        installed = apt_cache[pkg].installed if pkg in apt_cache else None
+        versions[pkg] = installed.version if installed else None
+    return versions
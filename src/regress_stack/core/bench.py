@@ -0,0 +1,112 @@
+import concurrent.futures
+import dataclasses
+import itertools
+import logging
+import threading
+import time
+import typing
+
+LOG = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+
+
+@dataclasses.dataclass
+class OperationStats:
+    """Throughput and latencies, in seconds, of an operation."""
+
+    name: str
+    iterations: int
+    errors: int
+    concurrency: int
+    duration: float
+    throughput: float
+    latencies: typing.Dict[str, float]
+
+
+def percentile(values: typing.Sequence[float], q: float) -> float:
+    """Return the q-th percentile of sorted values, interpolating linearly."""
+    if not values:
+        return 0.0
+    rank = (len(values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def run_operation(
+    name: str,
+    func: typing.Callable[[], typing.Any],
+    iterations: int,
+    concurrency: int = 1,
+) -> OperationStats:
+    """Call func iterations times from concurrency threads, and time it.
+
+    Failed calls are counted as errors, and left out of the latencies.
+    """
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies: typing.List[float] = []
+    errors = 0
+
+    def worker():
+        nonlocal errors
+        while next(counter) < iterations:
+            start = time.perf_counter()
+            try:
+                func()
+            except Exception as e:
+                LOG.warning("Operation %s failed: %s", name, e)
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+    stats = {f"p{q}": percentile(latencies, q) for q in PERCENTILES}
+    if latencies:
+        stats.update(
+            min=latencies[0],
+            max=latencies[-1],
+            mean=sum(latencies) / len(latencies),
+        )
+    return OperationStats(
+        name=name,
+        iterations=iterations,
+        errors=errors,
+        concurrency=concurrency,
+        duration=duration,
+        throughput=len(latencies) / duration if duration else 0.0,
+        latencies=stats,
+    )
+
+
+def run(
+    operations: typing.Dict[str, typing.Callable[[], typing.Any]],
+    iterations: int,
+    concurrency: int = 1,
+) -> typing.List[OperationStats]:
+    """Benchmark operations one after the other."""
+    results = []
+    for name, func in operations.items():
+        LOG.info(
+            "Benchmarking %s (%d iterations, %d threads)", name, iterations, concurrency
+        )
+        stats = run_operation(name, func, iterations, concurrency)
+        LOG.info(
+            "%s: %.2f ops/s, p50 %.3fs, p99 %.3fs, %d errors",
+            name,
+            stats.throughput,
+            stats.latencies["p50"],
+            stats.latencies["p99"],
+            stats.errors,
+        )
+        results.append(stats)
+    return results
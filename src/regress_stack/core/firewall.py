@@ -0,0 +1,97 @@
+import dataclasses
+import logging
+import shlex
+import typing
+
+from regress_stack.core import utils
+
+LOG = logging.getLogger(__name__)
+
+SAVE = "iptables-legacy-save"
+RESTORE = "iptables-legacy-restore"
+
+
+@dataclasses.dataclass(frozen=True)
+class NatRule:
+    """Rule of the nat table, identified by its comment."""
+
+    chain: str
+    source: str
+    comment: str
+    target: str = "MASQUERADE"
+
+    def rule_args(self, action: str = "-A") -> typing.List[str]:
+        """Return the rule as printed by iptables-save."""
+        return [
+            action,
+            self.chain,
+            "-s",
+            self.source,
+            "-m",
+            "comment",
+            "--comment",
+            self.comment,
+            "-j",
+            self.target,
+        ]
+
+
+def _existing_rules(dump: str) -> typing.Set[typing.Tuple[str, ...]]:
+    return {
+        tuple(shlex.split(line)) for line in dump.splitlines() if line.startswith("-A ")
+    }
+
+
+def missing_rules(rules: typing.Iterable[NatRule], dump: str) -> typing.List[NatRule]:
+    """Return the rules not in dump, the nat table in iptables-save format."""
+    existing = _existing_rules(dump)
+    missing = []
+    for rule in dict.fromkeys(rules):
+        if tuple(rule.rule_args()) not in existing:
+            missing.append(rule)
+    return missing
+
+
+def _quote(arg: str) -> str:
+    # iptables-restore only understands double quotes
+    if not arg or any(c.isspace() for c in arg):
+        return f'"{arg}"'
+    return arg
+
+
+def restore_input(rules: typing.Iterable[NatRule], action: str = "-A") -> str:
+    lines = ["*nat"]
+    lines.extend(" ".join(map(_quote, rule.rule_args(action))) for rule in rules)
+    lines.append("COMMIT")
+    return "\n".join(lines) + "\n"
+
+
+def reconcile(rules: typing.Iterable[NatRule]) -> typing.List[NatRule]:
+    """Add the missing rules to the nat table, return them.
+
+    The table is read once, and the missing rules are appended in a single
+    atomic restore, leaving other rules in place.
+    """
+    rules = list(rules)
+    if not rules:
+        return []
+    missing = missing_rules(rules, utils.run(SAVE, ["-t", "nat"]))
+    if missing:
+        LOG.debug("Adding nat rules %s", ", ".join(rule.comment for rule in missing))
+        utils.run(RESTORE, ["--noflush", "-w"], input=restore_input(missing))
+    return missing
+
+
+def remove(rules: typing.Iterable[NatRule]) -> typing.List[NatRule]:
+    """Delete the rules present in the nat table, return them."""
+    rules = list(rules)
+    if not rules:
+        return []
+    existing = _existing_rules(utils.run(SAVE, ["-t", "nat"]))
+    present = [
+        rule for rule in dict.fromkeys(rules) if tuple(rule.rule_args()) in existing
+    ]
+    if present:
+        LOG.debug("Deleting nat rules %s", ", ".join(rule.comment for rule in present))
+        utils.run(RESTORE, ["--noflush", "-w"], input=restore_input(present, "-D"))
+    return present
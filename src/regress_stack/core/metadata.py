@@ -0,0 +1,161 @@
+import ast
+import dataclasses
+import logging
+import pathlib
+import pkgutil
+import typing
+
+LOG = logging.getLogger(__name__)
+
+# Functions a module may define, called by the commands.
+HOOKS = ("setup", "configure_tempest", "nat_rules", "teardown")
+
+
+@dataclasses.dataclass
+class ModuleMetadata:
+    """Declarations a module exposes to the planner and the commands."""
+
+    path: typing.Optional[str] = None
+    dependencies: typing.List[str] = dataclasses.field(default_factory=list)
+    optional_dependencies: typing.List[str] = dataclasses.field(default_factory=list)
+    packages: typing.List[str] = dataclasses.field(default_factory=list)
+    logs: typing.List[str] = dataclasses.field(default_factory=list)
+    services: typing.List[str] = dataclasses.field(default_factory=list)
+    test_include_regexes: typing.List[str] = dataclasses.field(default_factory=list)
+    test_exclude_regexes: typing.List[str] = dataclasses.field(default_factory=list)
+    test_canary_regexes: typing.List[str] = dataclasses.field(default_factory=list)
+    hooks: typing.List[str] = dataclasses.field(default_factory=list)
+    bench_operations: typing.List[str] = dataclasses.field(default_factory=list)
+
+
+# Module level names read from the source, and the metadata field they fill.
+LITERALS = {
+    "PACKAGES": "packages",
+    "LOGS": "logs",
+    # systemd units, as fnmatch patterns, whose resource usage is sampled
+    "SERVICES": "services",
+    "TEST_INCLUDE_REGEXES": "test_include_regexes",
+    "TEST_EXCLUDE_REGEXES": "test_exclude_regexes",
+    "TEST_CANARY_REGEXES": "test_canary_regexes",
+    # Each operation is a bench_<operation> function of the module
+    "BENCH_OPERATIONS": "bench_operations",
+}
+REFERENCES = {
+    "DEPENDENCIES": "dependencies",
+    "OPTIONAL_DEPENDENCIES": "optional_dependencies",
+}
+
+
+def _resolve_relative(module: str, level: int, package: str) -> str:
+    if not level:
+        return module
+    base = package.rsplit(".", level - 1)[0] if level > 1 else package
+    return f"{base}.{module}" if module else base
+
+
+def _imported_names(tree: ast.Module, package: str) -> typing.Dict[str, str]:
+    """Map names bound by top level imports to canonical module names."""
+    names = {}
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    names[alias.asname] = alias.name
+        elif isinstance(node, ast.ImportFrom):
+            base = _resolve_relative(node.module or "", node.level, package)
+            for alias in node.names:
+                names[alias.asname or alias.name] = f"{base}.{alias.name}"
+    return names
+
+
+def _dotted_name(node: ast.expr) -> typing.Optional[str]:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        parent = _dotted_name(node.value)
+        return f"{parent}.{node.attr}" if parent else None
+    return None
+
+
+def _read_references(
+    node: ast.expr, imports: typing.Dict[str, str], path: str
+) -> typing.List[str]:
+    if isinstance(node, ast.Call) and _dotted_name(node.func) in ("set", "list"):
+        if node.args:
+            return _read_references(node.args[0], imports, path)
+        return []
+    if not isinstance(node, (ast.Set, ast.List, ast.Tuple)):
+        raise RuntimeError(f"{path}:{node.lineno}: expected a set of modules")
+    references = []
+    for elt in node.elts:
+        # Dependencies declared by name do not need to be imported
+        if isinstance(elt, ast.Constant) and isinstance(elt.value, str):
+            references.append(elt.value)
+            continue
+        name = _dotted_name(elt)
+        if name is None:
+            raise RuntimeError(
+                f"{path}:{elt.lineno}: expected a module name or reference"
+            )
+        head, _, tail = name.partition(".")
+        if head not in imports:
+            raise RuntimeError(f"{path}:{elt.lineno}: {head!r} is not imported")
+        references.append(imports[head] + ("." + tail if tail else ""))
+    return sorted(references)
+
+
+def read_metadata(
+    path: typing.Union[str, pathlib.Path], package: str
+) -> ModuleMetadata:
+    """Read the declarations of the module at path, part of package.
+
+    The module is parsed, not imported: its top level code (host lookups,
+    netlink queries...) does not run.
+    """
+    source = pathlib.Path(path).read_text()
+    tree = ast.parse(source, filename=str(path))
+    imports = _imported_names(tree, package)
+    metadata = ModuleMetadata(path=str(path))
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name in HOOKS:
+            metadata.hooks.append(node.name)
+            continue
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target, value = node.targets[0], node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target, value = node.target, node.value
+        else:
+            continue
+        if not isinstance(target, ast.Name):
+            continue
+        if target.id in LITERALS:
+            try:
+                literal = ast.literal_eval(value)
+            except ValueError:
+                raise RuntimeError(
+                    f"{path}:{node.lineno}: {target.id} must be a literal"
+                ) from None
+            setattr(metadata, LITERALS[target.id], list(literal))
+        elif target.id in REFERENCES:
+            setattr(
+                metadata,
+                REFERENCES[target.id],
+                _read_references(value, imports, str(path)),
+            )
+    return metadata
+
+
+def index_package(
+    path: typing.Union[str, pathlib.Path], package: str
+) -> typing.Dict[str, ModuleMetadata]:
+    """Read the metadata of every module of a package directory."""
+    index = {}
+    for module in pkgutil.iter_modules([str(path)]):
+        if module.ispkg:
+            continue
+        canonical_name = package + "." + module.name
+        index[canonical_name] = read_metadata(
+            pathlib.Path(path) / (module.name + ".py"), package
+        )
+        LOG.debug("Indexed module %r", canonical_name)
+    return index
@@ -1,51 +1,78 @@
+import collections
+import concurrent.futures
 import importlib
+import importlib.machinery
+import importlib.metadata
 import importlib.util
 import logging
 import pathlib
-import pkgutil
+import sys
 import types
 import typing
 
 import networkx as nx
 
 import regress_stack.core.apt as apt
+from regress_stack.core.metadata import ModuleMetadata, index_package, read_metadata
 
 LOG = logging.getLogger(__name__)
 _MOD_REGISTRY: typing.MutableMapping[str, types.ModuleType] = {}
+_MOD_INDEX: typing.MutableMapping[str, ModuleMetadata] = {}
 
+ENTRY_POINT_GROUP = "regress_stack.modules"
 
-def load_module(name: str, path: str):
+
+def load_module(name: str, path: typing.Optional[str] = None) -> types.ModuleType:
+    """Import a module, from path if it cannot be found by name."""
     if name in _MOD_REGISTRY:
         return _MOD_REGISTRY[name]
-    spec = importlib.util.find_spec(name, path)
-    if spec is None:
+    try:
+        spec = importlib.util.find_spec(name)
+    except ModuleNotFoundError:
+        spec = None
+    if spec is not None:
+        module_loaded = importlib.import_module(name)
+    elif path is not None:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module_loaded = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module_loaded
+        spec.loader.exec_module(module_loaded)
+    else:
         raise RuntimeError(f"Module {name} not found!")
-    module_loaded = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module_loaded)
     _MOD_REGISTRY[name] = module_loaded
     LOG.debug("Loaded module %r from %r", name, path)
     return module_loaded
 
 
 def modules() -> typing.List[str]:
-    return list(module.rsplit(".")[-1] for module in _MOD_REGISTRY.keys())
+    return list(module.rsplit(".")[-1] for module in _MOD_INDEX.keys())
 
 
 class ModuleComp:
+    """A module of the dependency graph, imported on first use."""
+
     name: str
-    module: types.ModuleType
+    metadata: ModuleMetadata
 
-    def __init__(self, name: str, module: types.ModuleType) -> None:
+    def __init__(self, name: str, metadata: ModuleMetadata) -> None:
         self.name = name
-        self.module = module
+        self.metadata = metadata
+
+    @property
+    def path(self) -> typing.Optional[str]:
+        return self.metadata.path
+
+    @property
+    def module(self) -> types.ModuleType:
+        return load_module(self.name, self.path)
 
     def __hash__(self) -> int:
-        return hash(self.name) ^ hash(self.module.__file__)
+        return hash(self.name) ^ hash(self.path)
 
     def __eq__(self, value: object) -> bool:
         if not isinstance(value, ModuleComp):
             return False
-        if self.name == value.name and self.module.__file__ == value.module.__file__:
+        if self.name == value.name and self.path == value.path:
             return True
         return False
 
@@ -56,88 +83,144 @@ class ModuleComp:
         return self.name < other.name
 
     def __repr__(self) -> str:
-        return f"ModuleComp(name={self.name}, file={self.module.__file__})"
+        return f"ModuleComp(name={self.name}, file={self.path})"
 
 
-def build_dependency_graph(modules_mod: types.ModuleType) -> nx.DiGraph:
-    """Build a directed graph of dependencies."""
+def _entry_points(group: str) -> typing.Iterable[importlib.metadata.EntryPoint]:
+    entry_points = importlib.metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=group)
+    # Python < 3.10
+    return entry_points.get(group, [])
+
+
+def _find_spec(name: str) -> typing.Optional[importlib.machinery.ModuleSpec]:
+    """Find the spec of a module, without importing its parent packages.
+
+    importlib.util.find_spec imports the parents of dotted names, running
+    the ``__init__`` of plugin distributions.
+    """
+    parts = name.split(".")
+    spec = importlib.util.find_spec(parts[0])
+    for i in range(1, len(parts)):
+        if spec is None or spec.submodule_search_locations is None:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(
+            ".".join(parts[: i + 1]), list(spec.submodule_search_locations)
+        )
+    return spec
+
+
+def index_plugins() -> typing.Dict[str, ModuleMetadata]:
+    """Read the metadata of modules registered by installed distributions.
+
+    Distributions register modules in the ENTRY_POINT_GROUP entry point group,
+    e.g. ``octavia = regress_stack_octavia.octavia``. Plugins are located, not
+    imported.
+    """
+    index = {}
+    for entry_point in _entry_points(ENTRY_POINT_GROUP):
+        name = entry_point.value.partition(":")[0].strip()
+        if name.rsplit(".")[-1] != entry_point.name:
+            LOG.warning(
+                "Plugin %r is registered as %r, it will be known as %r",
+                name,
+                entry_point.name,
+                name.rsplit(".")[-1],
+            )
+        spec = _find_spec(name)
+        if spec is None or not spec.has_location:
+            LOG.warning("Plugin %r not found, skipping", name)
+            continue
+        index[name] = read_metadata(spec.origin, name.rpartition(".")[0])
+        LOG.debug("Indexed plugin %r from %r", name, spec.origin)
+    return index
+
+
+def index_modules(modules_mod: types.ModuleType) -> typing.Dict[str, ModuleMetadata]:
+    """Read the metadata of built-in and plugin modules, without importing them.
+
+    Built-in modules take precedence over plugins with the same name.
+    """
     modules_dir = pathlib.Path(modules_mod.__path__[0])
     package = str(modules_mod.__package__)
-    modules = list(pkgutil.iter_modules([str(modules_dir)]))
+    index = index_package(modules_dir, package)
+    names = {module.rsplit(".")[-1] for module in index}
+    for plugin, metadata in index_plugins().items():
+        if plugin.rsplit(".")[-1] in names:
+            LOG.warning("Plugin %r shadows a built-in module, skipping", plugin)
+            continue
+        index[plugin] = metadata
+        names.add(plugin.rsplit(".")[-1])
+    _MOD_INDEX.update(index)
+    return index
+
+
+def build_dependency_graph(modules_mod: types.ModuleType) -> nx.DiGraph:
+    """Build a directed graph of dependencies.
+
+    Dependencies are either canonical module names or short names, like
+    ``keystone``.
+    """
+    index = index_modules(modules_mod)
+    comps = {name: ModuleComp(name, metadata) for name, metadata in index.items()}
+    short_names = {name.rsplit(".")[-1]: name for name in comps}
     graph: nx.DiGraph[ModuleComp] = nx.DiGraph()
 
-    for module in modules:
-        canonical_name = package + "." + module.name
-        module_loaded = load_module(canonical_name, module.module_finder.path)
-        mod = ModuleComp(
-            canonical_name,
-            module_loaded,
-        )
-        dependencies: set[types.ModuleType] = getattr(
-            module_loaded, "DEPENDENCIES", set()
-        )
-        optional_dependencies: set[types.ModuleType] = getattr(
-            module_loaded, "OPTIONAL_DEPENDENCIES", set()
-        )
+    def resolve(mod: ModuleComp, dep: str) -> ModuleComp:
+        dep = short_names.get(dep, dep)
+        if dep not in comps:
+            LOG.warning("Module %r depends on unknown %r", mod.name, dep)
+            comps[dep] = ModuleComp(dep, ModuleMetadata())
+        return comps[dep]
+
+    for mod in list(comps.values()):
+        optional_dependencies = {
+            resolve(mod, dep) for dep in mod.metadata.optional_dependencies
+        }
         # In case someone includes a dependency in both DEPENDENCIES and OPTIONAL_DEPENDENCIES
-        dependencies = dependencies - optional_dependencies
-        graph.add_node(
-            mod, installed=apt.pkgs_installed(getattr(module_loaded, "PACKAGES", []))
-        )
+        dependencies = {
+            resolve(mod, dep) for dep in mod.metadata.dependencies
+        } - optional_dependencies
+        graph.add_node(mod, installed=apt.pkgs_installed(mod.metadata.packages))
         for dep in dependencies:
-            graph.add_edge(ModuleComp(dep.__name__, dep), mod, optional=False)
+            graph.add_edge(dep, mod, optional=False)
         for dep in optional_dependencies:
-            graph.add_edge(ModuleComp(dep.__name__, dep), mod, optional=True)
+            graph.add_edge(dep, mod, optional=True)
 
     return graph
 
 
 def filter_graph(G: nx.DiGraph) -> nx.DiGraph:
-    """Remove nodes with uninstalled packages."""
-    # Identify nodes with installed=False
-    nodes_to_remove = {
-        n for n, data in G.nodes(data=True) if not data.get("installed", False)
-    }
-
-    # Identify nodes that are only connected via optional=True edges
-    def is_only_optional(n):
-        """If all predecessors are optional, then this node is optional.
-
-        If there are no predecessors, then this node is not optional.
-        """
-        predecessors = list(G.predecessors(n))
-        if not predecessors:
-            return False
-
-        return all(
-            G.get_edge_data(pred, n).get("optional", False) for pred in predecessors
-        )
+    """Remove nodes with uninstalled packages.
 
-    # Identity nodes missing required dependencies
-    def is_missing_required(n, to_remove: set):
-        """If predecessor is missing, then this node is missing."""
-        predecessors = set(G.predecessors(n))
-        if not predecessors:
-            return False
-
-        # Only consider required predecessors
-        predecessors = {
-            pred
-            for pred in predecessors
-            if not G.get_edge_data(pred, n, {}).get("optional", False)
-        }
-        return bool(predecessors.intersection(to_remove))
-
-    # Collect nodes to remove
-    changed = True
-    while changed:
-        changed = False
-        for node in G.nodes:
-            if node not in nodes_to_remove and (
-                is_only_optional(node) or is_missing_required(node, nodes_to_remove)
-            ):
-                nodes_to_remove.add(node)
-                changed = True  # Ensure we check again after removals
+    A node is removed when its packages are not installed, when all of its
+    dependencies are optional, or when one of its required dependencies is
+    removed. Removals are propagated along required edges from a worklist, so
+    each node and edge is visited once, whatever the size of the graph.
+    """
+    nodes_to_remove = set()
+    for node, data in G.nodes(data=True):
+        if not data.get("installed", False):
+            nodes_to_remove.add(node)
+            continue
+        # If all predecessors are optional, then this node is optional.
+        # If there are no predecessors, then this node is not optional.
+        predecessors = G.pred[node]
+        if predecessors and all(
+            edge.get("optional", False) for edge in predecessors.values()
+        ):
+            nodes_to_remove.add(node)
+
+    # If a required predecessor is missing, then this node is missing.
+    queue = collections.deque(nodes_to_remove)
+    while queue:
+        node = queue.popleft()
+        for successor, edge in G.succ[node].items():
+            if successor in nodes_to_remove or edge.get("optional", False):
+                continue
+            nodes_to_remove.add(successor)
+            queue.append(successor)
 
     LOG.debug("Removing nodes %r", nodes_to_remove)
 
@@ -146,49 +229,107 @@ def filter_graph(G: nx.DiGraph) -> nx.DiGraph:
     return G
 
 
-def get_subgraph_to_path(G: nx.DiGraph, target: str) -> nx.DiGraph:
-    """Return subgraph to target."""
-    subgraph = nx.ancestors(G, target)
-    subgraph.add(target)
-    return G.subgraph(subgraph)
+def name_index(G: nx.DiGraph) -> typing.Dict[str, ModuleComp]:
+    """Map the short names of the modules of the graph to the modules."""
+    return {mod.name.rsplit(".")[-1]: mod for mod in G.nodes}
 
 
-def get_execution_order(
-    modules_mod: types.ModuleType, target=None
-) -> typing.List[ModuleComp]:
-    """Determine the execution order of modules based on dependencies.
+def get_ancestors(
+    G: nx.DiGraph, targets: typing.Iterable[ModuleComp]
+) -> typing.Set[ModuleComp]:
+    """Return targets and the modules they depend on, directly or not."""
+    seen = set(targets)
+    queue = collections.deque(seen)
+    while queue:
+        for pred in G.predecessors(queue.popleft()):
+            if pred not in seen:
+                seen.add(pred)
+                queue.append(pred)
+    return seen
 
-    Always include the utils module as the first module.
-    """
-    LOG.debug("Building dependency graph from %r...", modules_mod.__name__)
 
-    utils_mod = modules_mod.utils
-    utils = ModuleComp(str(utils_mod.__name__), utils_mod)
-    if target == "utils":
-        return [utils]
+def get_descendants(
+    G: nx.DiGraph, sources: typing.Iterable[ModuleComp]
+) -> typing.Set[ModuleComp]:
+    """Return sources and the modules depending on them, directly or not."""
+    seen = set(sources)
+    queue = collections.deque(seen)
+    while queue:
+        for succ in G.successors(queue.popleft()):
+            if succ not in seen:
+                seen.add(succ)
+                queue.append(succ)
+    return seen
 
-    graph = build_dependency_graph(modules_mod)
-    graph = filter_graph(graph)
+
+def prune_graph(G: nx.DiGraph) -> nx.DiGraph:
+    """Filter the graph and make sure it can be ordered."""
+    graph = filter_graph(G)
 
     if not nx.is_directed_acyclic_graph(graph):
         raise RuntimeError("Circular dependency detected!")
 
-    order = list(nx.lexicographical_topological_sort(graph))
-    if utils in order:
-        order.remove(utils)
-    if not target:
-        return [utils] + order
-
-    end_node = None
-    for mod in order:
-        if mod.name.rsplit(".")[-1] == target:
-            end_node = mod
-            break
-    else:
-        raise RuntimeError(f"Target {target!r} not found!")
+    return graph
 
-    sg: nx.DiGraph[ModuleComp] = get_subgraph_to_path(graph, end_node)
-    order = list(nx.lexicographical_topological_sort(sg))
-    if utils in order:
-        order.remove(utils)
-    return [utils] + order
+
+def sort_graph(
+    G: nx.DiGraph,
+    targets: typing.Union[str, typing.Iterable[str], None] = None,
+    index: typing.Optional[typing.Dict[str, ModuleComp]] = None,
+) -> typing.List[ModuleComp]:
+    """Sort the modules needed to reach targets, by short name.
+
+    Dependencies shared by several targets appear once. Without targets,
+    every module of the graph is returned. index is the name_index of G,
+    built when not given.
+    """
+    graph = G
+    if isinstance(targets, str):
+        targets = [targets]
+    if targets:
+        if index is None:
+            index = name_index(G)
+        mods = []
+        for target in targets:
+            if target not in index:
+                raise RuntimeError(f"Target {target!r} not found!")
+            mods.append(index[target])
+        graph = G.subgraph(get_ancestors(G, mods))
+
+    return list(nx.lexicographical_topological_sort(graph))
+
+
+def run_in_dependency_order(
+    G: nx.DiGraph,
+    mods: typing.Iterable[ModuleComp],
+    func: typing.Callable[[ModuleComp], typing.Any],
+    max_workers: typing.Optional[int] = None,
+    reverse: bool = False,
+) -> None:
+    """Call func on mods concurrently, each once the mods it depends on are done.
+
+    The first exception raised by func is raised once the running calls end,
+    mods depending on the failed one are not started. With reverse, each mod
+    waits for the mods depending on it instead, as teardowns do.
+    """
+    selected = set(mods)
+    blockers = nx.descendants if reverse else nx.ancestors
+    waiting = {
+        mod: (blockers(G, mod) & selected) if mod in G else set() for mod in selected
+    }
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        running: typing.Dict[concurrent.futures.Future, ModuleComp] = {}
+        while waiting or running:
+            for mod in sorted(mod for mod, deps in waiting.items() if not deps):
+                del waiting[mod]
+                running[executor.submit(func, mod)] = mod
+            if not running:
+                raise RuntimeError("Circular dependency detected!")
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                mod = running.pop(future)
+                future.result()
+                for deps in waiting.values():
+                    deps.discard(mod)
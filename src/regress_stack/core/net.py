@@ -0,0 +1,61 @@
+import logging
+import socket
+import typing
+
+if typing.TYPE_CHECKING:
+    import pyroute2
+
+LOG = logging.getLogger(__name__)
+
+# Interface flag set when the link is administratively up
+IFF_UP = 0x1
+
+
+def _link_index(ipr: "pyroute2.IPRoute", ifname: str) -> int:
+    indexes = ipr.link_lookup(ifname=ifname)
+    if not indexes:
+        raise RuntimeError(f"Interface {ifname!r} not found!")
+    return indexes[0]
+
+
+def default_route_address() -> typing.Tuple[str, int]:
+    """Return IPv4 address and prefix length of the default route interface."""
+    # Importing pyroute2 costs more than the query itself
+    import pyroute2
+
+    with pyroute2.IPRoute() as ipr:
+        routes = ipr.get_default_routes(family=socket.AF_INET)
+        if not routes:
+            raise RuntimeError("No IPv4 default route")
+        ifindex = routes[0].get_attr("RTA_OIF")
+        for addr in ipr.get_addr(family=socket.AF_INET, index=ifindex):
+            return addr.get_attr("IFA_ADDRESS"), addr["prefixlen"]
+    raise RuntimeError(f"No IPv4 address on default route interface {ifindex}")
+
+
+def ensure_address(ifname: str, address: str, prefixlen: int) -> bool:
+    """Assign address to interface ifname, return whether it was missing."""
+    import pyroute2
+
+    with pyroute2.IPRoute() as ipr:
+        index = _link_index(ipr, ifname)
+        for addr in ipr.get_addr(family=socket.AF_INET, index=index):
+            if addr.get_attr("IFA_ADDRESS") == address:
+                return False
+        LOG.debug("Adding %s/%d to %s", address, prefixlen, ifname)
+        ipr.addr("add", index=index, address=address, prefixlen=prefixlen)
+        return True
+
+
+def ensure_link_up(ifname: str) -> bool:
+    """Bring interface ifname up, return whether it was down."""
+    import pyroute2
+
+    with pyroute2.IPRoute() as ipr:
+        index = _link_index(ipr, ifname)
+        (link,) = ipr.get_links(index)
+        if link["flags"] & IFF_UP:
+            return False
+        LOG.debug("Setting %s up", ifname)
+        ipr.link("set", index=index, state="up")
+        return True
@@ -0,0 +1,183 @@
+import codecs
+import collections
+import itertools
+import json
+import logging
+import socket
+import time
+import typing
+
+LOG = logging.getLogger(__name__)
+
+Row = typing.Dict[str, typing.Any]
+Condition = typing.Callable[[typing.Dict[str, Row]], bool]
+
+
+def ovs_map(d: typing.Dict[str, str]) -> list:
+    """Encode d as an OVSDB map."""
+    return ["map", [[key, value] for key, value in d.items()]]
+
+
+def ovs_set(values: typing.Iterable[typing.Any]) -> list:
+    """Encode values as an OVSDB set."""
+    return ["set", list(values)]
+
+
+class Client:
+    """Minimal OVSDB JSON-RPC client (RFC 7047).
+
+    Echo requests of the server are answered, update notifications of
+    monitors are queued until read by wait().
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        self._sock = sock
+        self._ids = itertools.count()
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._updates: typing.Deque[list] = collections.deque()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._sock.close()
+
+    def _send(self, message: typing.Dict[str, typing.Any]) -> None:
+        self._sock.sendall(json.dumps(message).encode())
+
+    def _recv(self, deadline: float) -> typing.Dict[str, typing.Any]:
+        while True:
+            self._buffer = self._buffer.lstrip()
+            if self._buffer:
+                try:
+                    message, end = self._decoder.raw_decode(self._buffer)
+                except json.JSONDecodeError:
+                    pass
+                else:
+                    self._buffer = self._buffer[end:]
+                    return message
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise RuntimeError("Timed out waiting for OVSDB server")
+            self._sock.settimeout(timeout)
+            try:
+                data = self._sock.recv(65536)
+            except socket.timeout:
+                raise RuntimeError("Timed out waiting for OVSDB server") from None
+            if not data:
+                raise RuntimeError("OVSDB server closed the connection")
+            self._buffer += self._utf8.decode(data)
+
+    def _handle(self, message: typing.Dict[str, typing.Any]) -> None:
+        """Handle a request or notification of the server."""
+        method = message.get("method")
+        if method == "echo":
+            self._send(
+                {"id": message["id"], "result": message["params"], "error": None}
+            )
+        elif method == "update":
+            self._updates.append(message["params"])
+        else:
+            LOG.debug("Ignoring OVSDB message %r", message)
+
+    def call(self, method: str, *params: typing.Any, timeout: float = 30) -> typing.Any:
+        request_id = next(self._ids)
+        self._send({"method": method, "params": list(params), "id": request_id})
+        deadline = time.monotonic() + timeout
+        while True:
+            message = self._recv(deadline)
+            if "method" in message:
+                self._handle(message)
+                continue
+            if message.get("id") != request_id:
+                continue
+            if message.get("error") is not None:
+                raise RuntimeError(f"OVSDB {method} failed: {message['error']}")
+            return message["result"]
+
+    def transact(self, db: str, *operations: Row, timeout: float = 30) -> list:
+        """Execute operations in a single transaction, return their results."""
+        results = self.call("transact", db, *operations, timeout=timeout)
+        for operation, result in zip(operations, results):
+            if result and "error" in result:
+                raise RuntimeError(
+                    f"OVSDB transaction failed on {operation['op']}: "
+                    f"{result['error']}: {result.get('details', '')}"
+                )
+        if len(results) > len(operations):
+            # The commit itself failed, e.g. on a constraint violation
+            raise RuntimeError(f"OVSDB transaction failed: {results[-1]}")
+        return results
+
+    def wait(
+        self,
+        db: str,
+        table: str,
+        columns: typing.List[str],
+        condition: Condition,
+        timeout: float = 60,
+    ) -> typing.Dict[str, Row]:
+        """Monitor table until condition is true for its rows, return them.
+
+        Rows are keyed by uuid, condition is checked on the initial rows and
+        on each update notification.
+        """
+        monitor_id = f"wait-{next(self._ids)}"
+        rows: typing.Dict[str, Row] = {}
+        deadline = time.monotonic() + timeout
+        initial = self.call(
+            "monitor", db, monitor_id, {table: {"columns": columns}}, timeout=timeout
+        )
+        _apply_update(rows, initial.get(table, {}))
+        try:
+            while not condition(rows):
+                while not self._updates:
+                    message = self._recv(deadline)
+                    if "method" in message:
+                        self._handle(message)
+                update_id, updates = self._updates.popleft()
+                if update_id == monitor_id:
+                    _apply_update(rows, updates.get(table, {}))
+        finally:
+            self.call("monitor_cancel", monitor_id, timeout=timeout)
+        return rows
+
+
+def _apply_update(rows: typing.Dict[str, Row], updates: typing.Dict[str, Row]):
+    for uuid, update in updates.items():
+        if "new" in update:
+            rows[uuid] = update["new"]
+        else:
+            rows.pop(uuid, None)
+
+
+def connect(remote: str, timeout: float = 60) -> Client:
+    """Connect to an OVSDB server at tcp:IP:PORT or unix:PATH.
+
+    The server may still be starting: connection is retried until timeout.
+    """
+    kind, _, address = remote.partition(":")
+    if kind == "tcp":
+        host, _, port = address.rpartition(":")
+        family, sockaddr = socket.AF_INET, (host, int(port))
+    elif kind == "unix":
+        family, sockaddr = socket.AF_UNIX, address
+    else:
+        raise RuntimeError(f"Unsupported OVSDB remote {remote!r}")
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(sockaddr)
+            return Client(sock)
+        except OSError as e:
+            sock.close()
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Failed to connect to {remote}: {e}") from e
+            LOG.debug("OVSDB server %s not ready: %s", remote, e)
+            time.sleep(0.5)
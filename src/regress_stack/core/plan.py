@@ -0,0 +1,255 @@
+import dataclasses
+import json
+import logging
+import pathlib
+import types
+import typing
+
+import networkx as nx
+
+from regress_stack.core import apt, utils
+from regress_stack.core.metadata import ModuleMetadata
+from regress_stack.core.modules import (
+    ModuleComp,
+    build_dependency_graph,
+    get_descendants,
+    name_index,
+    prune_graph,
+    sort_graph,
+)
+
+LOG = logging.getLogger(__name__)
+
+PLAN_PATH = utils.REGRESS_STACK_DIR / "plan.json"
+PLAN_VERSION = 1
+GREEN_RUN_PATH = utils.REGRESS_STACK_DIR / "green-run.json"
+
+PackageVersions = typing.Dict[str, typing.Dict[str, typing.Optional[str]]]
+
+_PLAN: typing.Optional["ExecutionPlan"] = None
+# Modification time of the dpkg status when _PLAN was made
+_PLAN_MTIME: typing.Optional[float] = None
+
+
+class ExecutionPlan:
+    """Filtered dependency graph and module order, shared by all commands.
+
+    The utils module is always executed first.
+    """
+
+    graph: nx.DiGraph
+    utils: ModuleComp
+    metadata: typing.Dict[str, ModuleMetadata]
+
+    def __init__(
+        self,
+        graph: nx.DiGraph,
+        utils_mod: ModuleComp,
+        setup_done: typing.Iterable[str] = (),
+    ) -> None:
+        self.graph = graph
+        self.utils = utils_mod
+        self.metadata = {mod.name: mod.metadata for mod in (utils_mod, *graph.nodes)}
+        self._setup_done = set(setup_done)
+        self._order: typing.Optional[typing.List[ModuleComp]] = None
+        self._index = name_index(graph)
+
+    @classmethod
+    def build(cls, modules_mod: types.ModuleType) -> "ExecutionPlan":
+        LOG.debug("Building execution plan from %r...", modules_mod.__name__)
+        graph = build_dependency_graph(modules_mod)
+        utils_name = modules_mod.__name__ + ".utils"
+        for utils_mod in graph.nodes:
+            if utils_mod.name == utils_name:
+                break
+        else:
+            raise RuntimeError(f"Module {utils_name} not found!")
+        graph = prune_graph(graph)
+        mods = [utils_mod, *graph.nodes]
+        return cls(
+            graph,
+            utils_mod,
+            (mod.name for mod in mods if utils.is_setup_done(mod.name)),
+        )
+
+    def order(
+        self, targets: typing.Union[str, typing.Sequence[str], None] = None
+    ) -> typing.List[ModuleComp]:
+        """Determine the execution order of modules needed to reach targets."""
+        if isinstance(targets, str):
+            targets = [targets]
+        if targets:
+            # utils always comes first, it is not a target of its own
+            targets = [target for target in targets if target != "utils"]
+            if not targets:
+                return [self.utils]
+        elif self._order is not None:
+            return list(self._order)
+
+        order = sort_graph(self.graph, targets, self._index)
+        if self.utils in order:
+            order.remove(self.utils)
+        order.insert(0, self.utils)
+        if not targets:
+            self._order = order
+        return list(order)
+
+    def reset_order(
+        self, targets: typing.Union[str, typing.Sequence[str], None] = None
+    ) -> typing.List[ModuleComp]:
+        """Return the set-up modules to tear down to reset targets.
+
+        Modules depending on a target go with it, its dependencies are
+        kept. The modules are in execution order, to be torn down reversed.
+        """
+        if isinstance(targets, str):
+            targets = [targets]
+        selected = None
+        if targets:
+            mods = []
+            for target in targets:
+                if target == "utils":
+                    mods.append(self.utils)
+                elif target in self._index:
+                    mods.append(self._index[target])
+                else:
+                    raise RuntimeError(f"Target {target!r} not found!")
+            selected = set(mods) | get_descendants(
+                self.graph, [mod for mod in mods if mod in self.graph]
+            )
+        return [
+            mod
+            for mod in self.order()
+            if (selected is None or mod in selected) and self.is_setup_done(mod.name)
+        ]
+
+    def is_setup_done(self, name: str) -> bool:
+        return name in self._setup_done
+
+    def mark_setup(self, name: str) -> None:
+        utils.mark_setup(name)
+        self._setup_done.add(name)
+
+    def clear_setup(self, name: str) -> None:
+        utils.clear_setup(name)
+        self._setup_done.discard(name)
+
+    def package_versions(self, setup_only: bool = False) -> PackageVersions:
+        """Return the installed versions of the packages of each module.
+
+        With setup_only, only of the modules whose setup is done.
+        """
+        return {
+            name: apt.pkg_versions(metadata.packages)
+            for name, metadata in self.metadata.items()
+            if not setup_only or self.is_setup_done(name)
+        }
+
+    def affected_modules(
+        self, previous: PackageVersions, current: PackageVersions
+    ) -> typing.Set[str]:
+        """Return the modules whose packages, or dependencies' packages, changed."""
+        changed = {name for name in current if previous.get(name) != current[name]}
+        if self.utils.name in changed:
+            return set(current)
+        affected = get_descendants(
+            self.graph, (mod for mod in self.graph.nodes if mod.name in changed)
+        )
+        return changed | {mod.name for mod in affected}
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "version": PLAN_VERSION,
+            "utils": self.utils.name,
+            "modules": [
+                {
+                    "name": mod.name,
+                    "metadata": dataclasses.asdict(self.metadata[mod.name]),
+                    "setup_done": self.is_setup_done(mod.name),
+                }
+                for mod in self.order()
+            ],
+            "nodes": [mod.name for mod in self.graph.nodes],
+            "edges": [
+                [src.name, dst.name, bool(data.get("optional", False))]
+                for src, dst, data in self.graph.edges(data=True)
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: typing.Dict[str, typing.Any]) -> "ExecutionPlan":
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError(f"Unsupported plan version {data.get('version')!r}")
+        comps = {
+            entry["name"]: ModuleComp(
+                entry["name"], ModuleMetadata(**entry["metadata"])
+            )
+            for entry in data["modules"]
+        }
+        graph: nx.DiGraph = nx.DiGraph()
+        graph.add_nodes_from(comps[name] for name in data["nodes"])
+        for src, dst, optional in data["edges"]:
+            graph.add_edge(comps[src], comps[dst], optional=optional)
+        return cls(
+            graph,
+            comps[data["utils"]],
+            (entry["name"] for entry in data["modules"] if entry["setup_done"]),
+        )
+
+    def save(self, path: pathlib.Path = PLAN_PATH) -> pathlib.Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), indent=2))
+        LOG.debug("Saved execution plan to %s", path)
+        return path
+
+    @classmethod
+    def load(cls, path: pathlib.Path = PLAN_PATH) -> "ExecutionPlan":
+        LOG.debug("Loading execution plan from %s", path)
+        return cls.from_dict(json.loads(path.read_text()))
+
+
+def get_plan(modules_mod: types.ModuleType, from_saved: bool = False) -> ExecutionPlan:
+    """Return the execution plan of this process, building it once.
+
+    With from_saved, the plan handed over by a previous setup is reused
+    when there is one. The plan is made again when packages were installed
+    or removed since, as modules are filtered on their packages.
+    """
+    global _PLAN, _PLAN_MTIME
+
+    mtime = apt.status_mtime()
+    if _PLAN is not None and mtime != _PLAN_MTIME:
+        LOG.debug("Installed packages changed, planning again")
+        _PLAN = None
+    if _PLAN is None:
+        if from_saved and PLAN_PATH.exists():
+            _PLAN = ExecutionPlan.load(PLAN_PATH)
+        else:
+            _PLAN = ExecutionPlan.build(modules_mod)
+        _PLAN_MTIME = mtime
+
+    return _PLAN
+
+
+def save_green_run(versions: PackageVersions, path: pathlib.Path = GREEN_RUN_PATH):
+    """Record the package versions tested by a successful run."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(versions, indent=2))
+
+
+def forget_green_run(names: typing.Iterable[str], path: pathlib.Path = GREEN_RUN_PATH):
+    """Drop modules from the green run, their tests are selected again."""
+    versions = load_green_run(path)
+    if versions is None:
+        return
+    for name in names:
+        versions.pop(name, None)
+    save_green_run(versions, path)
+
+
+def load_green_run(
+    path: pathlib.Path = GREEN_RUN_PATH,
+) -> typing.Optional[PackageVersions]:
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
@@ -0,0 +1,345 @@
+import dataclasses
+import datetime
+import json
+import logging
+import pathlib
+import re
+import subprocess
+import typing
+import xml.etree.ElementTree as ET
+
+from regress_stack.core import utils
+
+LOG = logging.getLogger(__name__)
+
+# Final test statuses of the subunit v2 protocol
+FAILURES = ("fail", "uxsuccess")
+SKIPS = ("skip",)
+FINAL_STATUSES = ("success", "xfail", *FAILURES, *SKIPS)
+UNATTRIBUTED = "other"
+FAILED_TESTS_PATH = utils.REGRESS_STACK_DIR / "failed-tests.txt"
+
+
+@dataclasses.dataclass
+class TestResult:
+    __test__ = False
+
+    id: str
+    status: str
+    duration: float
+    module: str
+    details: str = ""
+    attempts: int = 1
+
+    @property
+    def failed(self) -> bool:
+        return self.status in FAILURES
+
+    @property
+    def flaky(self) -> bool:
+        """Whether the test failed, then passed when retried."""
+        return self.attempts > 1 and not self.failed
+
+
+class Attribution:
+    """Attribute tests to the first module whose regexes select them."""
+
+    def __init__(
+        self,
+        modules: typing.Iterable[
+            typing.Tuple[str, typing.Iterable[str], typing.Iterable[str]]
+        ],
+    ) -> None:
+        self._modules = [
+            (
+                name,
+                [re.compile(regex) for regex in include_regexes],
+                [re.compile(regex) for regex in exclude_regexes],
+            )
+            for name, include_regexes, exclude_regexes in modules
+        ]
+
+    def module(self, test_id: str) -> str:
+        for name, includes, excludes in self._modules:
+            if any(regex.search(test_id) for regex in includes) and not any(
+                regex.search(test_id) for regex in excludes
+            ):
+                return name
+        return UNATTRIBUTED
+
+
+class ResultCollector:
+    """Collect test results from a subunit v2 stream, as they are received.
+
+    Implements the testtools.StreamResult interface.
+    """
+
+    def __init__(
+        self,
+        attribution: Attribution,
+        progress: typing.Optional[typing.Callable[[TestResult], None]] = None,
+    ) -> None:
+        self.attribution = attribution
+        self.progress = progress
+        self.results: typing.List[TestResult] = []
+        self._started: typing.Dict[str, datetime.datetime] = {}
+        self._details: typing.Dict[str, typing.List[bytes]] = {}
+
+    def startTestRun(self) -> None:
+        pass
+
+    def stopTestRun(self) -> None:
+        pass
+
+    def status(
+        self,
+        test_id: typing.Optional[str] = None,
+        test_status: typing.Optional[str] = None,
+        test_tags=None,
+        runnable: bool = True,
+        file_name: typing.Optional[str] = None,
+        file_bytes: bytes = b"",
+        eof: bool = False,
+        mime_type=None,
+        route_code=None,
+        timestamp: typing.Optional[datetime.datetime] = None,
+    ) -> None:
+        if test_id is None:
+            # Output of the runner, not related to a test
+            return
+        if file_name is not None and file_bytes:
+            self._details.setdefault(test_id, []).append(file_bytes)
+        if test_status == "inprogress":
+            if timestamp is not None:
+                self._started[test_id] = timestamp
+            return
+        if test_status not in FINAL_STATUSES:
+            return
+        start = self._started.pop(test_id, None)
+        duration = 0.0
+        if start is not None and timestamp is not None:
+            duration = (timestamp - start).total_seconds()
+        details = b"".join(self._details.pop(test_id, []))
+        result = TestResult(
+            test_id,
+            test_status,
+            duration,
+            self.attribution.module(test_id),
+            details.decode(errors="replace") if test_status in FAILURES else "",
+        )
+        self.results.append(result)
+        if self.progress:
+            self.progress(result)
+
+
+def select_canary(
+    tests: typing.Iterable[str],
+    regexes: typing.Iterable[str],
+    failed: typing.Iterable[str] = (),
+) -> typing.List[str]:
+    """Select tests matching a canary regex, or which failed previously."""
+    compiled = [re.compile(regex) for regex in regexes]
+    failed = set(failed)
+    return [
+        test
+        for test in tests
+        if test in failed or any(regex.search(test) for regex in compiled)
+    ]
+
+
+def save_failed(
+    results: typing.Iterable[TestResult], path: pathlib.Path = FAILED_TESTS_PATH
+) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("".join(result.id + "\n" for result in results if result.failed))
+
+
+def load_failed(path: pathlib.Path = FAILED_TESTS_PATH) -> typing.List[str]:
+    if not path.exists():
+        return []
+    return path.read_text().splitlines()
+
+
+def run_problems(
+    tests: typing.Iterable[str],
+    results: typing.Iterable[TestResult],
+    returncode: int,
+) -> typing.List[str]:
+    """Return what went wrong with a run of tests, besides failed tests.
+
+    A run crashing or stopping early leaves tests without a result, one
+    failing without a failed test failed outside of the tests.
+    """
+    results = list(results)
+    seen = {result.id for result in results}
+    missing = [test for test in tests if test not in seen]
+    problems = []
+    if missing:
+        problems.append(f"{len(missing)} tests without a result, e.g. {missing[0]}")
+    if returncode and not any(result.failed for result in results):
+        problems.append(f"exit code {returncode} without a failed test")
+    return problems
+
+
+def retry_failed(
+    results: typing.Iterable[TestResult],
+    run: typing.Callable[[str], typing.Sequence[TestResult]],
+    retries: int,
+) -> typing.List[TestResult]:
+    """Rerun each failed test alone, until it passes or up to retries times.
+
+    Failed results are replaced by the result of their last attempt. A flaky
+    test keeps the details of its last failure.
+    """
+    final = []
+    for result in results:
+        while result.failed and result.attempts <= retries:
+            rerun = [other for other in run(result.id) if other.id == result.id]
+            if not rerun:
+                # e.g. a failure of the class fixtures, not of a single test
+                break
+            details = rerun[-1].details or result.details
+            result = dataclasses.replace(
+                rerun[-1], details=details, attempts=result.attempts + 1
+            )
+        final.append(result)
+    return final
+
+
+def log_progress(result: TestResult) -> None:
+    LOG.info(
+        "%s %s (%.2fs) [%s]", result.status, result.id, result.duration, result.module
+    )
+
+
+def read_subunit(stream: typing.IO[bytes], collector: ResultCollector) -> None:
+    import subunit
+
+    case = subunit.ByteStreamToStreamResult(stream, non_subunit_name="stdout")
+    collector.startTestRun()
+    try:
+        case.run(collector)
+    finally:
+        collector.stopTestRun()
+
+
+def run_subunit(
+    cmd: str,
+    args: typing.Sequence[str],
+    collector: ResultCollector,
+    env: typing.Optional[typing.Dict[str, str]] = None,
+    cwd: typing.Optional[str] = None,
+) -> int:
+    """Run a command writing a subunit stream, collect results while it runs."""
+    LOG.debug("Streaming results of %r", " ".join([cmd, *args]))
+    with subprocess.Popen(
+        [cmd, *args], stdout=subprocess.PIPE, env=env, cwd=cwd
+    ) as process:
+        assert process.stdout is not None
+        read_subunit(process.stdout, collector)
+    return process.returncode
+
+
+def _by_duration(results: typing.Iterable[TestResult]) -> typing.List[TestResult]:
+    return sorted(results, key=lambda result: result.duration, reverse=True)
+
+
+def summary(
+    results: typing.Sequence[TestResult], top: int = 10
+) -> typing.Dict[str, typing.Any]:
+    """Summarize results, ranking the slowest tests and modules."""
+    statuses: typing.Dict[str, int] = {}
+    modules: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+    for result in results:
+        statuses[result.status] = statuses.get(result.status, 0) + 1
+        module = modules.setdefault(
+            result.module,
+            {"module": result.module, "tests": 0, "failures": 0, "duration": 0.0},
+        )
+        module["tests"] += 1
+        module["failures"] += result.failed
+        module["duration"] += result.duration
+    return {
+        "tests": len(results),
+        "statuses": statuses,
+        "failures": [result.id for result in results if result.failed],
+        "flaky": [result.id for result in results if result.flaky],
+        "duration": sum(result.duration for result in results),
+        "slowest_tests": [
+            {"id": result.id, "module": result.module, "duration": result.duration}
+            for result in _by_duration(results)[:top]
+        ],
+        "slowest_modules": sorted(
+            modules.values(), key=lambda module: module["duration"], reverse=True
+        ),
+    }
+
+
+def write_json(results: typing.Sequence[TestResult], path: pathlib.Path) -> None:
+    report = summary(results)
+    report["results"] = [dataclasses.asdict(result) for result in results]
+    path.write_text(json.dumps(report, indent=2))
+
+
+def write_junit(results: typing.Sequence[TestResult], path: pathlib.Path) -> None:
+    suite = ET.Element(
+        "testsuite",
+        name="regress-stack",
+        tests=str(len(results)),
+        failures=str(sum(result.failed for result in results)),
+        skipped=str(sum(result.status in SKIPS for result in results)),
+        time=f"{sum(result.duration for result in results):.3f}",
+    )
+    for result in results:
+        # Tempest ids carry their tags: tempest.api.Class.test[id-...,smoke]
+        classname, _, name = result.id.partition("[")[0].rpartition(".")
+        case = ET.SubElement(
+            suite,
+            "testcase",
+            classname=classname,
+            name=name,
+            time=f"{result.duration:.3f}",
+        )
+        properties = ET.SubElement(case, "properties")
+        properties.append(ET.Element("property", name="module", value=result.module))
+        if result.attempts > 1:
+            properties.append(
+                ET.Element("property", name="attempts", value=str(result.attempts))
+            )
+        if result.failed:
+            ET.SubElement(case, "failure", message=result.status).text = result.details
+        elif result.flaky:
+            ET.SubElement(case, "system-err").text = result.details
+        elif result.status in SKIPS:
+            ET.SubElement(case, "skipped")
+    ET.ElementTree(suite).write(path, encoding="unicode", xml_declaration=True)
+
+
+def log_summary(results: typing.Sequence[TestResult], top: int = 10) -> None:
+    report = summary(results, top)
+    LOG.info(
+        "Ran %d tests in %.2fs: %s",
+        report["tests"],
+        report["duration"],
+        report["statuses"],
+    )
+    if report["flaky"]:
+        LOG.warning("Passed on retry:")
+        for test_id in report["flaky"]:
+            LOG.warning("  %s", test_id)
+    if report["failures"]:
+        LOG.error("Failed tests:")
+        for test_id in report["failures"]:
+            LOG.error("  %s", test_id)
+    LOG.info("Slowest tests:")
+    for test in report["slowest_tests"]:
+        LOG.info("  %8.2fs %s [%s]", test["duration"], test["id"], test["module"])
+    LOG.info("Slowest modules:")
+    for module in report["slowest_modules"]:
+        LOG.info(
+            "  %8.2fs %s (%d tests, %d failures)",
+            module["duration"],
+            module["module"],
+            module["tests"],
+            module["failures"],
+        )
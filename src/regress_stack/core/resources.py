@@ -0,0 +1,186 @@
+import contextlib
+import dataclasses
+import fnmatch
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+import typing
+
+LOG = logging.getLogger(__name__)
+
+CGROUP_ROOT = pathlib.Path("/sys/fs/cgroup/system.slice")
+UNIT_SUFFIX = ".service"
+
+Sample = typing.Dict[str, int]
+
+
+def find_units(
+    patterns: typing.Iterable[str], root: pathlib.Path = CGROUP_ROOT
+) -> typing.Dict[str, pathlib.Path]:
+    """Return the cgroup of the running units matching patterns.
+
+    Template instances (ceph-osd@0) are found in their template slice.
+    """
+    patterns = list(patterns)
+    units = {}
+    for dirpath, dirnames, _ in os.walk(root):
+        for dirname in dirnames:
+            if not dirname.endswith(UNIT_SUFFIX):
+                continue
+            unit = dirname[: -len(UNIT_SUFFIX)]
+            if any(fnmatch.fnmatchcase(unit, pattern) for pattern in patterns):
+                units[unit] = pathlib.Path(dirpath, dirname)
+        # Units are only nested in slices
+        dirnames[:] = [dirname for dirname in dirnames if dirname.endswith(".slice")]
+    return units
+
+
+def _read_keyed(path: pathlib.Path) -> typing.Dict[str, int]:
+    values = {}
+    for line in path.read_text().splitlines():
+        key, _, value = line.partition(" ")
+        values[key] = int(value)
+    return values
+
+
+def read_sample(cgroup: pathlib.Path) -> Sample:
+    """Read CPU time (usec), memory (bytes) and IO (bytes) counters of cgroup."""
+    sample = {
+        "cpu_usec": _read_keyed(cgroup / "cpu.stat")["usage_usec"],
+        "memory": int((cgroup / "memory.current").read_text()),
+        "io_read": 0,
+        "io_write": 0,
+    }
+    io_stat = cgroup / "io.stat"
+    if io_stat.exists():
+        # One line per device: "8:0 rbytes=1 wbytes=2 rios=3 ..."
+        for line in io_stat.read_text().splitlines():
+            for field in line.split()[1:]:
+                key, _, value = field.partition("=")
+                if key == "rbytes":
+                    sample["io_read"] += int(value)
+                elif key == "wbytes":
+                    sample["io_write"] += int(value)
+    return sample
+
+
+@dataclasses.dataclass
+class UnitSummary:
+    samples: int = 0
+    memory_peak: int = 0
+    memory_total: int = 0
+    first: typing.Optional[typing.Tuple[float, Sample]] = None
+    last: typing.Optional[typing.Tuple[float, Sample]] = None
+
+    def add(self, timestamp: float, sample: Sample) -> None:
+        self.samples += 1
+        self.memory_peak = max(self.memory_peak, sample["memory"])
+        self.memory_total += sample["memory"]
+        if self.first is None:
+            self.first = (timestamp, sample)
+        self.last = (timestamp, sample)
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        assert self.first is not None and self.last is not None
+        (start, first), (end, last) = self.first, self.last
+        elapsed = end - start
+        cpu = (last["cpu_usec"] - first["cpu_usec"]) / 1e6
+        return {
+            "samples": self.samples,
+            "memory_peak": self.memory_peak,
+            "memory_average": self.memory_total // self.samples,
+            "cpu_seconds": cpu,
+            "cpu_average": cpu / elapsed if elapsed else 0.0,
+            "io_read": last["io_read"] - first["io_read"],
+            "io_write": last["io_write"] - first["io_write"],
+        }
+
+
+class Sampler(threading.Thread):
+    """Sample the cgroup counters of units matching patterns, every interval.
+
+    Samples are appended to series as JSON lines, the summary is written
+    to summary when stopped.
+    """
+
+    def __init__(
+        self,
+        patterns: typing.Iterable[str],
+        series: pathlib.Path,
+        summary: pathlib.Path,
+        interval: float = 5.0,
+        root: pathlib.Path = CGROUP_ROOT,
+    ) -> None:
+        super().__init__(name="resource-sampler", daemon=True)
+        self.patterns = list(patterns)
+        self.series = series
+        self.summary = summary
+        self.interval = interval
+        self.root = root
+        self.units: typing.Dict[str, UnitSummary] = {}
+        self._stop_event = threading.Event()
+
+    def sample(self, output: typing.TextIO) -> None:
+        timestamp = time.time()
+        samples = {}
+        # Units are started by the setup, look them up every time
+        for unit, cgroup in find_units(self.patterns, self.root).items():
+            try:
+                samples[unit] = read_sample(cgroup)
+            except (OSError, KeyError, ValueError):
+                # Unit stopped while being read
+                continue
+            self.units.setdefault(unit, UnitSummary()).add(timestamp, samples[unit])
+        if samples:
+            output.write(json.dumps({"time": timestamp, "units": samples}) + "\n")
+            output.flush()
+
+    def run(self) -> None:
+        with self.series.open("a") as output:
+            while True:
+                try:
+                    self.sample(output)
+                except Exception:
+                    LOG.exception("Failed to sample resources")
+                if self._stop_event.wait(self.interval):
+                    return
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+        self.summary.write_text(
+            json.dumps(
+                {unit: summary.to_dict() for unit, summary in self.units.items()},
+                indent=2,
+            )
+        )
+        LOG.info("Resource usage written to %s", self.summary)
+
+
+@contextlib.contextmanager
+def sampling(
+    patterns: typing.Iterable[str],
+    directory: pathlib.Path,
+    name: str,
+    interval: float = 5.0,
+):
+    """Sample resources of units matching patterns while in context."""
+    patterns = list(patterns)
+    if not patterns or interval <= 0 or not CGROUP_ROOT.exists():
+        yield None
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    sampler = Sampler(
+        patterns,
+        directory / f"{name}-series.jsonl",
+        directory / f"{name}-summary.json",
+        interval,
+    )
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
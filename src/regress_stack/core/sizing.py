@@ -0,0 +1,164 @@
+import dataclasses
+import json
+import logging
+import os
+import typing
+
+from regress_stack.core import utils
+
+LOG = logging.getLogger(__name__)
+
+# Choices of the last setup, kept by the next ones
+SETTINGS_PATH = utils.REGRESS_STACK_DIR / "sizing.json"
+
+PROFILES = ("minimal", "ci", "perf")
+DEFAULT_PROFILE = "minimal"
+# Rough memory used by one worker process of an OpenStack service
+WORKER_MEMORY_GIB = 0.25
+# Services running workers, which share the host memory
+WORKER_SERVICES = 12
+
+# Ceph OSDs, backed by loop files
+OSD_COUNT = 3
+OSD_SIZE_GIB = 2
+# Ephemeral storage places the MySQL data and the OSD backing files in
+# tmpfs, leaving the rest of the memory to the services and instances
+EPHEMERAL_MYSQL_GIB = 2
+EPHEMERAL_RESERVE_GIB = 6
+MIN_OSD_SIZE_GIB = 1
+
+_PROFILE = DEFAULT_PROFILE
+_STORAGE: typing.Optional["Storage"] = None
+
+
+@dataclasses.dataclass(frozen=True)
+class Sizing:
+    """Worker, process and database pool counts of the services."""
+
+    workers: int
+    wsgi_processes: int
+    max_pool_size: int
+
+
+@dataclasses.dataclass(frozen=True)
+class Storage:
+    """Sizes of the data stores, in GiB, and whether they live in tmpfs."""
+
+    ephemeral: bool
+    mysql_gib: int
+    osd_gib: int
+
+
+def host_resources() -> typing.Tuple[int, float]:
+    """Return the number of cores and the memory of the host, in GiB."""
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return os.cpu_count() or 1, memory / 1024**3
+
+
+def _check_profile(profile: str):
+    if profile not in PROFILES:
+        raise RuntimeError(f"Unknown profile {profile!r}, expected one of {PROFILES}")
+
+
+def compute(profile: str, cores: int, memory_gib: float) -> Sizing:
+    """Size the services for profile on a host with cores and memory_gib.
+
+    minimal runs a single process everywhere, enough for smoke tests. ci
+    uses a few cores to shorten test runs, perf sizes for throughput.
+    Worker counts are bounded by what the host memory can hold.
+    """
+    _check_profile(profile)
+    if profile == "minimal":
+        return Sizing(workers=1, wsgi_processes=1, max_pool_size=1)
+    # Keep half of the memory for the databases, the broker and instances
+    memory_bound = int(memory_gib / 2 / (WORKER_SERVICES * WORKER_MEMORY_GIB))
+    if profile == "ci":
+        workers = max(1, min(cores // 4, memory_bound, 2))
+        return Sizing(workers=workers, wsgi_processes=workers, max_pool_size=5)
+    workers = max(1, min(cores // 2, memory_bound))
+    return Sizing(workers=workers, wsgi_processes=workers, max_pool_size=10)
+
+
+def _load_settings() -> typing.Dict[str, typing.Any]:
+    if not SETTINGS_PATH.exists():
+        return {}
+    return json.loads(SETTINGS_PATH.read_text())
+
+
+def _save_settings(**settings: typing.Any):
+    SETTINGS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    SETTINGS_PATH.write_text(json.dumps({**_load_settings(), **settings}, indent=2))
+
+
+def set_profile(profile: typing.Optional[str] = None):
+    """Select profile, by default the one of the previous setup."""
+    global _PROFILE
+    if profile is None:
+        profile = _load_settings().get("profile", DEFAULT_PROFILE)
+    _check_profile(profile)
+    _PROFILE = profile
+    _save_settings(profile=profile)
+
+
+def current() -> Sizing:
+    """Return the sizing of the selected profile on this host."""
+    sizing = compute(_PROFILE, *host_resources())
+    LOG.debug("Sizing for profile %r: %s", _PROFILE, sizing)
+    return sizing
+
+
+def compute_storage(ephemeral: bool, memory_gib: float) -> Storage:
+    """Size the data stores on a host with memory_gib.
+
+    Ephemeral OSDs shrink to what the memory can hold, down to
+    MIN_OSD_SIZE_GIB; below that the host does not have enough memory.
+    """
+    if not ephemeral:
+        return Storage(ephemeral=False, mysql_gib=0, osd_gib=OSD_SIZE_GIB)
+    available = memory_gib - EPHEMERAL_RESERVE_GIB - EPHEMERAL_MYSQL_GIB
+    osd_gib = min(OSD_SIZE_GIB, int(available // OSD_COUNT))
+    if osd_gib < MIN_OSD_SIZE_GIB:
+        needed = EPHEMERAL_RESERVE_GIB + EPHEMERAL_MYSQL_GIB
+        needed += OSD_COUNT * MIN_OSD_SIZE_GIB
+        raise RuntimeError(
+            f"Ephemeral storage needs {needed} GiB of memory, "
+            f"the host has {memory_gib:.1f} GiB"
+        )
+    return Storage(ephemeral=True, mysql_gib=EPHEMERAL_MYSQL_GIB, osd_gib=osd_gib)
+
+
+def _saved_storage() -> typing.Optional[Storage]:
+    saved = _load_settings().get("storage")
+    return Storage(**saved) if saved else None
+
+
+def set_ephemeral(ephemeral: typing.Optional[bool] = None):
+    """Select ephemeral storage or not, by default as the previous setup.
+
+    Ephemeral storage is refused when memory is insufficient. Once selected,
+    the next setups keep it and its sizes, which the tmpfs in place were
+    made for, until it is turned off while no tmpfs is mounted.
+    """
+    global _STORAGE
+    saved = _saved_storage()
+    if saved is not None:
+        if ephemeral is not False:
+            _STORAGE = saved
+            return
+        mounts = utils.tmpfs_mounts()
+        if mounts:
+            raise RuntimeError(
+                "Ephemeral storage is still mounted on "
+                f"{', '.join(map(str, mounts))}, reboot before turning it off"
+            )
+        _save_settings(storage=None)
+    _STORAGE = compute_storage(bool(ephemeral), host_resources()[1])
+    if ephemeral:
+        _save_settings(storage=dataclasses.asdict(_STORAGE))
+
+
+def storage() -> Storage:
+    """Return the sizes of the data stores on this host."""
+    if _STORAGE is not None:
+        return _STORAGE
+    return _saved_storage() or compute_storage(False, host_resources()[1])
@@ -0,0 +1,54 @@
+import json
+import pathlib
+import typing
+
+from regress_stack.core import utils
+
+# Written in the workspace, so that a new workspace is never taken as current
+FINGERPRINT_FILE = ".regress-stack-fingerprint"
+
+
+def workspace_fingerprint(
+    endpoints: typing.Iterable[typing.Any],
+    versions: typing.Dict[str, typing.Any],
+    discover_args: typing.Sequence[str],
+) -> str:
+    """Fingerprint what tempest.conf is generated from.
+
+    The catalog changes with the services deployed, and when they are
+    recreated (e.g. by a reset), the packages with upgrades.
+    """
+    catalog = sorted(
+        (endpoint.service_id, endpoint.interface, endpoint.region_id, endpoint.url)
+        for endpoint in endpoints
+    )
+    return utils.fingerprint(
+        json.dumps(
+            {
+                "catalog": catalog,
+                "packages": versions,
+                "discover_args": list(discover_args),
+            },
+            sort_keys=True,
+        )
+    )
+
+
+def is_initialized(workspace: pathlib.Path) -> bool:
+    return (workspace / ".stestr.conf").exists()
+
+
+def is_current(workspace: pathlib.Path, fingerprint: str) -> bool:
+    """Return whether the configuration of workspace matches fingerprint."""
+    path = workspace / FINGERPRINT_FILE
+    if not (workspace / "etc" / "tempest.conf").exists() or not path.exists():
+        return False
+    return path.read_text().strip() == fingerprint
+
+
+def save_fingerprint(workspace: pathlib.Path, fingerprint: str):
+    (workspace / FINGERPRINT_FILE).write_text(fingerprint + "\n")
+
+
+def clear_fingerprint(workspace: pathlib.Path):
+    (workspace / FINGERPRINT_FILE).unlink(missing_ok=True)
@@ -1,19 +1,44 @@
+import concurrent.futures
 import contextlib
 import functools
+import hashlib
 import ipaddress
+import json
 import logging
 import pathlib
 import platform
-import socket
 import subprocess
+import threading
 import time
 import typing
 
-import pyroute2
+from regress_stack.core import net
 
 LOG = logging.getLogger(__name__)
 
 REGRESS_STACK_DIR = pathlib.Path("/var/lib/regress-stack/")
+CONFIG_FINGERPRINTS = REGRESS_STACK_DIR / "config-fingerprints.json"
+TMPFS_DIR = REGRESS_STACK_DIR / "tmpfs"
+
+# Fingerprints of configuration applied by the current setup, keyed by file
+_PENDING_FINGERPRINTS: typing.Dict[str, typing.Set[str]] = {}
+
+# State each command reads or changes; running a command of a domain
+# invalidates the cached reads of that domain.
+COMMAND_DOMAINS = {
+    "mysql": "mysql",
+    "rabbitmqctl": "rabbitmq",
+    "ceph": "ceph",
+    "ceph-volume": "ceph",
+    "virsh": "libvirt",
+    "nova-manage": "nova",
+    "losetup": "loop",
+}
+# Output of read only commands, keyed by domain then command
+_RUN_CACHE: typing.Dict[str, typing.Dict[typing.Hashable, str]] = {}
+# Bumped on each invalidation, keyed by domain, None for all the domains
+_RUN_CACHE_GENERATION: typing.Dict[typing.Optional[str], int] = {}
+_RUN_CACHE_LOCK = threading.Lock()
 
 
 @contextlib.contextmanager
@@ -49,14 +74,69 @@ def measure_time(func):
     return wrapper
 
 
+def _command_domain(cmd_args: typing.Sequence[str]) -> typing.Optional[str]:
+    args = iter(cmd_args)
+    for arg in args:
+        if arg == "sudo":
+            continue
+        if arg == "--user":
+            next(args, None)
+            continue
+        return COMMAND_DOMAINS.get(pathlib.PurePath(arg).name)
+    return None
+
+
+def invalidate_cache(domain: typing.Optional[str] = None):
+    """Forget the cached reads of domain, or of every domain."""
+    with _RUN_CACHE_LOCK:
+        _RUN_CACHE_GENERATION[domain] = _RUN_CACHE_GENERATION.get(domain, 0) + 1
+        if domain is None:
+            _RUN_CACHE.clear()
+        else:
+            _RUN_CACHE.pop(domain, None)
+
+
+def _cache_generation(domain: str) -> typing.Tuple[int, int]:
+    return (
+        _RUN_CACHE_GENERATION.get(None, 0),
+        _RUN_CACHE_GENERATION.get(domain, 0),
+    )
+
+
 def run(
     cmd: str,
     args: typing.Sequence[str] = (),
     env: typing.Optional[typing.Dict[str, str]] = None,
     cwd: typing.Optional[str] = None,
+    input: typing.Optional[str] = None,
+    cache_domain: typing.Optional[str] = None,
 ) -> str:
+    """Run cmd with args, return its output.
+
+    A cache_domain marks the command as a pure read of that domain: its
+    output is reused until a command of the domain runs without one. An
+    output read while the domain is invalidated is not cached, it may
+    predate the change.
+    """
     cmd_args = [cmd]
     cmd_args.extend(args)
+    if cache_domain is not None:
+        key = (
+            tuple(cmd_args),
+            tuple(sorted(env.items())) if env else None,
+            cwd,
+            input,
+        )
+        with _RUN_CACHE_LOCK:
+            cached = _RUN_CACHE.get(cache_domain, {}).get(key)
+            generation = _cache_generation(cache_domain)
+        if cached is not None:
+            LOG.debug("Command %r cached in %s", " ".join(cmd_args), cache_domain)
+            return cached
+    else:
+        domain = _command_domain(cmd_args)
+        if domain is not None:
+            invalidate_cache(domain)
     try:
         result = subprocess.run(
             cmd_args,
@@ -67,6 +147,7 @@ def run(
             stderr=subprocess.PIPE,
             env=env,
             cwd=cwd,
+            input=input,
         )
     except subprocess.CalledProcessError as e:
         LOG.error("Command %r failed with exit code %d", cmd, e.returncode)
@@ -79,24 +160,135 @@ def run(
         result.stdout,
         result.stderr,
     )
+    if cache_domain is not None:
+        with _RUN_CACHE_LOCK:
+            if _cache_generation(cache_domain) == generation:
+                _RUN_CACHE.setdefault(cache_domain, {})[key] = result.stdout
     return result.stdout
 
 
+T = typing.TypeVar("T")
+
+
+def parallel(*funcs: typing.Callable[[], T]) -> typing.List[T]:
+    """Call funcs concurrently, return their results in order.
+
+    The first exception raised is raised once all calls end.
+    """
+    with concurrent.futures.ThreadPoolExecutor(len(funcs) or None) as executor:
+        futures = [executor.submit(func) for func in funcs]
+    return [future.result() for future in futures]
+
+
 def sudo(
-    cmd: str, args: typing.Sequence[str], user: typing.Optional[str] = None
+    cmd: str,
+    args: typing.Sequence[str],
+    user: typing.Optional[str] = None,
+    cache_domain: typing.Optional[str] = None,
 ) -> str:
     opts = []
     if user:
         opts = ["--user", user]
-    return run("sudo", opts + [cmd, *args])
+    return run("sudo", opts + [cmd, *args], cache_domain=cache_domain)
+
+
+def service_active(service: str) -> bool:
+    result = subprocess.run(["systemctl", "is-active", "--quiet", service])
+    return result.returncode == 0
 
 
-def restart_service(service: str):
+def restart_service(service: str, changed: bool = True) -> bool:
+    """Restart service, unless its configuration did not change and it runs.
+
+    Return whether it was restarted.
+    """
+    if not changed and service_active(service):
+        LOG.debug("Configuration of %s did not change, not restarting", service)
+        return False
     run("systemctl", ["restart", service])
+    return True
+
+
+def restart_apache(changed: bool = True) -> bool:
+    return restart_service("apache2", changed)
+
+
+def stop_service(*services: str):
+    """Stop services; the next setup starts them again."""
+    run("systemctl", ["stop", *services])
+
 
+def move_to_tmpfs(path: pathlib.Path, size_mib: int) -> bool:
+    """Bind mount a tmpfs copy of path over it, return whether it was moved.
 
-def restart_apache():
-    restart_service("apache2")
+    Writes only reach memory. After a reboot, path shows its content from
+    before the move again.
+    """
+    if path.is_mount():
+        return False
+    mountpoint = TMPFS_DIR / path.name
+    mountpoint.mkdir(parents=True, exist_ok=True)
+    if not mountpoint.is_mount():
+        run(
+            "mount",
+            ["-t", "tmpfs", "-o", f"size={size_mib}m", "tmpfs", str(mountpoint)],
+        )
+    path.mkdir(parents=True, exist_ok=True)
+    # Copies path itself, with its ownership and mode
+    run("cp", ["-a", str(path), str(mountpoint)])
+    run("mount", ["--bind", str(mountpoint / path.name), str(path)])
+    LOG.info("Moved %s to a tmpfs of %d MiB", path, size_mib)
+    return True
+
+
+def tmpfs_mounts() -> typing.List[pathlib.Path]:
+    """Return the tmpfs mounted by move_to_tmpfs."""
+    if not TMPFS_DIR.exists():
+        return []
+    return sorted(path for path in TMPFS_DIR.iterdir() if path.is_mount())
+
+
+def fingerprint(data: str) -> str:
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def file_fingerprint(path: typing.Union[str, pathlib.Path]) -> typing.Optional[str]:
+    try:
+        return hashlib.sha256(pathlib.Path(path).read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def _load_fingerprints() -> typing.Dict[str, typing.Dict[str, str]]:
+    if not CONFIG_FINGERPRINTS.exists():
+        return {}
+    return json.loads(CONFIG_FINGERPRINTS.read_text())
+
+
+def config_applied(path: str, desired: str) -> bool:
+    """Check if desired configuration was applied to path by a completed setup.
+
+    The file must not have been modified since, by a package upgrade for
+    example.
+    """
+    content = _load_fingerprints().get(path, {}).get(desired)
+    return content is not None and content == file_fingerprint(path)
+
+
+def record_config(path: str, desired: str):
+    """Remember desired configuration of path, saved when the setup completes."""
+    _PENDING_FINGERPRINTS.setdefault(path, set()).add(desired)
+
+
+def _save_fingerprints():
+    if not _PENDING_FINGERPRINTS:
+        return
+    fingerprints = _load_fingerprints()
+    for path, desired in _PENDING_FINGERPRINTS.items():
+        content = file_fingerprint(path)
+        fingerprints[path] = {digest: content for digest in sorted(desired)}
+    CONFIG_FINGERPRINTS.write_text(json.dumps(fingerprints, indent=2))
+    _PENDING_FINGERPRINTS.clear()
 
 
 @functools.lru_cache()
@@ -107,11 +299,7 @@ def fqdn() -> str:
 @functools.lru_cache()
 def _get_local_ip_by_default_route() -> typing.Tuple[str, int]:
     """Get host IP from default route interface."""
-    with pyroute2.NDB() as ndb:
-        default_route_ifindex = ndb.routes["default"]["oif"]
-        iface = ndb.interfaces[default_route_ifindex]
-        ipaddr = iface.ipaddr[socket.AF_INET]
-        return ipaddr["address"], ipaddr["prefixlen"]
+    return net.default_route_address()
 
 
 @functools.lru_cache()
@@ -173,11 +361,17 @@ def release() -> str:
 def mark_setup(name: str):
     """Mark task as done."""
     REGRESS_STACK_DIR.mkdir(parents=True, exist_ok=True)
+    _save_fingerprints()
     done_file = REGRESS_STACK_DIR / (name + ".setup")
     done_file.touch()
     return done_file
 
 
+def clear_setup(name: str):
+    """Mark task as not done."""
+    (REGRESS_STACK_DIR / (name + ".setup")).unlink(missing_ok=True)
+
+
 def is_setup_done(name: str) -> bool:
     """Check if task is done."""
     done_file = REGRESS_STACK_DIR / (name + ".setup")
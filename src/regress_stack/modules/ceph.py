@@ -1,4 +1,5 @@
 import functools
+import json
 import logging
 import shutil
 import subprocess
@@ -7,6 +8,7 @@ import uuid
 from pathlib import Path
 
 from regress_stack.core import apt as core_apt
+from regress_stack.core import sizing as core_sizing
 from regress_stack.core import utils as core_utils
 from regress_stack.modules import utils as module_utils
 
@@ -14,6 +16,7 @@ LOG = logging.getLogger(__name__)
 
 PACKAGES = ["ceph-mgr", "ceph-mon", "ceph-osd", "ceph-volume"]
 LOGS = ["/var/log/ceph/"]
+SERVICES = ["ceph-mon@*", "ceph-mgr@*", "ceph-osd@*"]
 
 UUID_PATH = Path("/etc/ceph/fsid")
 
@@ -31,9 +34,7 @@ MGR_SETUP_DONE = MGR_DATA_FOLDER / "done"
 LOOP_DEVICE_PATH = Path("/var/lib/ceph-osd")
 RBD_UUID = Path("/etc/ceph/rbd_secret_uuid")
 
-OSD_SIZE_GB = 2
 BS = 4096
-COUNT = (OSD_SIZE_GB * 1024**3) // BS
 
 CEPH_OSD_UNIT_PATH = Path("/etc/systemd/system/ceph-osd@.service")
 CEPH_OSD_SYSTEMD = r"""
@@ -112,8 +113,32 @@ def setup():
     import_keyrings()
     setup_mon()
     setup_mgr()
-    for i in range(3):
-        core_utils.exists_cache(LOOP_DEVICE_PATH / f"ceph-{i}")(setup_osd)(i)
+    # Created once, the daemons are down again after a reboot
+    core_utils.restart_service(f"ceph-mon@{core_utils.fqdn()}", changed=False)
+    core_utils.restart_service(f"ceph-mgr@{core_utils.fqdn()}", changed=False)
+    storage = core_sizing.storage()
+    if storage.ephemeral:
+        move_osds_to_tmpfs(storage.osd_gib)
+    for i in range(core_sizing.OSD_COUNT):
+        setup_osd(i, storage.osd_gib)
+
+
+def teardown():
+    """Delete the pools and the OSDs; the monitor and the manager are kept."""
+    if not installed():
+        return
+    pools = [pool for pool in list_pools() if not pool.startswith(".")]
+    if pools:
+        core_utils.run(
+            "ceph", ["config", "set", "mon", "mon_allow_pool_delete", "true"]
+        )
+    for pool in pools:
+        core_utils.run(
+            "ceph",
+            ["osd", "pool", "rm", pool, pool, "--yes-i-really-really-mean-it"],
+        )
+    for i in range(core_sizing.OSD_COUNT):
+        teardown_osd(i)
 
 
 @functools.lru_cache
@@ -309,28 +334,68 @@ def setup_mgr():
     return MGR_SETUP_DONE
 
 
-def setup_loop_device(name: str) -> str:
-    if not LOOP_DEVICE_PATH.exists():
-        LOOP_DEVICE_PATH.mkdir(parents=True, exist_ok=True)
-    core_utils.run(
-        "dd",
-        ["if=/dev/zero", f"of={LOOP_DEVICE_PATH / name}", f"bs={BS}", f"count={COUNT}"],
-    )
-    lo_device = core_utils.run(
-        "losetup", ["--show", "--find", str(LOOP_DEVICE_PATH / name)]
+def attached_loop_device(path: Path) -> typing.Optional[str]:
+    """Return the loop device backed by path, if attached."""
+    # Lines look like "/dev/loop0: []: (/var/lib/ceph-osd/ceph-0)"
+    output = core_utils.run(
+        "losetup", ["--associated", str(path)], cache_domain="loop"
     ).strip()
-    LOG.debug("Created loop device %s", lo_device)
+    if not output:
+        return None
+    return output.splitlines()[0].partition(":")[0]
+
+
+def move_osds_to_tmpfs(osd_gib: int):
+    if LOOP_DEVICE_PATH.is_mount():
+        return
+    if any(LOOP_DEVICE_PATH.glob("ceph-*")):
+        # Attached loop devices would keep using the files on disk
+        raise RuntimeError(
+            f"OSD backing files exist in {LOOP_DEVICE_PATH}, "
+            "reset ceph before using ephemeral storage"
+        )
+    # Some room for the filesystem and the .partial files being renamed
+    size_mib = core_sizing.OSD_COUNT * osd_gib * 1024 + 64
+    core_utils.move_to_tmpfs(LOOP_DEVICE_PATH, size_mib)
+
+
+def setup_loop_device(name: str, size_gib: int) -> str:
+    """Attach the loop device backed by name, creating the file if needed.
+
+    Backing files outlive reboots, loop devices do not.
+    """
+    path = LOOP_DEVICE_PATH / name
+    if not path.exists():
+        LOOP_DEVICE_PATH.mkdir(parents=True, exist_ok=True)
+        # Written aside, an interrupted dd does not leave a short backing file
+        partial = path.with_suffix(".partial")
+        core_utils.run(
+            "dd",
+            [
+                "if=/dev/zero",
+                f"of={partial}",
+                f"bs={BS}",
+                f"count={size_gib * 1024**3 // BS}",
+            ],
+        )
+        partial.rename(path)
+    lo_device = attached_loop_device(path)
+    if lo_device:
+        return lo_device
+    lo_device = core_utils.run("losetup", ["--show", "--find", str(path)]).strip()
+    LOG.debug("Attached %s to loop device %s", path, lo_device)
     return lo_device
 
 
-def setup_osd(i: int) -> Path:
-    name = f"ceph-{i}"
-    lo_device = setup_loop_device(name)
-    core_utils.run("wipefs", ["--all", lo_device])
-    core_utils.run("sgdisk", ["--zap-all", lo_device])
-    core_utils.run(
-        "ceph-volume", ["raw", "prepare", "--bluestore", "--data", lo_device]
+def prepared_osds(lo_device: str) -> typing.List[int]:
+    """Return the ids of the bluestore OSDs on lo_device."""
+    output = core_utils.run(
+        "ceph-volume", ["raw", "list", "--format", "json", lo_device]
     )
+    return [osd["osd_id"] for osd in json.loads(output or "{}").values()]
+
+
+def activate_osd(i: int):
     try:
         core_utils.run("ceph-volume", ["raw", "activate", "--osd-id", str(i)])
     except subprocess.CalledProcessError as e:
@@ -342,15 +407,55 @@ def setup_osd(i: int) -> Path:
         else:
             LOG.error("Failed to activate osd %d: %s", i, e)
             raise
-    core_utils.restart_service(f"ceph-osd@{i}")
+
+
+def setup_osd(i: int, size_gib: int) -> Path:
+    """Provision OSD i on a loop device, or bring an existing one back.
+
+    After a reboot the backing file is reattached and its bluestore OSD
+    activated again, instead of being wiped and prepared from scratch.
+    """
+    name = f"ceph-{i}"
+    service = f"ceph-osd@{i}"
+    if core_utils.service_active(service):
+        return LOOP_DEVICE_PATH / name
+    lo_device = setup_loop_device(name, size_gib)
+    if i in prepared_osds(lo_device):
+        LOG.debug("Reactivating osd %d on %s", i, lo_device)
+    else:
+        core_utils.run("wipefs", ["--all", lo_device])
+        core_utils.run("sgdisk", ["--zap-all", lo_device])
+        core_utils.run(
+            "ceph-volume", ["raw", "prepare", "--bluestore", "--data", lo_device]
+        )
+    activate_osd(i)
+    core_utils.restart_service(service)
     return LOOP_DEVICE_PATH / name
 
 
+def teardown_osd(i: int):
+    """Stop and purge OSD i, then remove its loop device and backing file."""
+    path = LOOP_DEVICE_PATH / f"ceph-{i}"
+    core_utils.stop_service(f"ceph-osd@{i}")
+    core_utils.run("ceph", ["osd", "purge", str(i), "--yes-i-really-mean-it"])
+    # ceph-volume raw activate mounts a tmpfs with the OSD keyring
+    osd_dir = Path(f"/var/lib/ceph/osd/{CLUSTER}-{i}")
+    if osd_dir.is_mount():
+        core_utils.run("umount", [str(osd_dir)])
+    lo_device = attached_loop_device(path)
+    if lo_device:
+        core_utils.run("losetup", ["--detach", lo_device])
+    path.unlink(missing_ok=True)
+
+
+def list_pools() -> typing.List[str]:
+    output = core_utils.run("ceph", ["osd", "pool", "ls"], cache_domain="ceph")
+    return [pool.strip() for pool in output.splitlines() if pool.strip()]
+
+
 def ensure_pool(name: str) -> str:
-    pools = core_utils.run("ceph", ["osd", "pool", "ls"]).splitlines()
-    for pool in pools:
-        if name == pool.strip():
-            return name
+    if name in list_pools():
+        return name
     core_utils.run("ceph", ["osd", "pool", "create", name, "32"])
     return name
 
@@ -386,7 +491,9 @@ def ensure_authenticate(pool: str, user: typing.Optional[str] = None) -> Path:
 
 
 def get_key(user: str) -> str:
-    return core_utils.run("ceph", ["auth", "get-key", f"client.{user}"]).strip()
+    return core_utils.run(
+        "ceph", ["auth", "get-key", f"client.{user}"], cache_domain="ceph"
+    ).strip()
 
 
 @functools.lru_cache
@@ -1,11 +1,19 @@
+import uuid
+
 from regress_stack.core import apt as core_apt
+from regress_stack.core import sizing as core_sizing
 from regress_stack.core import utils as core_utils
 from regress_stack.modules import ceph, keystone, mysql, rabbitmq
 from regress_stack.modules import utils as module_utils
 
-DEPENDENCIES = {ceph, keystone, mysql, rabbitmq}
+DEPENDENCIES = {"ceph", "keystone", "mysql", "rabbitmq"}
 PACKAGES = ["cinder-api", "cinder-scheduler", "cinder-volume"]
 LOGS = ["/var/log/cinder/"]
+SERVICES = ["cinder-scheduler", "cinder-volume"]
+BENCH_OPERATIONS = ["volume"]
+TEST_CANARY_REGEXES = [
+    r"^tempest\.api\.volume\.test_volumes_list\.VolumesListTestJSON\.test_volume_list\b",
+]
 
 CONF = "/etc/cinder/cinder.conf"
 URL = f"http://{core_utils.fqdn()}:8776/v3/%(project_id)s"
@@ -20,20 +28,18 @@ def installed() -> bool:
 
 
 def setup():
+    sizing = core_sizing.current()
     db_user, db_pass = mysql.ensure_service(SERVICE)
     rabbit_user, rabbit_pass = rabbitmq.ensure_service(SERVICE)
     username, password = keystone.ensure_service_account(SERVICE, SERVICE_TYPE, URL)
     pool = ceph.ensure_pool(VOLUME_POOL)
     ceph.ensure_authenticate(VOLUME_POOL, SERVICE)
-    core_utils.run(
-        "sed",
-        [
-            "-i",
-            "s|cinder-wsgi processes=5 threads=1|cinder-wsgi processes=1 threads=1|",
-            "/etc/apache2/conf-enabled/cinder-wsgi.conf",
-        ],
+    changed = module_utils.file_sub(
+        "/etc/apache2/conf-enabled/cinder-wsgi.conf",
+        r"cinder-wsgi processes=\d+",
+        f"cinder-wsgi processes={sizing.wsgi_processes}",
     )
-    module_utils.cfg_set(
+    changed |= module_utils.cfg_set(
         CONF,
         (
             "database",
@@ -68,6 +74,30 @@ def setup():
         ),
     )
     core_utils.sudo("cinder-manage", ["db", "sync"], SERVICE)
-    core_utils.restart_apache()
-    core_utils.restart_service("cinder-scheduler")
-    core_utils.restart_service("cinder-volume")
+    core_utils.restart_apache(changed)
+    core_utils.restart_service("cinder-scheduler", changed)
+    core_utils.restart_service("cinder-volume", changed)
+
+
+def teardown():
+    conn = keystone.o7k()
+    keystone.delete_resources(
+        conn.block_storage.volumes(all_projects=True),
+        lambda volume: conn.block_storage.delete_volume(volume, cascade=True),
+        conn.block_storage.wait_for_delete,
+    )
+    core_utils.stop_service("cinder-scheduler", "cinder-volume")
+    mysql.drop_service(SERVICE)
+    rabbitmq.drop_user(SERVICE)
+
+
+def bench_volume():
+    conn = keystone.o7k()
+    volume = conn.block_storage.create_volume(
+        name=f"bench-{uuid.uuid4().hex[:8]}", size=1
+    )
+    try:
+        conn.block_storage.wait_for_status(volume, "available")
+    finally:
+        conn.block_storage.delete_volume(volume)
+        conn.block_storage.wait_for_delete(volume)
@@ -1,10 +1,16 @@
+from regress_stack.core import sizing as core_sizing
 from regress_stack.core import utils as core_utils
 from regress_stack.modules import keystone, mysql
 from regress_stack.modules import utils as module_utils
 
-DEPENDENCIES = {keystone, mysql}
+DEPENDENCIES = {"keystone", "mysql"}
 PACKAGES = ["glance-api"]
 LOGS = ["/var/log/glance/"]
+SERVICES = ["glance-api"]
+BENCH_OPERATIONS = ["image_list"]
+TEST_CANARY_REGEXES = [
+    r"^tempest\.api\.image\.v2\.test_images\.ListUserImagesTest\.test_list_no_params\b",
+]
 
 CONF = "/etc/glance/glance-api.conf"
 URL = f"http://{core_utils.fqdn()}:9292/"
@@ -13,24 +19,38 @@ SERVICE_TYPE = "image"
 
 
 def setup():
+    sizing = core_sizing.current()
     db_user, db_pass = mysql.ensure_service(SERVICE)
     username, password = keystone.ensure_service_account(SERVICE, SERVICE_TYPE, URL)
-    module_utils.cfg_set(
+    changed = module_utils.cfg_set(
         CONF,
         (
             "database",
             "connection",
             mysql.connection_string(SERVICE, db_user, db_pass),
         ),
-        ("database", "max_pool_size", "1"),
+        ("database", "max_pool_size", str(sizing.max_pool_size)),
         ("paste_deploy", "flavor", "keystone"),
         *module_utils.dict_to_cfg_set_args(
             "keystone_authtoken", keystone.authtoken_service(username, password)
         ),
-        ("DEFAULT", "workers", "1"),
+        ("DEFAULT", "workers", str(sizing.workers)),
         ("DEFAULT", "enabled_backends", "fs:file"),
         ("glance_store", "default_backend", "fs"),
         ("fs", "filesystem_store_datadir", "/var/lib/glance/images/"),
     )
     core_utils.sudo("glance-manage", ["db_sync"], user=SERVICE)
-    core_utils.restart_service("glance-api")
+    core_utils.restart_service("glance-api", changed)
+
+
+def teardown():
+    conn = keystone.o7k()
+    # Removes the image files from the store
+    keystone.delete_resources(conn.image.images(), conn.image.delete_image)
+    core_utils.stop_service("glance-api")
+    mysql.drop_service(SERVICE)
+
+
+def bench_image_list():
+    conn = keystone.o7k()
+    list(conn.image.images())
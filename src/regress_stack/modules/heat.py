@@ -1,15 +1,17 @@
 import logging
 import pathlib
 
+from regress_stack.core import sizing as core_sizing
 from regress_stack.core import utils as core_utils
-from regress_stack.modules import keystone, mysql, neutron, nova, rabbitmq
+from regress_stack.modules import keystone, mysql, neutron, rabbitmq
 from regress_stack.modules import utils as module_utils
 
 LOG = logging.getLogger(__name__)
 
-DEPENDENCIES = {keystone, mysql, rabbitmq, nova, neutron}
+DEPENDENCIES = {"keystone", "mysql", "rabbitmq", "nova", "neutron"}
 PACKAGES = ["heat-api", "heat-api-cfn", "heat-engine"]
 LOGS = ["/var/log/heat/"]
+SERVICES = ["heat-api", "heat-api-cfn", "heat-engine"]
 
 CONF = "/etc/heat/heat.conf"
 URL = f"http://{core_utils.fqdn()}:8004"
@@ -43,6 +45,7 @@ TEST_EXCLUDE_REGEXES = [
 
 
 def setup():
+    sizing = core_sizing.current()
     db_user, db_pass = mysql.ensure_service(SERVICE)
     rabbit_user, rabbit_pass = rabbitmq.ensure_service(SERVICE)
     username, password = keystone.ensure_service_account(
@@ -57,14 +60,14 @@ def setup():
     keystone.grant_domain_role(heat_stack_admin, keystone.admin_role(), domain)
     keystone.ensure_role(HEAT_STACK_OWNER)
     keystone.ensure_role(HEAT_STACK_USER)
-    module_utils.cfg_set(
+    changed = module_utils.cfg_set(
         CONF,
         (
             "database",
             "connection",
             mysql.connection_string(SERVICE, db_user, db_pass),
         ),
-        ("database", "max_pool_size", "1"),
+        ("database", "max_pool_size", str(sizing.max_pool_size)),
         *module_utils.dict_to_cfg_set_args(
             "keystone_authtoken", keystone.authtoken_service(username, password)
         ),
@@ -78,9 +81,9 @@ def setup():
                 "user_domain_id": keystone.service_domain(),
             },
         ),
-        ("DEFAULT", "num_engine_workers", "1"),
-        ("heat_api", "workers", "1"),
-        ("heat_api_cfn", "workers", "1"),
+        ("DEFAULT", "num_engine_workers", str(sizing.workers)),
+        ("heat_api", "workers", str(sizing.workers)),
+        ("heat_api_cfn", "workers", str(sizing.workers)),
         ("DEFAULT", "transport_url", rabbitmq.transport_url(rabbit_user, rabbit_pass)),
         ("DEFAULT", "heat_metadata_server_url", URL_HEAT_METADATA),
         ("DEFAULT", "heat_waitcondition_server_url", URL_HEAT_METADATA_WAIT),
@@ -95,9 +98,22 @@ def setup():
         ),
     )
     core_utils.sudo("heat-manage", ["db_sync"], user=SERVICE)
-    core_utils.restart_service("heat-api")
-    core_utils.restart_service("heat-api-cfn")
-    core_utils.restart_service("heat-engine")
+    core_utils.restart_service("heat-api", changed)
+    core_utils.restart_service("heat-api-cfn", changed)
+    core_utils.restart_service("heat-engine", changed)
+
+
+def teardown():
+    conn = keystone.o7k()
+    # Stacks own servers and networks, delete them through heat first
+    keystone.delete_resources(
+        conn.orchestration.stacks(),
+        conn.orchestration.delete_stack,
+        conn.orchestration.wait_for_delete,
+    )
+    core_utils.stop_service("heat-api", "heat-api-cfn", "heat-engine")
+    mysql.drop_service(SERVICE)
+    rabbitmq.drop_user(SERVICE)
 
 
 def configure_tempest(tempest_conf: pathlib.Path):
@@ -107,15 +123,19 @@ def configure_tempest(tempest_conf: pathlib.Path):
     demo_project = keystone.ensure_project(
         "heat-demo-project", keystone.default_domain()
     )
-    keystone.grant_project_role(
-        keystone.admin_user(), keystone.admin_role(), demo_project
-    )
 
-    heat_demo_network = neutron.ensure_network("heat-demo-network", demo_project.id)
-    heat_demo_subnet = neutron.ensure_subnet(
-        "heat-demo-subnet", heat_demo_network, "192.168.0.0/24"
+    def ensure_demo_subnet():
+        network = neutron.ensure_network("heat-demo-network", demo_project.id)
+        subnet = neutron.ensure_subnet("heat-demo-subnet", network, "192.168.0.0/24")
+        return network, subnet
+
+    _, (heat_demo_network, heat_demo_subnet), heat_demo_router = core_utils.parallel(
+        lambda: keystone.grant_project_role(
+            keystone.admin_user(), keystone.admin_role(), demo_project
+        ),
+        ensure_demo_subnet,
+        lambda: neutron.ensure_router("heat-demo-router", demo_project),
     )
-    heat_demo_router = neutron.ensure_router("heat-demo-router", demo_project)
     neutron.ensure_subnet_router(heat_demo_subnet, heat_demo_router)
 
     module_utils.cfg_set(
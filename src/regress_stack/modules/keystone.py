@@ -2,8 +2,10 @@ import functools
 import logging
 import os
 import pathlib
+import threading
 import typing
 
+from regress_stack.core import sizing as core_sizing
 from regress_stack.core import utils as core_utils
 from regress_stack.modules import mysql, utils
 from regress_stack.modules import utils as module_utils
@@ -11,10 +13,15 @@ from regress_stack.modules import utils as module_utils
 LOG = logging.getLogger(__name__)
 
 DEPENDENCIES = {
-    mysql,
+    "mysql",
 }
 PACKAGES = ["keystone", "apache2", "libapache2-mod-wsgi-py3"]
 LOGS = ["/var/log/keystone/"]
+SERVICES = ["apache2"]
+BENCH_OPERATIONS = ["token_issue"]
+TEST_CANARY_REGEXES = [
+    r"^tempest\.api\.identity\.admin\.v3\.test_domains\.DomainsTestJSON\.test_list_domains\b",
+]
 
 CONF = "/etc/keystone/keystone.conf"
 ADMIN_PASSWORD = "changeme"
@@ -22,25 +29,34 @@ OS_AUTH_URL = f"http://{core_utils.fqdn()}:5000/v3/"
 SERVICE_DOMAIN = "service"
 SERVICE_PROJECT = "service"
 
+HTTP_DEBUG_DEFAULT = os.environ.get("REGRESS_STACK_HTTP_DEBUG", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+_HTTP_DEBUG = HTTP_DEBUG_DEFAULT
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+# SDK connection of each thread, replaced to drop the connections of all
+_CONNECTIONS = threading.local()
+
 
 def setup():
+    sizing = core_sizing.current()
     username, password = mysql.ensure_service("keystone")
-    core_utils.run(
-        "sed",
-        [
-            "-i",
-            "s|keystone-public processes=5 threads=1|keystone-public processes=1 threads=1|",
-            "/etc/apache2/sites-enabled/keystone.conf",
-        ],
+    changed = module_utils.file_sub(
+        "/etc/apache2/sites-enabled/keystone.conf",
+        r"keystone-public processes=\d+",
+        f"keystone-public processes={sizing.wsgi_processes}",
     )
-    module_utils.cfg_set(
+    changed |= module_utils.cfg_set(
         CONF,
         (
             "database",
             "connection",
             mysql.connection_string("keystone", username, password),
         ),
-        ("database", "max_pool_size", "1"),
+        ("database", "max_pool_size", str(sizing.max_pool_size)),
         ("token", "provider", "fernet"),
     )
     LOG.debug("Running keystone-manage db_sync...")
@@ -69,7 +85,7 @@ def setup():
             utils.REGION,
         ],
     )
-    core_utils.restart_apache()
+    core_utils.restart_apache(changed)
     authrc = auth_rc()
     print(authrc)
     pathlib.Path("~/auth.rc").expanduser().write_text(authrc)
@@ -78,6 +94,14 @@ def setup():
     ensure_role("_member_")
 
 
+def teardown():
+    # placement and cinder-api are served by apache too, they are torn
+    # down before keystone
+    core_utils.stop_service("apache2")
+    mysql.drop_service("keystone")
+    forget_session()
+
+
 def auth_env() -> typing.Dict[str, str]:
     return {
         "OS_USERNAME": "admin",
@@ -117,16 +141,121 @@ def auth_rc():
     return "\n".join(f"export {k}={v}" for k, v in auth_env().items())
 
 
-@functools.lru_cache()
+def connection_config() -> typing.Dict[str, typing.Any]:
+    """Admin connection settings, as accepted by openstack.connect."""
+    return {
+        "auth_type": "password",
+        "auth": {
+            "auth_url": OS_AUTH_URL,
+            "username": "admin",
+            "password": ADMIN_PASSWORD,
+            "project_name": "admin",
+            "user_domain_name": "Default",
+            "project_domain_name": "Default",
+        },
+        "identity_api_version": "3",
+        "region_name": utils.REGION,
+    }
+
+
+def set_http_debug(enabled: bool):
+    """Log every HTTP request and response made through o7k()."""
+    global _HTTP_DEBUG
+    _HTTP_DEBUG = enabled
+    # Logging is configured with the first connection, update it if made
+    if _SESSION is not None:
+        import openstack
+
+        _configure_logging(openstack)
+
+
+def _configure_logging(openstack):
+    if _HTTP_DEBUG:
+        openstack.enable_logging(debug=True, http_debug=True)
+        return
+    # Formatting request and response bodies is costly, skip it unless asked
+    for logger in ("openstack", "keystoneauth"):
+        logging.getLogger(logger).setLevel(logging.INFO)
+
+
 def o7k():
-    os.environ.update(auth_env())
-    import openstack
+    """Return the admin SDK connection of the calling thread.
 
-    openstack.enable_logging(debug=True)
-    conn = openstack.connect(load_envvars=True)
+    All connections share one authentication: the token and the catalog are
+    reused across services, threads and refreshes.
+    """
+    connections = _CONNECTIONS
+    conn = getattr(connections, "conn", None)
+    if conn is None:
+        conn = connections.conn = _connect()
     return conn
 
 
+def _connect():
+    global _SESSION
+    import openstack
+    from keystoneauth1 import session as ks_session
+
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _configure_logging(openstack)
+            conn = openstack.connect(
+                load_yaml_config=False, load_envvars=False, **connection_config()
+            )
+            _SESSION = conn.session
+            return conn
+    # Sessions are not thread-safe, only share the authentication
+    return openstack.connection.Connection(
+        session=ks_session.Session(auth=_SESSION.auth),
+        region_name=utils.REGION,
+    )
+
+
+def forget_session():
+    """Authenticate again, and look identities up again, on next use."""
+    global _SESSION, _CONNECTIONS
+    with _SESSION_LOCK:
+        _SESSION = None
+    _CONNECTIONS = threading.local()
+    for cached in (
+        region,
+        service_domain,
+        default_domain,
+        admin_user,
+        service_project,
+        admin_role,
+    ):
+        cached.cache_clear()
+
+
+def delete_resources(
+    resources: typing.Iterable[typing.Any],
+    delete: typing.Callable[[typing.Any], typing.Any],
+    wait_for_delete: typing.Optional[typing.Callable[[typing.Any], typing.Any]] = None,
+) -> int:
+    """Delete resources, then wait for them to be gone, return their count.
+
+    All deletions are requested first so that the services process them
+    concurrently, the wait is the one of the slowest.
+    """
+    resources = list(resources)
+    for resource in resources:
+        LOG.debug("Deleting %s %s...", type(resource).__name__, resource.id)
+        delete(resource)
+    if wait_for_delete is not None:
+        for resource in resources:
+            wait_for_delete(resource)
+    return len(resources)
+
+
+def refresh_catalog():
+    """Fetch the service catalog again on next use of o7k()."""
+    global _CONNECTIONS
+    if _SESSION is not None:
+        _SESSION.auth.invalidate()
+    _CONNECTIONS = threading.local()
+
+
 @functools.lru_cache()
 def region() -> str:
     conn = o7k()
@@ -260,9 +389,8 @@ def ensure_endpoint(service, url: str):
     endpoints = list(conn.identity.endpoints(service_id=service.id))
     for interface in ("public", "internal", "admin"):
         _ensure_endpoint_interface(conn, service, url, region(), interface, endpoints)
-    # Clear connection after updating endpoints
-    conn.close()
-    o7k.cache_clear()
+    # Endpoints changed, new services must be found in the catalog
+    refresh_catalog()
 
 
 def grant_domain_role(user, role, domain):
@@ -275,3 +403,10 @@ def grant_project_role(user, role, project):
     conn = o7k()
     LOG.debug("Granting role %r to user %r...", role, user)
     project.assign_role_to_user(conn.identity, user, role)
+
+
+def bench_token_issue():
+    from keystoneauth1.identity import v3
+
+    conn = o7k()
+    v3.Password(**connection_config()["auth"]).get_access(conn.session)
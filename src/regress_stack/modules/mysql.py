@@ -1,16 +1,40 @@
 import logging
+import pathlib
 import typing
 
+from regress_stack.core import sizing as core_sizing
 from regress_stack.core import utils as core_utils
+from regress_stack.modules import utils as module_utils
 
 LOG = logging.getLogger(__name__)
 
 LOGS = ["/var/log/mysql/"]
+SERVICES = ["mysql"]
 PACKAGES = ["mysql-server"]
 
+DATA_DIR = pathlib.Path("/var/lib/mysql")
+EPHEMERAL_CONF = "/etc/mysql/mysql.conf.d/zz-regress-stack-ephemeral.cnf"
+# In tmpfs, flushing buys no durability; native AIO does not work there
+NON_DURABLE = {
+    "innodb_flush_log_at_trx_commit": "0",
+    "innodb_doublewrite": "OFF",
+    "innodb_use_native_aio": "OFF",
+    "sync_binlog": "0",
+}
+
 
 def setup():
-    pass
+    storage = core_sizing.storage()
+    if not storage.ephemeral:
+        return
+    changed = False
+    if not DATA_DIR.is_mount():
+        core_utils.stop_service("mysql")
+        changed = core_utils.move_to_tmpfs(DATA_DIR, storage.mysql_gib * 1024)
+    changed |= module_utils.cfg_set(
+        EPHEMERAL_CONF, *module_utils.dict_to_cfg_set_args("mysqld", NON_DURABLE)
+    )
+    core_utils.restart_service("mysql", changed)
 
 
 CREATE_USER = """CREATE USER '{name}'@'localhost' IDENTIFIED BY '{password}';
@@ -21,6 +45,10 @@ GRANT_USER = """ GRANT ALL PRIVILEGES ON {name}.* TO '{database}'@'localhost';
 GRANT ALL PRIVILEGES ON {name}.* TO '{database}'@'%';
 """
 
+DROP_SERVICE = """DROP DATABASE IF EXISTS {name};
+DROP USER IF EXISTS '{name}'@'localhost', '{name}'@'%';
+"""
+
 
 def get_host():
     return "localhost"
@@ -54,7 +82,11 @@ def ensure_database(name: str):
     # check if exists
     LOG.debug("Checking if database %r exists...", name)
     tpl = """SELECT SCHEMA_NAME FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = '{database}';"""
-    databases = core_utils.run("mysql", ["-u", "root", "-e", tpl.format(database=name)])
+    databases = core_utils.run(
+        "mysql",
+        ["-u", "root", "-e", tpl.format(database=name)],
+        cache_domain="mysql",
+    )
     if databases:
         LOG.debug("Database %r already exists.", name)
         return
@@ -66,7 +98,9 @@ def ensure_user(name, password):
     """Ensure that a user exists."""
     LOG.debug("Checking if user %r exists...", name)
     tpl = """SELECT User FROM mysql.user WHERE User = '{name}';"""
-    users = core_utils.run("mysql", ["-u", "root", "-e", tpl.format(name=name)])
+    users = core_utils.run(
+        "mysql", ["-u", "root", "-e", tpl.format(name=name)], cache_domain="mysql"
+    )
     if users:
         LOG.debug("User %r already exists.", name)
         return
@@ -82,3 +116,9 @@ def grant_user(name, database):
     core_utils.run(
         "mysql", ["-u", "root", "-e", GRANT_USER.format(name=name, database=database)]
     )
+
+
+def drop_service(name: str):
+    """Drop the database and the user of a service, if they exist."""
+    LOG.debug("Dropping database and user %r...", name)
+    core_utils.run("mysql", ["-u", "root", "-e", DROP_SERVICE.format(name=name)])
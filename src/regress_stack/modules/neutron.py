@@ -2,16 +2,23 @@ import functools
 import ipaddress
 import logging
 import time
+import uuid
 
+from regress_stack.core import sizing as core_sizing
 from regress_stack.core import utils as core_utils
 from regress_stack.modules import keystone, mysql, ovn, rabbitmq
 from regress_stack.modules import utils as module_utils
 
 LOG = logging.getLogger(__name__)
 
-DEPENDENCIES = {keystone, mysql, ovn, rabbitmq}
+DEPENDENCIES = {"keystone", "mysql", "ovn", "rabbitmq"}
 PACKAGES = ["neutron-server", "neutron-ovn-metadata-agent"]
 LOGS = ["/var/log/neutron/"]
+SERVICES = ["neutron-server", "neutron-ovn-metadata-agent"]
+BENCH_OPERATIONS = ["network_port"]
+TEST_CANARY_REGEXES = [
+    r"^tempest\.api\.network\.test_networks\.NetworksTest\.test_list_networks\b",
+]
 
 CONF = "/etc/neutron/neutron.conf"
 METADATA_AGENT_CONF = "/etc/neutron/neutron_ovn_metadata_agent.ini"
@@ -24,17 +31,18 @@ EXTERNAL_NETWORK = "external-network"
 
 
 def setup():
+    sizing = core_sizing.current()
     db_user, db_pass = mysql.ensure_service("neutron")
     rabbit_user, rabbit_pass = rabbitmq.ensure_service("neutron")
     username, password = keystone.ensure_service_account("neutron", "network", URL)
-    module_utils.cfg_set(
+    server_changed = module_utils.cfg_set(
         CONF,
         (
             "database",
             "connection",
             mysql.connection_string("neutron", db_user, db_pass),
         ),
-        ("database", "max_pool_size", "1"),
+        ("database", "max_pool_size", str(sizing.max_pool_size)),
         *module_utils.dict_to_cfg_set_args(
             "DEFAULT",
             {
@@ -50,8 +58,8 @@ def setup():
                 "dhcp_agents_per_network": "1",
             },
         ),
-        ("DEFAULT", "api_workers", "1"),
-        ("DEFAULT", "rpc_workers", "1"),
+        ("DEFAULT", "api_workers", str(sizing.workers)),
+        ("DEFAULT", "rpc_workers", str(sizing.workers)),
         ("DEFAULT", "transport_url", rabbitmq.transport_url(rabbit_user, rabbit_pass)),
         ("DEFAULT", "notify_nova_on_port_status_changes", "true"),
         ("DEFAULT", "notify_nova_on_port_data_changes", "true"),
@@ -67,7 +75,7 @@ def setup():
             "keystone_authtoken", keystone.authtoken_service(username, password)
         ),
     )
-    module_utils.cfg_set(
+    server_changed |= module_utils.cfg_set(
         ML2_CONF,
         *module_utils.dict_to_cfg_set_args(
             "ml2",
@@ -97,7 +105,7 @@ def setup():
             },
         ),
     )
-    module_utils.cfg_set(
+    agent_changed = module_utils.cfg_set(
         METADATA_AGENT_CONF,
         ("DEFAULT", "nova_metadata_host", core_utils.fqdn()),
         ("DEFAULT", "metadata_proxy_shared_secret", METADATA_SECRET),
@@ -109,8 +117,11 @@ def setup():
         ["--config-file", CONF, "--config-file", ML2_CONF, "upgrade", "head"],
         user="neutron",
     )
-    core_utils.restart_service("neutron-server")
-    core_utils.restart_service("neutron-ovn-metadata-agent")
+    core_utils.restart_service("neutron-server", server_changed)
+    # The agent reads neutron.conf too, for its transport and authentication
+    core_utils.restart_service(
+        "neutron-ovn-metadata-agent", agent_changed or server_changed
+    )
     # wait for neutron-server to accept http connections
     for _ in range(10):
         try:
@@ -124,6 +135,14 @@ def setup():
             raise e
 
 
+def teardown():
+    # Logical networks live in the OVN databases, reset with ovn
+    core_utils.stop_service("neutron-server", "neutron-ovn-metadata-agent")
+    mysql.drop_service("neutron")
+    rabbitmq.drop_user("neutron")
+    public_network.cache_clear()
+
+
 def ensure_public_network():
     """"""
     conn = keystone.o7k()
@@ -223,3 +242,13 @@ def ensure_subnet_router(subnet, router):
         LOG.debug("Reattaching port %r to router %r...", port.name, router)
         conn.network.remove_interface_from_router(port.device_id, port_id=port.id)
         conn.network.add_interface_to_router(router, port_id=port.id)
+
+
+def bench_network_port():
+    conn = keystone.o7k()
+    network = conn.network.create_network(name=f"bench-{uuid.uuid4().hex[:8]}")
+    try:
+        port = conn.network.create_port(network_id=network.id)
+        conn.network.delete_port(port)
+    finally:
+        conn.network.delete_network(network)
@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 import os
@@ -5,7 +6,10 @@ import pathlib
 import stat
 import subprocess
 import time
+import typing
+import uuid
 
+from regress_stack.core import sizing as core_sizing
 from regress_stack.core import utils as core_utils
 from regress_stack.modules import (
     ceph,
@@ -15,22 +19,21 @@ from regress_stack.modules import (
     mysql,
     neutron,
     ovn,
-    placement,
     rabbitmq,
     utils,
 )
 from regress_stack.modules import utils as module_utils
 
 DEPENDENCIES = {
-    glance,
-    keystone,
-    mysql,
-    neutron,
-    ovn,
-    rabbitmq,
-    placement,
+    "glance",
+    "keystone",
+    "mysql",
+    "neutron",
+    "ovn",
+    "rabbitmq",
+    "placement",
 }
-OPTIONAL_DEPENDENCIES = {ceph, cinder}
+OPTIONAL_DEPENDENCIES = {"ceph", "cinder"}
 PACKAGES = [
     "nova-api",
     "nova-conductor",
@@ -39,6 +42,17 @@ PACKAGES = [
     "nova-spiceproxy",
     "spice-html5",
 ]
+SERVICES = [
+    "nova-api",
+    "nova-conductor",
+    "nova-scheduler",
+    "nova-compute",
+    "nova-spiceproxy",
+]
+BENCH_OPERATIONS = ["server"]
+TEST_CANARY_REGEXES = [
+    r"^tempest\.api\.compute\.flavors\.test_flavors\.FlavorsV2TestJSON\.test_list_flavors\b",
+]
 LOG = logging.getLogger(__name__)
 
 CONF = "/etc/nova/nova.conf"
@@ -49,32 +63,33 @@ SERVICE_TYPE = "compute"
 
 
 def setup():
+    sizing = core_sizing.current()
     db_user, db_pass = mysql.ensure_service(SERVICE)
     db_api_user, db_api_pass = mysql.ensure_service("nova_api")
     db_cell0_user, db_cell0_pass = mysql.ensure_service("nova_cell0")
     rabbit_user, rabbit_pass = rabbitmq.ensure_service(SERVICE)
     username, password = keystone.ensure_service_account(SERVICE, SERVICE_TYPE, URL)
-    module_utils.cfg_set(
+    changed = module_utils.cfg_set(
         CONF,
         (
             "database",
             "connection",
             mysql.connection_string(SERVICE, db_user, db_pass),
         ),
-        ("database", "max_pool_size", "1"),
+        ("database", "max_pool_size", str(sizing.max_pool_size)),
         (
             "api_database",
             "connection",
             mysql.connection_string("nova_api", db_api_user, db_api_pass),
         ),
-        ("api_database", "max_pool_size", "1"),
+        ("api_database", "max_pool_size", str(sizing.max_pool_size)),
         ("DEFAULT", "transport_url", rabbitmq.transport_url(rabbit_user, rabbit_pass)),
         ("DEFAULT", "host", core_utils.fqdn()),
         ("DEFAULT", "my_ip", core_utils.my_ip()),
-        ("DEFAULT", "osapi_compute_workers", "1"),
-        ("DEFAULT", "metadata_workers", "1"),
-        ("conductor", "workers", "1"),
-        ("scheduler", "workers", "1"),
+        ("DEFAULT", "osapi_compute_workers", str(sizing.workers)),
+        ("DEFAULT", "metadata_workers", str(sizing.workers)),
+        ("conductor", "workers", str(sizing.workers)),
+        ("scheduler", "workers", str(sizing.workers)),
         ("DEFAULT", "auth_strategy", "keystone"),
         *module_utils.dict_to_cfg_set_args(
             "keystone_authtoken", keystone.authtoken_service(username, password)
@@ -124,7 +139,7 @@ def setup():
 
     if ceph.installed() and cinder.installed():
         pool = ceph.ensure_pool(cinder.VOLUME_POOL)
-        module_utils.cfg_set(
+        changed |= module_utils.cfg_set(
             CONF,
             *module_utils.dict_to_cfg_set_args(
                 "libvirt",
@@ -157,23 +172,43 @@ def setup():
         ],
         user="nova",
     )
-    list_cells = core_utils.sudo("nova-manage", ["cell_v2", "list_cells"], user="nova")
+    list_cells = core_utils.sudo(
+        "nova-manage", ["cell_v2", "list_cells"], user="nova", cache_domain="nova"
+    )
     if " cell1 " not in list_cells:
         core_utils.sudo(
             "nova-manage", ["cell_v2", "create_cell", "--name=cell1"], user="nova"
         )
     core_utils.sudo("nova-manage", ["db", "sync"], user="nova")
-    core_utils.restart_service("nova-api")
-    core_utils.restart_service("nova-scheduler")
-    core_utils.restart_service("nova-conductor")
-    core_utils.restart_service("nova-compute")
-    # Give some time for nova-compute to be up before discovering hosts
-    time.sleep(15)
+    core_utils.restart_service("nova-api", changed)
+    core_utils.restart_service("nova-scheduler", changed)
+    core_utils.restart_service("nova-conductor", changed)
+    # Also started again when stopped by a reset, without any change
+    if core_utils.restart_service("nova-compute", changed):
+        # Give some time for nova-compute to be up before discovering hosts
+        time.sleep(15)
     core_utils.sudo(
         "nova-manage", ["cell_v2", "discover_hosts", "--verbose"], user="nova"
     )
 
 
+def teardown():
+    conn = keystone.o7k()
+    # Undefines the libvirt domains and unplugs their ports
+    keystone.delete_resources(
+        conn.compute.servers(all_projects=True),
+        conn.compute.delete_server,
+        conn.compute.wait_for_delete,
+    )
+    core_utils.stop_service(
+        "nova-api", "nova-scheduler", "nova-conductor", "nova-compute"
+    )
+    for database in (SERVICE, "nova_api", "nova_cell0"):
+        mysql.drop_service(database)
+    rabbitmq.drop_user(SERVICE)
+    _bench_server_args.cache_clear()
+
+
 def virt_type() -> str:
     if _is_hw_virt_supported() and _is_kvm_api_available():
         return "kvm"
@@ -266,7 +301,9 @@ SECRET_TEMPLATE = """<secret ephemeral='no' private='no'>
 def ensure_libvirt_ceph_secret() -> str:
     secret_uuid = ceph.rbd_uuid()
     try:
-        core_utils.run("virsh", ["secret-get-value", secret_uuid])
+        core_utils.run(
+            "virsh", ["secret-get-value", secret_uuid], cache_domain="libvirt"
+        )
         return secret_uuid
     except subprocess.CalledProcessError:
         pass
@@ -286,3 +323,36 @@ def ensure_libvirt_ceph_secret() -> str:
         ],
     )
     return secret_uuid
+
+
+@functools.lru_cache()
+def _bench_server_args() -> typing.Dict[str, typing.Any]:
+    conn = keystone.o7k()
+    image = next(iter(conn.image.images(status="active")), None)
+    if image is None:
+        raise RuntimeError("No active image to boot servers from!")
+    flavors = [
+        flavor
+        for flavor in conn.compute.flavors()
+        if flavor.disk >= (image.min_disk or 0) and flavor.ram >= (image.min_ram or 0)
+    ]
+    if not flavors:
+        raise RuntimeError(f"No flavor fits image {image.name!r}!")
+    flavor = min(flavors, key=lambda flavor: (flavor.ram, flavor.disk))
+    return {
+        "image_id": image.id,
+        "flavor_id": flavor.id,
+        "networks": [{"uuid": neutron.public_network().id}],
+    }
+
+
+def bench_server():
+    conn = keystone.o7k()
+    server = conn.compute.create_server(
+        name=f"bench-{uuid.uuid4().hex[:8]}", **_bench_server_args()
+    )
+    try:
+        conn.compute.wait_for_server(server)
+    finally:
+        conn.compute.delete_server(server)
+        conn.compute.wait_for_delete(server)
@@ -1,16 +1,16 @@
 import ipaddress
 import logging
 import pathlib
-import re
-import subprocess
-
-import pyroute2
+import typing
 
+from regress_stack.core import firewall, net, ovsdb
 from regress_stack.core import utils as core_utils
+from regress_stack.modules import utils as module_utils
 
 LOG = logging.getLogger(__name__)
 
 LOGS = ["/var/log/ovn/"]
+SERVICES = ["ovn-*", "ovsdb-server", "ovs-vswitchd"]
 PACKAGES = [
     "ovn-central",
     "openvswitch-switch",
@@ -27,6 +27,11 @@ OVNNB_CONNECTION = f"tcp:{core_utils.my_ip()}:6641"
 OVNSB_CONNECTION = f"tcp:{core_utils.my_ip()}:6642"
 
 SYSTEM_ID = "/etc/openvswitch/system-id.conf"
+# Created empty by ovn-ctl when missing
+OVN_DB_FILES = [
+    pathlib.Path("/var/lib/ovn/ovnnb_db.db"),
+    pathlib.Path("/var/lib/ovn/ovnsb_db.db"),
+]
 
 OVS_CTL_OPTS = f"--ovsdb-server-options='--remote=ptcp:6640:{core_utils.my_ip()}'"
 
@@ -44,124 +49,181 @@ OVN_CTL_OPTS = f"""--db-nb-addr={core_utils.my_ip()} \
 def setup():
     system_id = core_utils.fqdn()
     pathlib.Path(SYSTEM_ID).write_text(system_id)
-    pathlib.Path("/etc/default/openvswitch-switch").write_text(
-        f"OVS_CTL_OPTS={OVS_CTL_OPTS}"
-    )
-    pathlib.Path("/etc/default/ovn-central").write_text(f"OVN_CTL_OPTS={OVN_CTL_OPTS}")
-    core_utils.restart_service("ovn-central")
-    core_utils.restart_service("openvswitch-switch")
-    core_utils.run(
-        "ovs-vsctl",
-        [
-            "--retry",
-            "set",
-            "open",
-            ".",
-            "external_ids:ovn-encap-type=geneve",
-            "--",
-            "set",
-            "open",
-            ".",
-            f"external_ids:ovn-encap-ip={OVN_ENCAP_IP}",
-            "--",
-            "set",
-            "open",
-            ".",
-            f"external_ids:system-id={system_id}",
-            "--",
-            "set",
-            "open",
-            ".",
-            "external_ids:ovn-match-northd-version=true",
-            "--",
-            "set",
-            "open",
-            ".",
-            f"external_ids:ovn-remote={OVNSB_CONNECTION}",
-        ],
+    ovs_changed = module_utils.file_write(
+        "/etc/default/openvswitch-switch", f"OVS_CTL_OPTS={OVS_CTL_OPTS}"
     )
-    core_utils.run(
-        "ovs-vsctl",
-        [
-            "--retry",
-            "--may-exist",
-            "add-br",
-            EXTERNAL_BRIDGE,
-            "--",
-            "set",
-            "bridge",
-            EXTERNAL_BRIDGE,
-            "datapath_type=system",
-            "protocols=OpenFlow13,OpenFlow15",
-        ],
-    )
-    core_utils.run(
-        "ovs-vsctl",
-        [
-            "--retry",
-            "set",
-            "open",
-            ".",
-            f"external_ids:ovn-bridge-mappings=physnet1:{EXTERNAL_BRIDGE}",
-            "--",
-            "set",
-            "open",
-            ".",
-            "external_ids:ovn-cms-options=enable-chassis-as-gw",
-        ],
+    ovn_changed = module_utils.file_write(
+        "/etc/default/ovn-central", f"OVN_CTL_OPTS={OVN_CTL_OPTS}"
     )
+    core_utils.restart_service("ovn-central", ovn_changed)
+    core_utils.restart_service("openvswitch-switch", ovs_changed)
+    with ovsdb.connect(OVSDB_CONNECTION) as client:
+        next_cfg = configure_ovs(client, system_id)
+        # Like ovs-vsctl, wait for ovs-vswitchd to apply the configuration
+        client.wait(
+            "Open_vSwitch",
+            "Open_vSwitch",
+            ["cur_cfg"],
+            lambda rows: all(row["cur_cfg"] >= next_cfg for row in rows.values()),
+        )
+    with ovsdb.connect(OVNSB_CONNECTION) as client:
+        # ovn-northd creates SB_Global, ovn-controller registers the chassis
+        client.wait("OVN_Southbound", "SB_Global", ["nb_cfg"], bool)
+        client.wait(
+            "OVN_Southbound",
+            "Chassis",
+            ["name"],
+            lambda rows: any(row["name"] == system_id for row in rows.values()),
+        )
     configure_external_bridge()
-    _add_iptable_postrouting_rule(EXTERNAL_CIDR, "ovn-external-bridge")
 
 
-def configure_external_bridge():
-    network = ipaddress.ip_network(EXTERNAL_CIDR)
-    ip = str(next(network.hosts()))
-    gw_ip = ip + "/" + str(network.prefixlen)
-    with pyroute2.NDB() as ndb:
-        with ndb.interfaces[EXTERNAL_BRIDGE] as iface:
-            try:
-                iface.ipaddr[gw_ip]
-            except KeyError:
-                iface.add_ip(gw_ip)
-                iface.set(state="up")
+def teardown():
+    with ovsdb.connect(OVSDB_CONNECTION) as client:
+        delete_bridge(client, EXTERNAL_BRIDGE)
+    core_utils.stop_service("ovn-central")
+    for db_file in OVN_DB_FILES:
+        db_file.unlink(missing_ok=True)
+
+
+def delete_bridge(client: ovsdb.Client, name: str) -> bool:
+    """Delete bridge name with its ports, return whether it existed."""
+    (bridges,) = client.transact(
+        "Open_vSwitch",
+        {
+            "op": "select",
+            "table": "Bridge",
+            "where": [["name", "==", name]],
+            "columns": ["_uuid"],
+        },
+    )
+    if not bridges["rows"]:
+        return False
+    # Bridges, ports and interfaces are garbage collected once unreferenced
+    client.transact(
+        "Open_vSwitch",
+        {
+            "op": "mutate",
+            "table": "Open_vSwitch",
+            "where": [],
+            "mutations": [
+                [
+                    "bridges",
+                    "delete",
+                    ovsdb.ovs_set(row["_uuid"] for row in bridges["rows"]),
+                ]
+            ],
+        },
+    )
+    return True
 
 
-def _add_iptable_postrouting_rule(cidr: str, comment: str) -> None:
-    """Add postrouting iptable rule.
+def configure_ovs(client: ovsdb.Client, system_id: str) -> int:
+    """Configure OVN in Open_vSwitch and create the external bridge.
 
-    Add new postiprouting iptable rule, if it does not exist, to allow traffic
-    for cidr network.
+    Everything is applied in a single transaction, return the configuration
+    sequence number ovs-vswitchd will report once applied.
     """
-    executable = "iptables-legacy"
-    rule_def = [
-        "POSTROUTING",
-        "-w",
-        "-t",
-        "nat",
-        "-s",
-        cidr,
-        "-j",
-        "MASQUERADE",
-        "-m",
-        "comment",
-        "--comment",
-        comment,
+    external_ids = {
+        "ovn-encap-type": "geneve",
+        "ovn-encap-ip": OVN_ENCAP_IP,
+        "system-id": system_id,
+        "ovn-match-northd-version": "true",
+        "ovn-remote": OVNSB_CONNECTION,
+        "ovn-bridge-mappings": f"physnet1:{EXTERNAL_BRIDGE}",
+        "ovn-cms-options": "enable-chassis-as-gw",
+    }
+    bridge_settings = {
+        "datapath_type": "system",
+        "protocols": ovsdb.ovs_set(["OpenFlow13", "OpenFlow15"]),
+    }
+    bridge_where = [["name", "==", EXTERNAL_BRIDGE]]
+    (bridges,) = client.transact(
+        "Open_vSwitch",
+        {"op": "select", "table": "Bridge", "where": bridge_where, "columns": []},
+    )
+    operations = [
+        {
+            "op": "mutate",
+            "table": "Open_vSwitch",
+            "where": [],
+            "mutations": [
+                ["external_ids", "delete", ovsdb.ovs_set(external_ids)],
+                ["external_ids", "insert", ovsdb.ovs_map(external_ids)],
+                ["next_cfg", "+=", 1],
+            ],
+        },
     ]
-    found = False
-    try:
-        core_utils.run(executable, ["--check", *rule_def])
-    except subprocess.CalledProcessError as e:
-        # --check has an RC of 1 if the rule does not exist
-        if e.returncode == 1 and re.search(r"No.*match by that name", e.stderr):
-            LOG.debug(f"Postrouting iptable rule for {cidr} missing")
-            found = False
-        else:
-            LOG.warning(f"Failed to lookup postrouting iptable rule for {cidr}")
+    if bridges["rows"]:
+        operations.append(
+            {
+                "op": "update",
+                "table": "Bridge",
+                "where": bridge_where,
+                "row": bridge_settings,
+            }
+        )
     else:
-        # If not exception was raised then the rule exists.
-        LOG.debug(f"Found existing postrouting rule for {cidr}")
-        found = True
-    if not found:
-        LOG.debug(f"Adding postrouting iptable rule for {cidr}")
-        core_utils.run(executable, ["--append", *rule_def])
+        # Same as ovs-vsctl add-br: a bridge with its internal port
+        operations.extend(
+            [
+                # Fail if the bridge was created in the meantime
+                {
+                    "op": "wait",
+                    "table": "Bridge",
+                    "where": bridge_where,
+                    "columns": ["name"],
+                    "until": "==",
+                    "rows": [],
+                    "timeout": 0,
+                },
+                {
+                    "op": "insert",
+                    "table": "Interface",
+                    "row": {"name": EXTERNAL_BRIDGE, "type": "internal"},
+                    "uuid-name": "iface",
+                },
+                {
+                    "op": "insert",
+                    "table": "Port",
+                    "row": {
+                        "name": EXTERNAL_BRIDGE,
+                        "interfaces": ["named-uuid", "iface"],
+                    },
+                    "uuid-name": "port",
+                },
+                {
+                    "op": "insert",
+                    "table": "Bridge",
+                    "row": {
+                        "name": EXTERNAL_BRIDGE,
+                        "ports": ["named-uuid", "port"],
+                        **bridge_settings,
+                    },
+                    "uuid-name": "bridge",
+                },
+                {
+                    "op": "mutate",
+                    "table": "Open_vSwitch",
+                    "where": [],
+                    "mutations": [["bridges", "insert", ["named-uuid", "bridge"]]],
+                },
+            ]
+        )
+    operations.append(
+        {"op": "select", "table": "Open_vSwitch", "where": [], "columns": ["next_cfg"]}
+    )
+    results = client.transact("Open_vSwitch", *operations)
+    return results[-1]["rows"][0]["next_cfg"]
+
+
+def configure_external_bridge():
+    network = ipaddress.ip_network(EXTERNAL_CIDR)
+    ip = str(next(network.hosts()))
+    net.ensure_address(EXTERNAL_BRIDGE, ip, network.prefixlen)
+    net.ensure_link_up(EXTERNAL_BRIDGE)
+
+
+def nat_rules() -> typing.List[firewall.NatRule]:
+    """Masquerade traffic of the external network."""
+    return [firewall.NatRule("POSTROUTING", EXTERNAL_CIDR, "ovn-external-bridge")]
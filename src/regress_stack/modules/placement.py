@@ -1,12 +1,13 @@
 import logging
 
+from regress_stack.core import sizing as core_sizing
 from regress_stack.core import utils as core_utils
 from regress_stack.modules import keystone, mysql
 from regress_stack.modules import utils as module_utils
 
 LOG = logging.getLogger(__name__)
 
-DEPENDENCIES = {keystone, mysql}
+DEPENDENCIES = {"keystone", "mysql"}
 PACKAGES = ["placement-api"]
 LOGS = ["/var/log/placement/"]  # empty?
 
@@ -15,28 +16,31 @@ URL = f"http://{core_utils.fqdn()}:8778/"
 
 
 def setup():
+    sizing = core_sizing.current()
     db_user, db_pass = mysql.ensure_service("placement")
     username, password = keystone.ensure_service_account("placement", "placement", URL)
-    core_utils.run(
-        "sed",
-        [
-            "-i",
-            "s|placement-api processes=5 threads=1|placement-api processes=1 threads=1|",
-            "/etc/apache2/sites-enabled/placement-api.conf",
-        ],
+    changed = module_utils.file_sub(
+        "/etc/apache2/sites-enabled/placement-api.conf",
+        r"placement-api processes=\d+",
+        f"placement-api processes={sizing.wsgi_processes}",
     )
-    module_utils.cfg_set(
+    changed |= module_utils.cfg_set(
         CONF,
         (
             "placement_database",
             "connection",
             mysql.connection_string("placement", db_user, db_pass),
         ),
-        ("placement_database", "max_pool_size", "1"),
+        ("placement_database", "max_pool_size", str(sizing.max_pool_size)),
         ("api", "auth_strategy", "keystone"),
         *module_utils.dict_to_cfg_set_args(
             "keystone_authtoken", keystone.authtoken_service(username, password)
         ),
     )
     core_utils.sudo("placement-manage", ["db", "sync"], user="placement")
-    core_utils.restart_apache()
+    core_utils.restart_apache(changed)
+
+
+def teardown():
+    # Served by apache, stopped with keystone
+    mysql.drop_service("placement")
@@ -1,4 +1,7 @@
 import logging
+import pathlib
+import re
+import threading
 import typing
 
 from regress_stack.core import utils as core_utils
@@ -12,14 +15,55 @@ LOGS = [
 
 REGION = "AutoPkgOne"
 
+# Serialize writes to a same file from concurrent hooks
+_FILE_LOCKS: typing.Dict[str, threading.Lock] = {}
+
 
 def setup():
     pass
 
 
-def cfg_set(config_file: str, *args: typing.Tuple[str, str, str]) -> None:
+def cfg_set(config_file: str, *args: typing.Tuple[str, str, str]) -> bool:
+    """Set options in config_file, return whether the file had to be written.
+
+    Nothing is written when the same options were applied by a completed
+    setup and the file was not modified since.
+    """
+    desired = core_utils.fingerprint(repr(args))
+    core_utils.record_config(config_file, desired)
+    if core_utils.config_applied(config_file, desired):
+        LOG.debug("%s is up to date", config_file)
+        return False
+    sections: typing.Dict[str, typing.List[str]] = {}
     for section, key, value in args:
-        core_utils.run("crudini", ["--set", config_file, section, key, value])
+        sections.setdefault(section, []).append(f"{key} = {value}")
+    ini = "".join(
+        f"[{section}]\n" + "".join(line + "\n" for line in lines)
+        for section, lines in sections.items()
+    )
+    with _FILE_LOCKS.setdefault(config_file, threading.Lock()):
+        core_utils.run("crudini", ["--merge", config_file], input=ini)
+    return True
+
+
+def file_sub(path: str, pattern: str, repl: str) -> bool:
+    """Substitute regex pattern by repl in file at path, return whether it changed."""
+    file = pathlib.Path(path)
+    content = file.read_text()
+    new_content = re.sub(pattern, repl, content)
+    if new_content == content:
+        return False
+    file.write_text(new_content)
+    return True
+
+
+def file_write(path: str, content: str) -> bool:
+    """Write content to file at path, return whether it changed."""
+    file = pathlib.Path(path)
+    if file.exists() and file.read_text() == content:
+        return False
+    file.write_text(content)
+    return True
 
 
 def dict_to_cfg_set_args(
@@ -0,0 +1,88 @@
+import random
+import time
+
+import networkx as nx
+import pytest
+
+from regress_stack.core.metadata import ModuleMetadata
+from regress_stack.core.modules import ModuleComp, filter_graph, prune_graph, sort_graph
+
+# Planning must stay in the millisecond range, even with thousands of
+# modules. Budgets are generous to stay stable on loaded CI runners.
+PLANNING_BUDGET = 1.0
+
+
+def synthetic_graph(
+    size: int,
+    max_deps: int = 4,
+    optional_ratio: float = 0.2,
+    uninstalled_ratio: float = 0.05,
+    seed: int = 0,
+) -> nx.DiGraph:
+    """Generate a module graph shaped like regress_stack.modules.
+
+    Every module depends on up to max_deps modules generated before it, so
+    the graph is acyclic. A share of edges is optional, and a share of
+    modules is not installed.
+    """
+    rng = random.Random(seed)
+    graph: nx.DiGraph = nx.DiGraph()
+    nodes = []
+    for i in range(size):
+        name = f"regress_stack.modules.mod{i}"
+        node = ModuleComp(name, ModuleMetadata(path=f"/fake/path/mod{i}.py"))
+        graph.add_node(node, installed=rng.random() >= uninstalled_ratio)
+        for dep in rng.sample(nodes, min(len(nodes), rng.randint(0, max_deps))):
+            graph.add_edge(dep, node, optional=rng.random() < optional_ratio)
+        nodes.append(node)
+    return graph
+
+
+def reference_filter_graph(G: nx.DiGraph) -> set:
+    """Fixed-point implementation of filter_graph semantics."""
+    to_remove = {n for n, data in G.nodes(data=True) if not data["installed"]}
+    changed = True
+    while changed:
+        changed = False
+        for node in G.nodes:
+            if node in to_remove:
+                continue
+            preds = list(G.predecessors(node))
+            only_optional = bool(preds) and all(
+                G[pred][node]["optional"] for pred in preds
+            )
+            missing_required = any(
+                pred in to_remove and not G[pred][node]["optional"] for pred in preds
+            )
+            if only_optional or missing_required:
+                to_remove.add(node)
+                changed = True
+    return set(G.nodes) - to_remove
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_filter_graph_matches_fixed_point(seed):
+    graph = synthetic_graph(200, uninstalled_ratio=0.1, seed=seed)
+    expected = reference_filter_graph(graph)
+    assert set(filter_graph(graph.copy()).nodes) == expected
+
+
+@pytest.mark.parametrize("size", [1000, 5000])
+def test_planning_scales(size):
+    graph = synthetic_graph(size)
+    start = time.perf_counter()
+    order = sort_graph(prune_graph(graph))
+    elapsed = time.perf_counter() - start
+    assert elapsed < PLANNING_BUDGET, f"planning {size} modules took {elapsed:.3f}s"
+    assert len(order) == len(graph.nodes)
+
+
+def test_planning_to_target_scales():
+    graph = synthetic_graph(5000)
+    # The last module generated that survives filtering has the deepest chain
+    target = list(filter_graph(graph.copy()).nodes)[-1]
+    start = time.perf_counter()
+    order = sort_graph(prune_graph(graph), target.name.rsplit(".")[-1])
+    elapsed = time.perf_counter() - start
+    assert elapsed < PLANNING_BUDGET, f"planning to target took {elapsed:.3f}s"
+    assert order[-1] == target
@@ -0,0 +1,59 @@
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+import pytest
+
+import regress_stack
+
+# Startup of the CLI, before a command does any work. Budgets are generous
+# to stay stable on loaded CI runners.
+IMPORT_BUDGET = 0.25
+WALL_BUDGET = 1.0
+# Only loaded by the commands needing them
+HEAVY_MODULES = ("apt", "networkx", "openstack", "pyroute2")
+COMMANDS = ("plan", "setup", "reset", "test", "bench", "list-modules", "agent")
+# What the regress-stack console script runs
+ENTRY_POINT = "from regress_stack.__main__ import main; main()"
+
+
+def _run_help(*args: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    src = str(pathlib.Path(regress_stack.__file__).parents[1])
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, (src, env.get("PYTHONPATH"))))
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", ENTRY_POINT, *args, "--help"],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+
+def _imports(stderr: str) -> dict:
+    """Map imported modules to their cumulative import time, in seconds."""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            imports[name.strip()] = int(cumulative) / 1e6
+    return imports
+
+
+@pytest.mark.parametrize("command", (None, *COMMANDS))
+def test_startup_budget(command):
+    args = (command,) if command else ()
+    start = time.perf_counter()
+    result = _run_help(*args)
+    wall = time.perf_counter() - start
+    imports = _imports(result.stderr)
+
+    heavy = sorted({name.split(".")[0] for name in imports} & set(HEAVY_MODULES))
+    assert not heavy, f"Imported at startup: {heavy}"
+    import_time = imports["regress_stack.__main__"]
+    assert import_time < IMPORT_BUDGET, f"{import_time:.3f}s"
+    assert wall < WALL_BUDGET, f"{wall:.3f}s"
@@ -0,0 +1,49 @@
+import io
+import logging
+import threading
+
+import pytest
+
+from regress_stack.core import agent
+
+
+@pytest.fixture
+def agent_socket(tmp_path):
+    # Unix socket paths are limited to about 100 characters
+    path = tmp_path / "a.sock"
+    calls = []
+
+    def handler(argv):
+        calls.append(argv)
+        print("running", *argv)
+        logging.getLogger("regress_stack.test").warning("almost done")
+        if argv == ["fail"]:
+            raise RuntimeError("failed")
+        if argv == ["exit"]:
+            raise SystemExit(2)
+
+    server = agent.AgentServer(path, handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield path, calls
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    assert not path.exists()
+
+
+@pytest.mark.parametrize("argv, code", [(["plan"], 0), (["fail"], 1), (["exit"], 2)])
+def test_submit(agent_socket, argv, code):
+    path, calls = agent_socket
+    stdout, stderr = io.StringIO(), io.StringIO()
+    assert agent.submit(argv, path, stdout, stderr) == code
+    assert stdout.getvalue() == "running " + " ".join(argv) + "\n"
+    assert "almost done" in stderr.getvalue()
+    assert calls == [argv]
+
+
+def test_submit_keeps_state(agent_socket):
+    path, calls = agent_socket
+    for argv in (["setup"], ["test"]):
+        agent.submit(argv, path, io.StringIO(), io.StringIO())
+    assert calls == [["setup"], ["test"]]
@@ -1,3 +1,5 @@
+import os
+import sys
 from unittest.mock import Mock
 
 import pytest
@@ -10,7 +12,8 @@ def mock_apt(monkeypatch):
     cache = {}
     apt = Mock(Cache=Mock(return_value=cache))
 
-    monkeypatch.setattr("regress_stack.core.apt.apt", apt)
+    # apt is imported on first use
+    monkeypatch.setitem(sys.modules, "apt", apt)
     yield apt
 
 
@@ -27,3 +30,28 @@ def test_pkgs_installed(mock_apt):
     regress_stack.core.apt.APT_CACHE = None
     mock_apt.Cache()["pkg"] = Mock(is_installed=True)
     assert regress_stack.core.apt.pkgs_installed(["pkg"]) is True
+
+
+def test_pkg_versions(mock_apt):
+    regress_stack.core.apt.APT_CACHE = None
+    mock_apt.Cache()["pkg"] = Mock(installed=Mock(version="1.0"))
+    mock_apt.Cache()["removed"] = Mock(installed=None)
+    assert regress_stack.core.apt.pkg_versions(["pkg", "removed", "unknown"]) == {
+        "pkg": "1.0",
+        "removed": None,
+        "unknown": None,
+    }
+
+
+def test_get_cache_reloads_after_dpkg_change(mock_apt, monkeypatch, tmp_path):
+    status = tmp_path / "status"
+    status.write_text("")
+    monkeypatch.setattr("regress_stack.core.apt.DPKG_STATUS", status)
+    regress_stack.core.apt.APT_CACHE = None
+    regress_stack.core.apt.get_cache()
+    regress_stack.core.apt.get_cache()
+    assert mock_apt.Cache.call_count == 1
+
+    os.utime(status, (0, 0))
+    regress_stack.core.apt.get_cache()
+    assert mock_apt.Cache.call_count == 2
@@ -0,0 +1,32 @@
+import threading
+
+import pytest
+
+from regress_stack.core import bench
+
+
+def test_percentile():
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert bench.percentile(values, 50) == 3.0
+    assert bench.percentile(values, 95) == pytest.approx(4.8)
+    assert bench.percentile(values, 100) == 5.0
+    assert bench.percentile([], 99) == 0.0
+
+
+def test_run_operation():
+    calls = []
+    lock = threading.Lock()
+
+    def operation():
+        with lock:
+            calls.append(threading.get_ident())
+            if len(calls) % 5 == 0:
+                raise RuntimeError("boom")
+
+    stats = bench.run_operation("glance.image_list", operation, 20, concurrency=4)
+
+    assert len(calls) == 20
+    assert stats.errors == 4
+    assert stats.throughput > 0
+    assert set(stats.latencies) == {"p50", "p95", "p99", "min", "max", "mean"}
+    assert stats.latencies["min"] <= stats.latencies["p50"] <= stats.latencies["max"]
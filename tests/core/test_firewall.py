@@ -0,0 +1,50 @@
+from unittest.mock import patch
+
+from regress_stack.core import firewall
+
+DUMP = """\
+# Generated by iptables-save v1.8.10 on Mon Jan  1 00:00:00 2025
+*nat
+:PREROUTING ACCEPT [0:0]
+:POSTROUTING ACCEPT [0:0]
+-A POSTROUTING -s 10.127.147.0/24 -m comment --comment ovn-external-bridge -j MASQUERADE
+-A POSTROUTING -s 10.0.0.0/8 -m comment --comment "other network" -j MASQUERADE
+COMMIT
+"""
+
+EXTERNAL = firewall.NatRule("POSTROUTING", "10.127.147.0/24", "ovn-external-bridge")
+OTHER = firewall.NatRule("POSTROUTING", "10.0.0.0/8", "other network")
+NEW = firewall.NatRule("POSTROUTING", "10.1.0.0/16", "new network")
+
+
+def test_missing_rules():
+    assert firewall.missing_rules([EXTERNAL, OTHER, NEW, NEW], DUMP) == [NEW]
+
+
+def test_reconcile():
+    with patch.object(firewall.utils, "run", return_value=DUMP) as run:
+        assert firewall.reconcile([EXTERNAL, NEW]) == [NEW]
+    run.assert_called_with(
+        firewall.RESTORE,
+        ["--noflush", "-w"],
+        input='*nat\n-A POSTROUTING -s 10.1.0.0/16 -m comment --comment "new network"'
+        " -j MASQUERADE\nCOMMIT\n",
+    )
+    assert run.call_count == 2
+
+
+def test_reconcile_nothing_missing():
+    with patch.object(firewall.utils, "run", return_value=DUMP) as run:
+        assert firewall.reconcile([EXTERNAL]) == []
+    run.assert_called_once_with(firewall.SAVE, ["-t", "nat"])
+
+
+def test_remove():
+    with patch.object(firewall.utils, "run", return_value=DUMP) as run:
+        assert firewall.remove([OTHER, NEW]) == [OTHER]
+    run.assert_called_with(
+        firewall.RESTORE,
+        ["--noflush", "-w"],
+        input='*nat\n-D POSTROUTING -s 10.0.0.0/8 -m comment --comment "other network"'
+        " -j MASQUERADE\nCOMMIT\n",
+    )
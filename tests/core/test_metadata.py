@@ -0,0 +1,100 @@
+import sys
+import textwrap
+
+import pytest
+
+import regress_stack.modules
+from regress_stack.core.metadata import ModuleMetadata, index_package, read_metadata
+
+SOURCE = """\
+import logging
+
+from regress_stack.core import utils as core_utils
+from regress_stack.modules import keystone, mysql
+from regress_stack.modules import utils as module_utils
+from . import ovn
+import regress_stack.modules.ceph as ceph_mod
+
+LOG = logging.getLogger(__name__)
+
+DEPENDENCIES = {keystone, mysql, ovn}
+OPTIONAL_DEPENDENCIES: set = {ceph_mod}
+PACKAGES = ["neutron-server"]
+LOGS = ["/var/log/neutron/"]
+URL = f"http://{core_utils.fqdn()}:9696/"
+TEST_INCLUDE_REGEXES = [
+    r"tempest.api.network",
+]
+
+
+def setup():
+    pass
+
+
+def configure_tempest(tempest_conf):
+    pass
+
+
+def helper():
+    pass
+"""
+
+
+def test_read_metadata(tmp_path):
+    path = tmp_path / "neutron.py"
+    path.write_text(SOURCE)
+    assert read_metadata(path, "regress_stack.modules") == ModuleMetadata(
+        path=str(path),
+        dependencies=[
+            "regress_stack.modules.keystone",
+            "regress_stack.modules.mysql",
+            "regress_stack.modules.ovn",
+        ],
+        optional_dependencies=["regress_stack.modules.ceph"],
+        packages=["neutron-server"],
+        logs=["/var/log/neutron/"],
+        test_include_regexes=["tempest.api.network"],
+        hooks=["setup", "configure_tempest"],
+    )
+
+
+def test_read_metadata_dependencies_by_name(tmp_path):
+    path = tmp_path / "octavia.py"
+    path.write_text('DEPENDENCIES = {"neutron", "keystone"}\n')
+    assert read_metadata(path, "regress_stack_octavia").dependencies == [
+        "keystone",
+        "neutron",
+    ]
+
+
+def test_read_metadata_empty_dependencies(tmp_path):
+    path = tmp_path / "mod.py"
+    path.write_text("DEPENDENCIES = set()\n")
+    assert read_metadata(path, "regress_stack.modules").dependencies == []
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "DEPENDENCIES = {keystone}\n",
+        "DEPENDENCIES = compute()\n",
+        "PACKAGES = packages()\n",
+    ],
+)
+def test_read_metadata_invalid(tmp_path, source):
+    path = tmp_path / "mod.py"
+    path.write_text(textwrap.dedent(source))
+    with pytest.raises(RuntimeError):
+        read_metadata(path, "regress_stack.modules")
+
+
+def test_index_package_does_not_import():
+    before = set(sys.modules)
+    index = index_package(
+        regress_stack.modules.__path__[0], regress_stack.modules.__name__
+    )
+    assert "regress_stack.modules.keystone" in index
+    assert index["regress_stack.modules.keystone"].dependencies == ["mysql"]
+    assert not {
+        name for name in set(sys.modules) - before if name.startswith("regress_stack")
+    }
@@ -1,62 +1,70 @@
+import sys
+import textwrap
+import threading
+import time
+from importlib.metadata import EntryPoint
 from unittest.mock import Mock, patch
 
 import networkx as nx
 import pytest
 
-from regress_stack.core.modules import ModuleComp, build_dependency_graph, filter_graph
+from regress_stack.core.metadata import read_metadata
+from regress_stack.core.modules import (
+    ModuleComp,
+    build_dependency_graph,
+    filter_graph,
+    get_ancestors,
+    run_in_dependency_order,
+)
 
 
 @pytest.fixture
-def mock_modules():
-    mock_mod1 = Mock()
-    mock_mod1.name = "mod1"
-    mock_mod1.__name__ = "regress_stack.modules.mod1"
-    mock_mod1.__file__ = "/fake/path/mod1.py"
-    mock_mod1.DEPENDENCIES = set()
-    mock_mod1.OPTIONAL_DEPENDENCIES = set()
-    mock_mod1.PACKAGES = ["pkg1"]
-
-    mock_mod2 = Mock()
-    mock_mod2.name = "mod2"
-    mock_mod2.__name__ = "regress_stack.modules.mod2"
-    mock_mod2.__file__ = "/fake/path/mod2.py"
-    mock_mod2.DEPENDENCIES = {mock_mod1}
-    mock_mod2.OPTIONAL_DEPENDENCIES = set()
-    mock_mod2.PACKAGES = ["pkg2"]
-
-    mock_mod3 = Mock()
-    mock_mod3.name = "mod3"
-    mock_mod3.__name__ = "regress_stack.modules.mod3"
-    mock_mod3.__file__ = "/fake/path/mod3.py"
-    mock_mod3.DEPENDENCIES = set()
-    mock_mod3.OPTIONAL_DEPENDENCIES = {mock_mod1}
-    mock_mod3.PACKAGES = ["pkg3"]
+def mock_modules(tmp_path):
+    (tmp_path / "mod1.py").write_text(
+        textwrap.dedent(
+            """\
+            PACKAGES = ["pkg1"]
+            """
+        )
+    )
+    (tmp_path / "mod2.py").write_text(
+        textwrap.dedent(
+            """\
+            from regress_stack.modules import mod1
+
+            DEPENDENCIES = {mod1}
+            PACKAGES = ["pkg2"]
+            """
+        )
+    )
+    (tmp_path / "mod3.py").write_text(
+        textwrap.dedent(
+            """\
+            from regress_stack.modules import mod1
+
+            OPTIONAL_DEPENDENCIES = {mod1}
+            PACKAGES = ["pkg3"]
+            """
+        )
+    )
 
     mock_modules_mod = Mock()
-    mock_modules_mod.__path__ = ["/fake/path"]
+    mock_modules_mod.__path__ = [str(tmp_path)]
     mock_modules_mod.__package__ = "regress_stack.modules"
-    mock_modules_mod.mod1 = mock_mod1
-    mock_modules_mod.mod2 = mock_mod2
-    mock_modules_mod.mod3 = mock_mod3
 
     return mock_modules_mod
 
 
-@patch("regress_stack.core.modules.pkgutil.iter_modules")
+def _comp(modules_mod, name: str) -> ModuleComp:
+    return ModuleComp(
+        "regress_stack.modules." + name,
+        read_metadata(f"{modules_mod.__path__[0]}/{name}.py", "regress_stack.modules"),
+    )
+
+
 @patch("regress_stack.core.modules.load_module")
 @patch("regress_stack.core.modules.apt.pkgs_installed")
-def test_build_dependency_graph(
-    mock_pkgs_installed, mock_load_module, mock_iter_modules, mock_modules
-):
-    mock_iter_modules.return_value = [
-        mock_modules.mod1,
-        mock_modules.mod2,
-        mock_modules.mod3,
-    ]
-
-    mock_load_module.side_effect = lambda name, path: getattr(
-        mock_modules, name.rsplit(".", 1)[1]
-    )
+def test_build_dependency_graph(mock_pkgs_installed, mock_load_module, mock_modules):
     mock_pkgs_installed.return_value = True
 
     graph = build_dependency_graph(mock_modules)
@@ -65,9 +73,9 @@ def test_build_dependency_graph(
     assert len(graph.nodes) == 3
     assert len(graph.edges) == 2
 
-    mod1 = ModuleComp("regress_stack.modules.mod1", mock_modules.mod1)
-    mod2 = ModuleComp("regress_stack.modules.mod2", mock_modules.mod2)
-    mod3 = ModuleComp("regress_stack.modules.mod3", mock_modules.mod3)
+    mod1 = _comp(mock_modules, "mod1")
+    mod2 = _comp(mock_modules, "mod2")
+    mod3 = _comp(mock_modules, "mod3")
 
     assert graph.has_node(mod1)
     assert graph.has_node(mod2)
@@ -84,22 +92,15 @@ def test_build_dependency_graph(
     assert graph[mod1][mod2]["optional"] is False
     assert graph[mod1][mod3]["optional"] is True
 
+    # Planning never imports module code
+    mock_load_module.assert_not_called()
+
 
-@patch("regress_stack.core.modules.pkgutil.iter_modules")
 @patch("regress_stack.core.modules.load_module")
 @patch("regress_stack.core.modules.apt.pkgs_installed")
 def test_build_dependency_graph_missing_packages(
-    mock_pkgs_installed, mock_load_module, mock_iter_modules, mock_modules
+    mock_pkgs_installed, mock_load_module, mock_modules
 ):
-    mock_iter_modules.return_value = [
-        mock_modules.mod1,
-        mock_modules.mod2,
-        mock_modules.mod3,
-    ]
-
-    mock_load_module.side_effect = lambda name, path: getattr(
-        mock_modules, name.rsplit(".", 1)[1]
-    )
     mock_pkgs_installed.side_effect = lambda pkgs: pkgs != ["pkg1"]
 
     graph = build_dependency_graph(mock_modules)
@@ -108,9 +109,9 @@ def test_build_dependency_graph_missing_packages(
     assert len(graph.nodes) == 3
     assert len(graph.edges) == 2
 
-    mod1 = ModuleComp("regress_stack.modules.mod1", mock_modules.mod1)
-    mod2 = ModuleComp("regress_stack.modules.mod2", mock_modules.mod2)
-    mod3 = ModuleComp("regress_stack.modules.mod3", mock_modules.mod3)
+    mod1 = _comp(mock_modules, "mod1")
+    mod2 = _comp(mock_modules, "mod2")
+    mod3 = _comp(mock_modules, "mod3")
 
     assert graph.has_node(mod1)
     assert graph.has_node(mod2)
@@ -119,6 +120,61 @@ def test_build_dependency_graph_missing_packages(
     assert graph.nodes[mod1]["installed"] is False
     assert graph.nodes[mod2]["installed"] is True
     assert graph.nodes[mod3]["installed"] is True
+    mock_load_module.assert_not_called()
+
+
+@patch("regress_stack.core.modules.load_module")
+def test_module_comp_loads_lazily(mock_load_module, mock_modules):
+    mod1 = _comp(mock_modules, "mod1")
+    mock_load_module.assert_not_called()
+    assert mod1.module is mock_load_module.return_value
+    mock_load_module.assert_called_once_with(
+        "regress_stack.modules.mod1", f"{mock_modules.__path__[0]}/mod1.py"
+    )
+
+
+@pytest.fixture
+def mock_plugin(tmp_path, monkeypatch):
+    plugin_dir = tmp_path / "site" / "regress_stack_octavia"
+    plugin_dir.mkdir(parents=True)
+    (plugin_dir / "__init__.py").write_text("")
+    (plugin_dir / "octavia.py").write_text(
+        textwrap.dedent(
+            """\
+            DEPENDENCIES = {"mod2"}
+            OPTIONAL_DEPENDENCIES = {"mod3"}
+            PACKAGES = ["octavia-api"]
+            """
+        )
+    )
+    monkeypatch.syspath_prepend(str(tmp_path / "site"))
+    entry_points = [
+        EntryPoint("octavia", "regress_stack_octavia.octavia", "regress_stack.modules"),
+        EntryPoint("mod1", "regress_stack_octavia.mod1", "regress_stack.modules"),
+    ]
+    with patch("regress_stack.core.modules._entry_points", return_value=entry_points):
+        yield plugin_dir / "octavia.py"
+
+
+@patch("regress_stack.core.modules.load_module")
+@patch("regress_stack.core.modules.apt.pkgs_installed")
+def test_build_dependency_graph_plugins(
+    mock_pkgs_installed, mock_load_module, mock_modules, mock_plugin
+):
+    mock_pkgs_installed.return_value = True
+
+    graph = build_dependency_graph(mock_modules)
+
+    octavia = ModuleComp(
+        "regress_stack_octavia.octavia",
+        read_metadata(mock_plugin, "regress_stack_octavia"),
+    )
+    assert len(graph.nodes) == 4
+    assert graph.has_edge(_comp(mock_modules, "mod2"), octavia)
+    assert graph[_comp(mock_modules, "mod3")][octavia]["optional"] is True
+    mock_load_module.assert_not_called()
+    assert "regress_stack_octavia" not in sys.modules
+    assert "regress_stack_octavia.octavia" not in sys.modules
 
 
 def test_filter_graph_all_installed(mock_modules):
@@ -220,3 +276,74 @@ def test_filter_graph_optional_dependency_missing():
     assert graph.has_node("mysql")
     assert graph.has_node("glance")
     assert graph.has_edge("mysql", "glance")
+
+
+def test_run_in_dependency_order():
+    """Test the following graph, with glance not selected:
+
+    mysql -> keystone -> glance -> nova
+    mysql -> neutron
+    """
+    graph = nx.DiGraph(
+        [
+            ("mysql", "keystone"),
+            ("keystone", "glance"),
+            ("glance", "nova"),
+            ("mysql", "neutron"),
+        ]
+    )
+    lock = threading.Lock()
+    events = []
+
+    def func(mod):
+        with lock:
+            events.append(("start", mod))
+        time.sleep(0.05)
+        with lock:
+            events.append(("end", mod))
+
+    run_in_dependency_order(graph, ["nova", "neutron", "keystone", "mysql"], func)
+
+    assert events[:2] == [("start", "mysql"), ("end", "mysql")]
+    assert events.index(("end", "keystone")) < events.index(("start", "nova"))
+    # Independent modules run concurrently
+    assert events.index(("start", "neutron")) < events.index(("end", "keystone"))
+
+
+def test_run_in_dependency_order_failure():
+    graph = nx.DiGraph([("mysql", "keystone")])
+    func = Mock(side_effect=RuntimeError("mysql failed"))
+
+    with pytest.raises(RuntimeError, match="mysql failed"):
+        run_in_dependency_order(graph, ["mysql", "keystone"], func)
+    func.assert_called_once_with("mysql")
+
+
+def test_run_in_dependency_order_reverse():
+    graph = nx.DiGraph([("mysql", "keystone"), ("keystone", "glance")])
+    done = []
+
+    run_in_dependency_order(
+        graph, ["mysql", "keystone", "glance"], done.append, reverse=True
+    )
+
+    assert done == ["glance", "keystone", "mysql"]
+
+
+def test_get_ancestors():
+    graph = nx.DiGraph(
+        [
+            ("mysql", "keystone"),
+            ("keystone", "heat"),
+            ("keystone", "cinder"),
+            ("ceph", "cinder"),
+            ("keystone", "glance"),
+        ]
+    )
+    assert get_ancestors(graph, ["heat", "cinder"]) == {
+        "mysql",
+        "keystone",
+        "heat",
+        "ceph",
+        "cinder",
+    }
@@ -0,0 +1,124 @@
+import json
+import socket
+import threading
+
+import pytest
+
+from regress_stack.core import ovsdb
+
+
+class FakeServer(threading.Thread):
+    """Answer requests of a client with handler, sending raw chunks."""
+
+    def __init__(self, sock, handler):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.handler = handler
+        self.received = []
+
+    def run(self):
+        decoder = json.JSONDecoder()
+        buffer = ""
+        while True:
+            data = self.sock.recv(65536)
+            if not data:
+                return
+            buffer += data.decode()
+            while buffer:
+                try:
+                    message, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    break
+                buffer = buffer[end:].lstrip()
+                self.received.append(message)
+                for chunk in self.handler(message):
+                    self.sock.sendall(chunk.encode())
+
+
+@pytest.fixture
+def serve():
+    sockets = []
+
+    def serve(handler):
+        client_sock, server_sock = socket.socketpair()
+        sockets.extend((client_sock, server_sock))
+        server = FakeServer(server_sock, handler)
+        server.start()
+        return ovsdb.Client(client_sock), server
+
+    yield serve
+    for sock in sockets:
+        sock.close()
+
+
+def _reply(message, result):
+    return json.dumps({"id": message["id"], "result": result, "error": None})
+
+
+def test_transact_answers_echo(serve):
+    def handler(message):
+        if message.get("method") == "transact":
+            reply = _reply(message, [{"rows": [{"next_cfg": 2}]}])
+            # Echo request first, then the reply split across writes
+            yield json.dumps({"id": "echo", "method": "echo", "params": []})
+            yield reply[:10]
+            yield reply[10:]
+
+    client, server = serve(handler)
+    results = client.transact(
+        "Open_vSwitch",
+        {"op": "select", "table": "Open_vSwitch", "where": []},
+    )
+    assert results == [{"rows": [{"next_cfg": 2}]}]
+    client.close()
+    server.join(1)
+    assert {"id": "echo", "result": [], "error": None} in server.received
+
+
+def test_transact_error(serve):
+    def handler(message):
+        yield _reply(message, [{}, {"error": "constraint violation", "details": "x"}])
+
+    client, _ = serve(handler)
+    with pytest.raises(RuntimeError, match="constraint violation"):
+        client.transact("Open_vSwitch", {"op": "insert"}, {"op": "insert"})
+
+
+def test_wait(serve):
+    def handler(message):
+        if message["method"] == "monitor":
+            monitor_id = message["params"][1]
+            yield _reply(message, {"Chassis": {"u1": {"new": {"name": "other"}}}})
+            for update in (
+                {"u1": {"old": {"name": "other"}}},
+                {"u2": {"new": {"name": "host"}}},
+            ):
+                yield json.dumps(
+                    {
+                        "id": None,
+                        "method": "update",
+                        "params": [monitor_id, {"Chassis": update}],
+                    }
+                )
+        elif message["method"] == "monitor_cancel":
+            yield _reply(message, {})
+
+    client, server = serve(handler)
+    rows = client.wait(
+        "OVN_Southbound",
+        "Chassis",
+        ["name"],
+        lambda rows: any(row["name"] == "host" for row in rows.values()),
+        timeout=5,
+    )
+    assert rows == {"u2": {"name": "host"}}
+    assert server.received[-1]["method"] == "monitor_cancel"
+
+
+def test_wait_timeout(serve):
+    def handler(message):
+        yield _reply(message, {})
+
+    client, _ = serve(handler)
+    with pytest.raises(RuntimeError, match="Timed out"):
+        client.wait("OVN_Southbound", "SB_Global", ["nb_cfg"], bool, timeout=0.2)
@@ -0,0 +1,205 @@
+import types
+from unittest.mock import patch
+
+import networkx as nx
+import pytest
+
+from regress_stack.core import plan
+from regress_stack.core.metadata import ModuleMetadata
+from regress_stack.core.modules import ModuleComp
+from regress_stack.core.plan import ExecutionPlan
+
+
+@pytest.fixture
+def mock_modules():
+    return types.ModuleType("regress_stack.modules")
+
+
+def _comp(name: str, **metadata) -> ModuleComp:
+    return ModuleComp(
+        "regress_stack.modules." + name,
+        ModuleMetadata(path=f"/fake/path/{name}.py", **metadata),
+    )
+
+
+@pytest.fixture
+def mock_graph():
+    comps = {
+        "utils": _comp("utils", packages=["crudini"], logs=["/var/log/apache2/"]),
+        "mysql": _comp("mysql", packages=["mysql-server"], logs=["/var/log/mysql/"]),
+        "keystone": _comp("keystone", packages=["keystone"]),
+        "heat": _comp(
+            "heat",
+            packages=["heat-api"],
+            test_include_regexes=["heat_tempest_plugin"],
+            test_exclude_regexes=["aodh"],
+            hooks=["setup", "configure_tempest"],
+        ),
+    }
+    graph = nx.DiGraph()
+    for comp in comps.values():
+        graph.add_node(comp, installed=True)
+    graph.add_edge(comps["mysql"], comps["keystone"], optional=False)
+    graph.add_edge(comps["keystone"], comps["heat"], optional=False)
+    return graph
+
+
+@pytest.fixture
+def execution_plan(mock_modules, mock_graph, monkeypatch, tmp_path):
+    monkeypatch.setattr("regress_stack.core.utils.REGRESS_STACK_DIR", tmp_path)
+    with patch(
+        "regress_stack.core.plan.build_dependency_graph", return_value=mock_graph
+    ) as build:
+        yield ExecutionPlan.build(mock_modules)
+    build.assert_called_once_with(mock_modules)
+
+
+def test_order(execution_plan):
+    names = [mod.name.rsplit(".")[-1] for mod in execution_plan.order()]
+    assert names == ["utils", "mysql", "keystone", "heat"]
+    names = [mod.name.rsplit(".")[-1] for mod in execution_plan.order("keystone")]
+    assert names == ["utils", "mysql", "keystone"]
+    assert execution_plan.order("utils") == [execution_plan.utils]
+    with pytest.raises(RuntimeError):
+        execution_plan.order("nova")
+
+
+def test_order_targets(execution_plan):
+    names = [
+        mod.name.rsplit(".")[-1]
+        for mod in execution_plan.order(["keystone", "heat", "utils"])
+    ]
+    assert names == ["utils", "mysql", "keystone", "heat"]
+    names = [mod.name.rsplit(".")[-1] for mod in execution_plan.order(["mysql"])]
+    assert names == ["utils", "mysql"]
+
+
+def test_metadata(execution_plan):
+    assert execution_plan.metadata["regress_stack.modules.heat"] == ModuleMetadata(
+        path="/fake/path/heat.py",
+        packages=["heat-api"],
+        test_include_regexes=["heat_tempest_plugin"],
+        test_exclude_regexes=["aodh"],
+        hooks=["setup", "configure_tempest"],
+    )
+    assert execution_plan.metadata["regress_stack.modules.utils"].logs == [
+        "/var/log/apache2/"
+    ]
+
+
+def test_mark_setup(execution_plan, tmp_path):
+    assert not execution_plan.is_setup_done("regress_stack.modules.mysql")
+    execution_plan.mark_setup("regress_stack.modules.mysql")
+    assert execution_plan.is_setup_done("regress_stack.modules.mysql")
+    assert (tmp_path / "regress_stack.modules.mysql.setup").exists()
+    execution_plan.clear_setup("regress_stack.modules.mysql")
+    assert not execution_plan.is_setup_done("regress_stack.modules.mysql")
+    assert not (tmp_path / "regress_stack.modules.mysql.setup").exists()
+
+
+def test_reset_order(execution_plan):
+    for name in ("utils", "mysql", "keystone", "heat"):
+        execution_plan.mark_setup("regress_stack.modules." + name)
+
+    def names(mods):
+        return [mod.name.rsplit(".")[-1] for mod in mods]
+
+    # Dependents go with the target, dependencies are kept
+    assert names(execution_plan.reset_order("keystone")) == ["keystone", "heat"]
+    assert names(execution_plan.reset_order(["heat"])) == ["heat"]
+    assert names(execution_plan.reset_order()) == ["utils", "mysql", "keystone", "heat"]
+    execution_plan.clear_setup("regress_stack.modules.heat")
+    assert names(execution_plan.reset_order("mysql")) == ["mysql", "keystone"]
+    with pytest.raises(RuntimeError):
+        execution_plan.reset_order("nova")
+
+
+def test_save_load(execution_plan, tmp_path):
+    execution_plan.mark_setup("regress_stack.modules.mysql")
+    path = execution_plan.save(tmp_path / "plan.json")
+
+    loaded = ExecutionPlan.load(path)
+
+    assert loaded.order() == execution_plan.order()
+    assert loaded.order("keystone") == execution_plan.order("keystone")
+    assert loaded.metadata == execution_plan.metadata
+    assert loaded.is_setup_done("regress_stack.modules.mysql")
+    assert not loaded.is_setup_done("regress_stack.modules.heat")
+
+
+def test_get_plan_is_built_once(mock_modules, mock_graph, monkeypatch, tmp_path):
+    monkeypatch.setattr(plan, "_PLAN", None)
+    monkeypatch.setattr(plan, "PLAN_PATH", tmp_path / "plan.json")
+    with patch(
+        "regress_stack.core.plan.build_dependency_graph", return_value=mock_graph
+    ) as build:
+        first = plan.get_plan(mock_modules)
+        assert plan.get_plan(mock_modules, from_saved=True) is first
+    build.assert_called_once()
+
+
+def test_get_plan_after_package_changes(
+    mock_modules, mock_graph, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(plan, "_PLAN", None)
+    monkeypatch.setattr(plan, "PLAN_PATH", tmp_path / "plan.json")
+    mtime = [1.0]
+    monkeypatch.setattr(plan.apt, "status_mtime", lambda: mtime[0])
+    with patch(
+        "regress_stack.core.plan.build_dependency_graph", return_value=mock_graph
+    ) as build:
+        first = plan.get_plan(mock_modules)
+        assert plan.get_plan(mock_modules) is first
+        mtime[0] = 2.0
+        assert plan.get_plan(mock_modules) is not first
+    assert build.call_count == 2
+
+
+def test_affected_modules(execution_plan):
+    previous = {
+        "regress_stack.modules.utils": {"crudini": "0.9.5"},
+        "regress_stack.modules.mysql": {"mysql-server": "8.0"},
+        "regress_stack.modules.keystone": {"keystone": "2:26.0.0"},
+        "regress_stack.modules.heat": {"heat-api": "1:23.0.0"},
+    }
+    assert execution_plan.affected_modules(previous, previous) == set()
+
+    current = dict(previous, **{"regress_stack.modules.keystone": {"keystone": None}})
+    assert execution_plan.affected_modules(previous, current) == {
+        "regress_stack.modules.keystone",
+        "regress_stack.modules.heat",
+    }
+
+    current = dict(previous, **{"regress_stack.modules.utils": {"crudini": "0.9.6"}})
+    assert execution_plan.affected_modules(previous, current) == set(current)
+
+
+def test_green_run(execution_plan, tmp_path):
+    assert plan.load_green_run(tmp_path / "green-run.json") is None
+    with patch("regress_stack.core.apt.pkg_versions", return_value={"pkg": "1.0"}):
+        versions = execution_plan.package_versions()
+    assert versions["regress_stack.modules.heat"] == {"pkg": "1.0"}
+    plan.save_green_run(versions, tmp_path / "green-run.json")
+    assert plan.load_green_run(tmp_path / "green-run.json") == versions
+
+    plan.forget_green_run(["regress_stack.modules.heat"], tmp_path / "green-run.json")
+    del versions["regress_stack.modules.heat"]
+    assert plan.load_green_run(tmp_path / "green-run.json") == versions
+
+
+def test_green_run_setup_only(execution_plan):
+    execution_plan.mark_setup("regress_stack.modules.utils")
+    execution_plan.mark_setup("regress_stack.modules.mysql")
+    with patch("regress_stack.core.apt.pkg_versions", return_value={"pkg": "1.0"}):
+        previous = execution_plan.package_versions(setup_only=True)
+        assert set(previous) == {
+            "regress_stack.modules.utils",
+            "regress_stack.modules.mysql",
+        }
+        # Set up after the green run, with the same packages
+        execution_plan.mark_setup("regress_stack.modules.keystone")
+        current = execution_plan.package_versions(setup_only=True)
+    assert execution_plan.affected_modules(previous, current) == {
+        "regress_stack.modules.keystone",
+        "regress_stack.modules.heat",
+    }
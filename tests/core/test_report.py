@@ -0,0 +1,160 @@
+import datetime
+import io
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from regress_stack.core import report
+
+RESULTS = [
+    report.TestResult(
+        "tempest.api.compute.test_servers.Test.test_boot[id-1,smoke]",
+        "success",
+        3.0,
+        "nova",
+    ),
+    report.TestResult(
+        "heat_tempest_plugin.tests.test_stack.Test.test_create",
+        "fail",
+        7.0,
+        "heat",
+        "Traceback: boom",
+    ),
+    report.TestResult(
+        "heat_tempest_plugin.tests.test_aodh.Test.test_alarm", "skip", 0.0, "other"
+    ),
+    report.TestResult(
+        "tempest.api.identity.test_users.Test.test_list", "success", 1.0, "other"
+    ),
+]
+
+
+def _stream(*tests):
+    """Encode (test_id, status, seconds) tuples as a subunit v2 stream."""
+    # Only parsing the stream needs subunit
+    subunit = pytest.importorskip("subunit")
+    output = io.BytesIO()
+    writer = subunit.StreamResultToBytes(output)
+    start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    for test_id, status, seconds in tests:
+        writer.status(test_id=test_id, test_status="inprogress", timestamp=start)
+        if status == "fail":
+            writer.status(
+                test_id=test_id,
+                file_name="traceback",
+                file_bytes=b"Traceback: boom",
+                mime_type="text/plain",
+            )
+        writer.status(
+            test_id=test_id,
+            test_status=status,
+            timestamp=start + datetime.timedelta(seconds=seconds),
+        )
+    output.seek(0)
+    return output
+
+
+@pytest.fixture
+def results():
+    return list(RESULTS)
+
+
+def test_collect():
+    attribution = report.Attribution(
+        [
+            ("heat", ["heat_tempest_plugin"], ["aodh"]),
+            ("nova", ["tempest.api.compute"], []),
+        ]
+    )
+    progress = []
+    collector = report.ResultCollector(attribution, progress=progress.append)
+    report.read_subunit(
+        _stream(*((result.id, result.status, result.duration) for result in RESULTS)),
+        collector,
+    )
+    assert progress == collector.results
+    assert collector.results == RESULTS
+
+
+def test_summary(results):
+    summary = report.summary(results, top=2)
+    assert summary["tests"] == 4
+    assert summary["statuses"] == {"success": 2, "fail": 1, "skip": 1}
+    assert [test["duration"] for test in summary["slowest_tests"]] == [7.0, 3.0]
+    assert [module["module"] for module in summary["slowest_modules"]] == [
+        "heat",
+        "nova",
+        "other",
+    ]
+    assert summary["slowest_modules"][0]["failures"] == 1
+
+
+def test_write_reports(results, tmp_path):
+    report.write_json(results, tmp_path / "report.json")
+    assert len(json.loads((tmp_path / "report.json").read_text())["results"]) == 4
+
+    report.write_junit(results, tmp_path / "report.xml")
+    suite = ET.parse(tmp_path / "report.xml").getroot()
+    assert suite.get("failures") == "1"
+    case = suite.find("testcase")
+    assert case.get("classname") == "tempest.api.compute.test_servers.Test"
+    assert case.get("name") == "test_boot"
+    assert suite.find("testcase/failure").text == "Traceback: boom"
+
+
+def test_select_canary():
+    tests = [
+        "tempest.api.compute.flavors.test_flavors.FlavorsV2TestJSON.test_list_flavors[id-1]",
+        "tempest.api.compute.test_servers.Test.test_boot[id-2,smoke]",
+        "tempest.api.network.test_networks.NetworksTest.test_create[id-3]",
+    ]
+    assert report.select_canary(
+        tests, [r"\.test_list_flavors\b"], failed=[tests[2], "tempest.removed"]
+    ) == [tests[0], tests[2]]
+
+
+def test_save_load_failed(results, tmp_path):
+    assert report.load_failed(tmp_path / "failed.txt") == []
+    report.save_failed(results, tmp_path / "failed.txt")
+    assert report.load_failed(tmp_path / "failed.txt") == [
+        "heat_tempest_plugin.tests.test_stack.Test.test_create"
+    ]
+
+
+def test_retry_failed(results):
+    failed_id = "heat_tempest_plugin.tests.test_stack.Test.test_create"
+    runs = []
+
+    def run(test_id):
+        runs.append(test_id)
+        status = "success" if len(runs) == 2 else "fail"
+        return [report.TestResult(test_id, status, 1.0, "heat")]
+
+    retried = report.retry_failed(results, run, retries=3)
+    assert runs == [failed_id, failed_id]
+    assert retried[0] is results[0]
+    assert (retried[1].status, retried[1].attempts) == ("success", 3)
+    assert retried[1].flaky
+    assert retried[1].details == "Traceback: boom"
+    assert report.summary(retried)["flaky"] == [failed_id]
+
+    runs.clear()
+    retried = report.retry_failed(results, lambda test_id: run(test_id)[:0], 3)
+    assert runs == [failed_id]
+    assert retried[1] is results[1]
+
+    retried = report.retry_failed(results, lambda test_id: [], retries=0)
+    assert report.summary(retried)["failures"] == [failed_id]
+    assert not any(result.flaky for result in retried)
+
+
+def test_run_problems(results):
+    tests = [result.id for result in results]
+    assert report.run_problems(tests, results, 1) == []
+    assert report.run_problems(tests[:1], results[:1], 0) == []
+    # Stopped before the last tests, without failures
+    assert report.run_problems(tests, results[:1], 1) == [
+        f"3 tests without a result, e.g. {tests[1]}",
+        "exit code 1 without a failed test",
+    ]
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from regress_stack.core import resources
+
+
+def _unit(root, path, usage_usec=0, memory=0, io=""):
+    cgroup = root / path
+    cgroup.mkdir(parents=True)
+    (cgroup / "cpu.stat").write_text(f"usage_usec {usage_usec}\nuser_usec 0\n")
+    (cgroup / "memory.current").write_text(f"{memory}\n")
+    (cgroup / "io.stat").write_text(io)
+    return cgroup
+
+
+@pytest.fixture
+def cgroup_root(tmp_path):
+    root = tmp_path / "system.slice"
+    _unit(root, "nova-api.service")
+    _unit(root, "cron.service")
+    _unit(root, "system-ceph\\x2dosd.slice/ceph-osd@0.service")
+    return root
+
+
+def test_find_units(cgroup_root):
+    units = resources.find_units(["nova-*", "ceph-osd@*"], cgroup_root)
+    assert sorted(units) == ["ceph-osd@0", "nova-api"]
+    assert units["ceph-osd@0"].parent.name == "system-ceph\\x2dosd.slice"
+
+
+def test_read_sample(tmp_path):
+    cgroup = _unit(
+        tmp_path,
+        "mysql.service",
+        usage_usec=1500,
+        memory=4096,
+        io="8:0 rbytes=10 wbytes=20 rios=1 wios=2\n8:16 rbytes=1 wbytes=2\n",
+    )
+    assert resources.read_sample(cgroup) == {
+        "cpu_usec": 1500,
+        "memory": 4096,
+        "io_read": 11,
+        "io_write": 22,
+    }
+
+
+def test_sampler(tmp_path, cgroup_root, monkeypatch):
+    series = tmp_path / "series.jsonl"
+    summary = tmp_path / "summary.json"
+    sampler = resources.Sampler(["nova-api"], series, summary, root=cgroup_root)
+    cgroup = cgroup_root / "nova-api.service"
+    with series.open("w") as output:
+        for timestamp, usage, memory in ((10.0, 0, 100), (12.0, 1_000_000, 300)):
+            (cgroup / "cpu.stat").write_text(f"usage_usec {usage}\n")
+            (cgroup / "memory.current").write_text(f"{memory}\n")
+            monkeypatch.setattr(resources.time, "time", lambda: timestamp)
+            sampler.sample(output)
+    monkeypatch.undo()
+    # Samples once more, then writes the summary
+    sampler.start()
+    sampler.stop()
+
+    lines = [json.loads(line) for line in series.read_text().splitlines()]
+    assert lines[0] == {
+        "time": 10.0,
+        "units": {
+            "nova-api": {"cpu_usec": 0, "memory": 100, "io_read": 0, "io_write": 0}
+        },
+    }
+    nova = json.loads(summary.read_text())["nova-api"]
+    assert nova["memory_peak"] == 300
+    assert nova["cpu_seconds"] == 1.0
+    assert nova["samples"] == 3
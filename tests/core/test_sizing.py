@@ -0,0 +1,92 @@
+import pytest
+
+from regress_stack.core import sizing
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(sizing, "SETTINGS_PATH", tmp_path / "sizing.json")
+    monkeypatch.setattr(sizing, "_PROFILE", sizing.DEFAULT_PROFILE)
+    monkeypatch.setattr(sizing, "_STORAGE", None)
+    return tmp_path / "sizing.json"
+
+
+@pytest.mark.parametrize(
+    "profile, cores, memory_gib, expected",
+    [
+        ("minimal", 64, 256, sizing.Sizing(1, 1, 1)),
+        ("ci", 2, 8, sizing.Sizing(1, 1, 5)),
+        ("ci", 16, 64, sizing.Sizing(2, 2, 5)),
+        ("perf", 16, 64, sizing.Sizing(8, 8, 10)),
+        # Bounded by memory
+        ("perf", 64, 24, sizing.Sizing(4, 4, 10)),
+    ],
+)
+def test_compute(profile, cores, memory_gib, expected):
+    assert sizing.compute(profile, cores, memory_gib) == expected
+
+
+def test_unknown_profile():
+    with pytest.raises(RuntimeError):
+        sizing.set_profile("huge")
+
+
+def test_profile_is_kept(settings):
+    sizing.set_profile()
+    assert sizing._PROFILE == sizing.DEFAULT_PROFILE
+    sizing.set_profile("ci")
+    sizing.set_profile()
+    assert sizing._PROFILE == "ci"
+    sizing.set_profile("perf")
+    assert sizing._PROFILE == "perf"
+
+
+@pytest.mark.parametrize(
+    "ephemeral, memory_gib, expected",
+    [
+        (False, 4, sizing.Storage(False, 0, 2)),
+        (True, 64, sizing.Storage(True, 2, 2)),
+        # OSDs shrink to fit
+        (True, 12, sizing.Storage(True, 2, 1)),
+    ],
+)
+def test_compute_storage(ephemeral, memory_gib, expected):
+    assert sizing.compute_storage(ephemeral, memory_gib) == expected
+
+
+def test_ephemeral_insufficient_memory(monkeypatch):
+    monkeypatch.setattr(sizing, "host_resources", lambda: (4, 8.0))
+    with pytest.raises(RuntimeError, match="needs 11 GiB"):
+        sizing.set_ephemeral(True)
+    assert not sizing.storage().ephemeral
+
+
+def test_ephemeral_is_kept(monkeypatch):
+    monkeypatch.setattr(sizing, "host_resources", lambda: (4, 12.0))
+    sizing.set_ephemeral()
+    assert not sizing.storage().ephemeral
+    sizing.set_ephemeral(True)
+    assert sizing.storage() == sizing.Storage(True, 2, 1)
+    # Sized for the memory when selected, not for the memory now free
+    monkeypatch.setattr(sizing, "host_resources", lambda: (4, 64.0))
+    monkeypatch.setattr(sizing, "_STORAGE", None)
+    assert sizing.storage() == sizing.Storage(True, 2, 1)
+    sizing.set_ephemeral()
+    assert sizing.storage() == sizing.Storage(True, 2, 1)
+
+
+def test_ephemeral_turned_off(monkeypatch, settings):
+    monkeypatch.setattr(sizing, "host_resources", lambda: (4, 12.0))
+    sizing.set_ephemeral(True)
+    monkeypatch.setattr(sizing.utils, "tmpfs_mounts", lambda: ["/tmpfs/mysql"])
+    with pytest.raises(RuntimeError, match="still mounted on /tmpfs/mysql"):
+        sizing.set_ephemeral(False)
+    assert sizing.storage().ephemeral
+    # After a reboot
+    monkeypatch.setattr(sizing.utils, "tmpfs_mounts", lambda: [])
+    sizing.set_ephemeral(False)
+    assert not sizing.storage().ephemeral
+    sizing.set_ephemeral()
+    assert not sizing.storage().ephemeral
+    monkeypatch.setattr(sizing, "_STORAGE", None)
+    assert not sizing.storage().ephemeral
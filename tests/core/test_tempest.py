@@ -0,0 +1,43 @@
+import types
+
+from regress_stack.core import tempest
+
+ENDPOINTS = [
+    types.SimpleNamespace(
+        service_id="abc", interface="public", region_id="RegionOne", url="http://a"
+    ),
+    types.SimpleNamespace(
+        service_id="def", interface="admin", region_id="RegionOne", url="http://d"
+    ),
+]
+VERSIONS = {"regress_stack.modules.keystone": {"keystone": "2:26.0.0"}}
+
+
+def test_workspace_fingerprint():
+    fingerprint = tempest.workspace_fingerprint(ENDPOINTS, VERSIONS, ["--create"])
+    assert fingerprint == tempest.workspace_fingerprint(
+        reversed(ENDPOINTS), VERSIONS, ["--create"]
+    )
+    assert fingerprint != tempest.workspace_fingerprint(
+        ENDPOINTS[:1], VERSIONS, ["--create"]
+    )
+    assert fingerprint != tempest.workspace_fingerprint(ENDPOINTS, {}, ["--create"])
+    assert fingerprint != tempest.workspace_fingerprint(ENDPOINTS, VERSIONS, [])
+
+
+def test_is_current(tmp_path):
+    assert not tempest.is_initialized(tmp_path)
+    (tmp_path / ".stestr.conf").touch()
+    assert tempest.is_initialized(tmp_path)
+
+    tempest.save_fingerprint(tmp_path, "abc")
+    # No configuration generated yet
+    assert not tempest.is_current(tmp_path, "abc")
+    (tmp_path / "etc").mkdir()
+    (tmp_path / "etc" / "tempest.conf").touch()
+    assert tempest.is_current(tmp_path, "abc")
+    assert not tempest.is_current(tmp_path, "def")
+
+    tempest.clear_fingerprint(tmp_path)
+    assert not tempest.is_current(tmp_path, "abc")
+    tempest.clear_fingerprint(tmp_path)
@@ -0,0 +1,142 @@
+import subprocess
+from unittest.mock import patch
+
+import pytest
+
+from regress_stack.core import utils
+from regress_stack.modules import utils as module_utils
+
+
+@pytest.fixture
+def fingerprints(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "REGRESS_STACK_DIR", tmp_path)
+    monkeypatch.setattr(utils, "CONFIG_FINGERPRINTS", tmp_path / "fingerprints.json")
+    monkeypatch.setattr(utils, "_PENDING_FINGERPRINTS", {})
+    return tmp_path
+
+
+def test_cfg_set_skips_applied_config(fingerprints):
+    conf = fingerprints / "service.conf"
+    conf.write_text("[DEFAULT]\n")
+    options = [("DEFAULT", "debug", "true"), ("database", "max_pool_size", "1")]
+
+    with patch.object(utils, "run") as run:
+        assert module_utils.cfg_set(str(conf), *options) is True
+        # Not recorded until the module setup completes
+        assert module_utils.cfg_set(str(conf), *options) is True
+        utils.mark_setup("service")
+        assert module_utils.cfg_set(str(conf), *options) is False
+        assert module_utils.cfg_set(str(conf), ("DEFAULT", "debug", "false"))
+    run.assert_called_with(
+        "crudini",
+        ["--merge", str(conf)],
+        input="[DEFAULT]\ndebug = false\n",
+    )
+    assert run.call_count == 3
+
+
+def test_cfg_set_reapplies_modified_file(fingerprints):
+    conf = fingerprints / "service.conf"
+    conf.write_text("[DEFAULT]\n")
+    with patch.object(utils, "run") as run:
+        module_utils.cfg_set(str(conf), ("DEFAULT", "debug", "true"))
+        utils.mark_setup("service")
+        conf.write_text("[DEFAULT]\ndebug = false\n")
+        assert module_utils.cfg_set(str(conf), ("DEFAULT", "debug", "true"))
+    assert run.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "changed, active, restarted",
+    [(True, True, True), (False, True, False), (False, False, True)],
+)
+def test_restart_service(changed, active, restarted):
+    with patch.object(utils, "run") as run:
+        with patch.object(utils, "service_active", return_value=active):
+            assert utils.restart_service("glance-api", changed) == restarted
+    assert run.called == restarted
+
+
+def test_file_sub(tmp_path):
+    conf = tmp_path / "keystone.conf"
+    conf.write_text("WSGIDaemonProcess keystone-public processes=5 threads=1\n")
+    pattern = r"keystone-public processes=\d+"
+    assert module_utils.file_sub(str(conf), pattern, "keystone-public processes=2")
+    assert not module_utils.file_sub(str(conf), pattern, "keystone-public processes=2")
+    assert (
+        conf.read_text() == "WSGIDaemonProcess keystone-public processes=2 threads=1\n"
+    )
+
+
+@pytest.fixture
+def run_cache(monkeypatch):
+    monkeypatch.setattr(utils, "_RUN_CACHE", {})
+    monkeypatch.setattr(utils, "_RUN_CACHE_GENERATION", {})
+    completed = []
+
+    def fake_run(cmd_args, **kwargs):
+        completed.append(cmd_args)
+        return subprocess.CompletedProcess(cmd_args, 0, f"out{len(completed)}", "")
+
+    monkeypatch.setattr(utils.subprocess, "run", fake_run)
+    return completed
+
+
+def test_run_cache_domain(run_cache):
+    query = ["list_users", "--formatter", "json"]
+    assert utils.run("rabbitmqctl", query, cache_domain="rabbitmq") == "out1"
+    assert utils.run("rabbitmqctl", query, cache_domain="rabbitmq") == "out1"
+    # Other domains are left alone
+    utils.run("mysql", ["-e", "CREATE DATABASE nova;"])
+    assert utils.run("rabbitmqctl", query, cache_domain="rabbitmq") == "out1"
+    utils.run("rabbitmqctl", ["add_user", "nova", "secret"])
+    assert utils.run("rabbitmqctl", query, cache_domain="rabbitmq") == "out4"
+    assert len(run_cache) == 4
+
+
+@pytest.mark.parametrize("domain", ["rabbitmq", None])
+def test_run_cache_invalidated_while_running(run_cache, monkeypatch, domain):
+    query = ["list_users", "--formatter", "json"]
+    fake_run = utils.subprocess.run
+
+    def concurrent_change(cmd_args, **kwargs):
+        # Another thread changes the domain while the query runs
+        utils.invalidate_cache(domain)
+        return fake_run(cmd_args, **kwargs)
+
+    monkeypatch.setattr(utils.subprocess, "run", concurrent_change)
+    assert utils.run("rabbitmqctl", query, cache_domain="rabbitmq") == "out1"
+    monkeypatch.setattr(utils.subprocess, "run", fake_run)
+    assert utils.run("rabbitmqctl", query, cache_domain="rabbitmq") == "out2"
+    assert utils.run("rabbitmqctl", query, cache_domain="rabbitmq") == "out2"
+
+
+def test_sudo_invalidates_cache_domain(run_cache):
+    list_cells = ["cell_v2", "list_cells"]
+    utils.sudo("nova-manage", list_cells, user="nova", cache_domain="nova")
+    utils.sudo("nova-manage", list_cells, user="nova", cache_domain="nova")
+    utils.sudo("nova-manage", ["cell_v2", "create_cell"], user="nova")
+    utils.sudo("nova-manage", list_cells, user="nova", cache_domain="nova")
+    assert len(run_cache) == 3
+
+
+def test_move_to_tmpfs(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "TMPFS_DIR", tmp_path / "tmpfs")
+    data = tmp_path / "mysql"
+    with patch.object(utils, "run") as run:
+        assert utils.move_to_tmpfs(data, 2048)
+    mountpoint = tmp_path / "tmpfs" / "mysql"
+    assert [call.args for call in run.call_args_list] == [
+        ("mount", ["-t", "tmpfs", "-o", "size=2048m", "tmpfs", str(mountpoint)]),
+        ("cp", ["-a", str(data), str(mountpoint)]),
+        ("mount", ["--bind", str(mountpoint / "mysql"), str(data)]),
+    ]
+    # Not mounted, as run was mocked
+    assert utils.tmpfs_mounts() == []
+    with patch.object(utils.pathlib.Path, "is_mount", return_value=True):
+        assert utils.tmpfs_mounts() == [mountpoint]
+
+    with patch.object(utils, "run") as run:
+        with patch.object(utils.pathlib.Path, "is_mount", return_value=True):
+            assert not utils.move_to_tmpfs(data, 2048)
+    run.assert_not_called()
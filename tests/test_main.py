@@ -0,0 +1,126 @@
+import threading
+import types
+from unittest.mock import patch
+
+import networkx as nx
+import pytest
+
+from regress_stack import __main__ as main
+from regress_stack.core import firewall, tempest
+from regress_stack.core.metadata import ModuleMetadata
+from regress_stack.core.modules import ModuleComp
+from regress_stack.core.plan import ExecutionPlan
+
+
+def _comp(name: str, **metadata) -> ModuleComp:
+    return ModuleComp(
+        "regress_stack.modules." + name,
+        ModuleMetadata(path=f"/fake/path/{name}.py", **metadata),
+    )
+
+
+@pytest.fixture
+def execution(monkeypatch, tmp_path):
+    monkeypatch.setattr("regress_stack.core.utils.REGRESS_STACK_DIR", tmp_path)
+    comps = {
+        "mysql": _comp("mysql", hooks=["setup", "teardown"]),
+        "keystone": _comp("keystone", hooks=["setup", "teardown"]),
+        "glance": _comp("glance", hooks=["setup", "teardown"]),
+        "heat": _comp("heat", hooks=["setup", "teardown", "nat_rules"]),
+    }
+    graph = nx.DiGraph()
+    for comp in comps.values():
+        graph.add_node(comp, installed=True)
+    graph.add_edge(comps["mysql"], comps["keystone"], optional=False)
+    graph.add_edge(comps["keystone"], comps["glance"], optional=False)
+    graph.add_edge(comps["keystone"], comps["heat"], optional=False)
+    names = [comp.name for comp in comps.values()]
+    for name in names:
+        (tmp_path / (name + ".setup")).touch()
+    return ExecutionPlan(graph, _comp("utils"), setup_done=names)
+
+
+@pytest.fixture
+def torn_down():
+    """Replace the modules by fakes recording their teardowns in order."""
+    calls = []
+    lock = threading.Lock()
+    rule = firewall.NatRule("POSTROUTING", "10.0.0.0/24", "heat")
+
+    def load_module(name, path=None):
+        def teardown():
+            with lock:
+                calls.append(name.rsplit(".")[-1])
+
+        return types.SimpleNamespace(teardown=teardown, nat_rules=lambda: [rule])
+
+    with patch("regress_stack.core.modules.load_module", side_effect=load_module):
+        yield calls
+
+
+def test_reset(execution, torn_down, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    workspace = tmp_path / main.TEMPEST_WORKSPACE
+    workspace.mkdir()
+    tempest.save_fingerprint(workspace, "fingerprint")
+    with patch.object(main, "execution_plan", return_value=execution):
+        with patch.object(ExecutionPlan, "save") as save:
+            with patch("regress_stack.core.plan.forget_green_run") as forget:
+                with patch("regress_stack.core.firewall.remove") as remove:
+                    main.reset(["keystone"])
+
+    # Dependents first, the dependencies of keystone are kept
+    assert len(torn_down) == 3
+    assert torn_down[-1] == "keystone"
+    assert set(torn_down[:2]) == {"glance", "heat"}
+    reset = {"regress_stack.modules." + name for name in torn_down}
+    for mod in execution.graph.nodes:
+        assert execution.is_setup_done(mod.name) == (mod.name not in reset)
+        assert (tmp_path / (mod.name + ".setup")).exists() == (mod.name not in reset)
+    assert list(remove.call_args.args[0]) == [
+        firewall.NatRule("POSTROUTING", "10.0.0.0/24", "heat")
+    ]
+    assert set(forget.call_args.args[0]) == reset
+    assert not (workspace / tempest.FINGERPRINT_FILE).exists()
+    save.assert_called_once_with()
+
+
+def test_reset_failed_teardown(execution):
+    torn_down = []
+
+    def fail():
+        raise RuntimeError("teardown failed")
+
+    def load_module(name, path=None):
+        if name.endswith("glance"):
+            return types.SimpleNamespace(teardown=fail)
+        return types.SimpleNamespace(teardown=lambda: torn_down.append(name))
+
+    with patch.object(main, "execution_plan", return_value=execution):
+        with patch.object(ExecutionPlan, "save") as save:
+            with patch(
+                "regress_stack.core.modules.load_module", side_effect=load_module
+            ):
+                with patch("regress_stack.core.firewall.remove") as remove:
+                    with pytest.raises(RuntimeError, match="teardown failed"):
+                        main.reset(["keystone"])
+
+    # keystone waits for glance, whose teardown failed
+    assert "regress_stack.modules.keystone" not in torn_down
+    assert execution.is_setup_done("regress_stack.modules.keystone")
+    assert execution.is_setup_done("regress_stack.modules.glance")
+    remove.assert_not_called()
+    save.assert_called_once_with()
+
+
+@pytest.mark.parametrize("value", ["0", "-2", "two"])
+@pytest.mark.parametrize("option", ["--iterations", "--concurrency"])
+def test_bench_requires_positive_counts(option, value, capsys):
+    with pytest.raises(SystemExit):
+        main.build_parser().parse_args(["bench", option, value])
+    assert "expected a positive integer" in capsys.readouterr().err
+
+
+def test_bench_counts():
+    args = main.build_parser().parse_args(["bench", "--concurrency", "8"])
+    assert (args.iterations, args.concurrency) == (20, 8)